@@ -0,0 +1,101 @@
+"""
+碰撞预警基准测试 - 两两最近接近距离 / TTC 的单次全量计算耗时
+对比 NumPy 向量化与逐对 Python 循环，并给出占广播周期的比例
+
+用法: python benchmarks/bench_collision.py [--cars 4 50 500] [--number 200] [--interval 0.07]
+"""
+
+import argparse
+import math
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collision import CollisionMonitor, closest_approach
+
+ARENA = 6.0  # 场地半宽（米），与仪表盘坐标范围一致
+MAX_SPEED = 0.5  # 随机速度上限（米/秒）
+PYTHON_LOOP_MAX_CARS = 100  # 逐对循环只在较小规模下运行
+
+
+def random_fleet(count, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-ARENA, ARENA, count)
+    y = rng.uniform(-ARENA, ARENA, count)
+    vx = rng.uniform(-MAX_SPEED, MAX_SPEED, count)
+    vy = rng.uniform(-MAX_SPEED, MAX_SPEED, count)
+    return x, y, vx, vy
+
+
+def python_pairs(x, y, vx, vy, radius, horizon):
+    """逐对计算的参考实现（与 closest_approach 公式相同）"""
+    result = []
+    count = len(x)
+    r2 = radius * radius
+    for i in range(count):
+        for j in range(i + 1, count):
+            px, py = x[j] - x[i], y[j] - y[i]
+            rvx, rvy = vx[j] - vx[i], vy[j] - vy[i]
+            p2 = px * px + py * py
+            v2 = rvx * rvx + rvy * rvy
+            pv = px * rvx + py * rvy
+            ttc = math.inf
+            if p2 <= r2:
+                ttc = 0.0
+            elif v2 > 1e-12 and pv < 0:
+                discriminant = pv * pv - v2 * (p2 - r2)
+                if discriminant >= 0:
+                    ttc = (-pv - math.sqrt(discriminant)) / v2
+            t_min = min(max(-pv / v2, 0.0), horizon) if v2 > 1e-12 else 0.0
+            result.append((math.hypot(px + rvx * t_min, py + rvy * t_min), ttc))
+    return result
+
+
+def bench(label, func, number):
+    seconds = timeit.timeit(func, number=number)
+    per_call_ms = seconds / number * 1000
+    print(f"  {label:<28} {per_call_ms:9.3f} ms/次")
+    return per_call_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="碰撞预警基准测试")
+    parser.add_argument('--cars', type=int, nargs='+', default=[4, 50, 500], help="小车数量（可多个）")
+    parser.add_argument('--number', type=int, default=200, help="每项测试的调用次数")
+    parser.add_argument('--interval', type=float, default=0.07, help="广播周期（秒），用于计算占用比例")
+    args = parser.parse_args()
+
+    monitor = CollisionMonitor()
+    for count in args.cars:
+        x, y, vx, vy = random_fleet(count)
+        ids = [f"CAR{i + 1}" for i in range(count)]
+        pairs = count * (count - 1) // 2
+        print(f"{count} 辆小车（{pairs} 对）:")
+
+        number = max(10, args.number * 50 // max(count, 50))
+        numpy_ms = bench("NumPy closest_approach",
+                         lambda: closest_approach(x, y, vx, vy, monitor.radius, monitor.horizon), number)
+        evaluate_ms = bench("CollisionMonitor.evaluate", lambda: monitor.evaluate(ids, x, y, vx, vy), number)
+        print(f"  预警 {monitor.stats['warnings']} 对, evaluate 占广播周期 {evaluate_ms / (args.interval * 1000):.1%}")
+
+        if count <= PYTHON_LOOP_MAX_CARS:
+            xs, ys, vxs, vys = x.tolist(), y.tolist(), vx.tolist(), vy.tolist()
+            python_ms = bench("Python 逐对循环",
+                              lambda: python_pairs(xs, ys, vxs, vys, monitor.radius, monitor.horizon), number)
+            print(f"  向量化加速 {python_ms / numpy_ms:.1f}x")
+
+            # 结果一致性检查：粗筛保留的组合与逐对结果一致，其余组合的 TTC 均超过 horizon
+            i, j, _, min_distance, _, ttc = closest_approach(x, y, vx, vy, monitor.radius, monitor.horizon)
+            reference = np.array(python_pairs(xs, ys, vxs, vys, monitor.radius, monitor.horizon)).reshape(-1, 2)
+            kept = np.zeros(len(reference), dtype=bool)
+            kept[i * count - i * (i + 1) // 2 + (j - i - 1)] = True
+            assert np.allclose(min_distance, reference[kept, 0]) and np.allclose(ttc, reference[kept, 1])
+            assert np.all(reference[~kept, 1] > monitor.horizon)
+
+
+if __name__ == '__main__':
+    main()
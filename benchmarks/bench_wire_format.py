@@ -0,0 +1,58 @@
+"""
+遥测协议基准测试 - 文本格式 vs 二进制帧
+对比上行解析耗时、下行编码耗时以及报文大小
+
+用法: python benchmarks/bench_wire_format.py [--number 200000] [--cars 4]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_protocol import (parse_telemetry, encode_telemetry, encode_text_fleet_frame,
+                                encode_binary_fleet_frame)
+
+
+def bench(label, func, number):
+    seconds = timeit.timeit(func, number=number)
+    per_call_us = seconds / number * 1e6
+    print(f"  {label:<28} {per_call_us:8.3f} us/次")
+    return per_call_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="遥测协议基准测试")
+    parser.add_argument('--number', type=int, default=200000, help="每项测试的调用次数")
+    parser.add_argument('--cars', type=int, default=4, help="下行广播帧中的小车数量")
+    args = parser.parse_args()
+
+    sample = (1.2345, -2.3456, 123.4, 12.31, 0.1234, -0.0567, 0.0123)
+    text_packet = ("CAR3:" + ",".join(f"{v:.4f}" for v in sample)).encode('utf-8')
+    binary_packet = encode_telemetry(3, 1024, *sample)
+    binary_packet_ts = encode_telemetry(3, 1024, *sample, timestamp=1700000000.123)
+
+    print("上行遥测解析:")
+    text_us = bench("文本 CARx:...", lambda: parse_telemetry(text_packet), args.number)
+    binary_us = bench("二进制帧", lambda: parse_telemetry(binary_packet), args.number)
+    bench("二进制帧（带时间戳）", lambda: parse_telemetry(binary_packet_ts), args.number)
+    print(f"  大小: 文本 {len(text_packet)} B, 二进制 {len(binary_packet)} B, "
+          f"带时间戳 {len(binary_packet_ts)} B, 解析加速 {text_us / binary_us:.1f}x")
+
+    x, y, yaw, _, vx, vy, vz = sample
+    text_entries = [(f"C{i + 1}", x, y, yaw, vx, vy, vz) for i in range(args.cars)]
+    binary_entries = [(i + 1, x, y, yaw, vx, vy, vz) for i in range(args.cars)]
+
+    print(f"下行广播编码（{args.cars} 辆小车）:")
+    text_us = bench("文本 [n C1 ...]",
+                    lambda: encode_text_fleet_frame(text_entries).encode('utf-8'), args.number // 4)
+    binary_us = bench("二进制帧", lambda: encode_binary_fleet_frame(1, binary_entries), args.number // 4)
+    text_size = len(encode_text_fleet_frame(text_entries).encode('utf-8'))
+    binary_size = len(encode_binary_fleet_frame(1, binary_entries))
+    print(f"  大小: 文本 {text_size} B, 二进制 {binary_size} B, 编码加速 {text_us / binary_us:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+指令通道 - 带序列号和确认的指令下发
+每辆小车独立的序列号；开启确认的小车回复 ACK 后停止重传，未确认时按指数退避重传；
+未开启确认的小车（旧固件）保持原有指令格式，按固定间隔盲发多份。重传由调度器驱动，调用线程只发送第一份
+"""
+
+import threading
+import time
+from collections import deque
+
+from server_log import get_logger
+from telemetry_protocol import tag_command
+
+log = get_logger("command")
+
+COMMAND_RETRY_DELAY = 0.03  # 首次重传等待（秒），之后每次翻倍
+COMMAND_RETRY_BACKOFF = 2.0
+COMMAND_MAX_ATTEMPTS = 5  # 含首次发送
+COMMAND_BLIND_DELAY = 0.05  # 旧固件盲发的间隔（秒），不退避
+COMMAND_RECENT_SIZE = 200  # 保留最近完成的指令结果条数
+
+# 指令状态
+PENDING = "pending"  # 等待确认
+ACKED = "acked"  # 已确认
+TIMEOUT = "timeout"  # 重传用尽仍未确认
+SENT = "sent"  # 旧固件：已发送，无法确认
+FAILED = "failed"  # 发送出错
+
+
+class PendingCommand:
+    """一条已发出的指令及其投递状态"""
+
+    __slots__ = ('car_id', 'sequence', 'message', 'payload', 'ack_required', 'broadcast',
+                 'created', 'next_send', 'attempts', 'max_attempts', 'retry_delay',
+                 'completed', 'status')
+
+    def __init__(self, car_id, sequence, message, payload, ack_required, max_attempts, retry_delay,
+                 broadcast=False):
+        self.car_id = car_id
+        self.sequence = sequence
+        self.message = message
+        self.payload = payload
+        self.ack_required = ack_required
+        self.broadcast = broadcast
+        self.created = time.monotonic()
+        self.next_send = self.created + retry_delay
+        self.attempts = 1
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.completed = None
+        self.status = PENDING
+
+    @property
+    def done(self):
+        return self.status != PENDING
+
+    def latency(self):
+        """从首次发送到确认的时间（秒），未确认返回None"""
+        if self.status != ACKED:
+            return None
+        return self.completed - self.created
+
+    def result(self):
+        latency = self.latency()
+        return {
+            'car_id': self.car_id,
+            'seq': self.sequence,
+            'command': self.message if isinstance(self.message, str) else f"<{len(self.message)} bytes>",
+            'status': self.status,
+            'attempts': self.attempts,
+            'latency_ms': round(latency * 1000, 2) if latency is not None else None
+        }
+
+
+class CommandChannel:
+    """
+    send_func(car_id, payload) -> bool 单播到小车；broadcast_func(payload) -> bool 子网广播
+    tick() 由调度器周期调用，负责重传和超时
+    """
+
+    def __init__(self, send_func, broadcast_func):
+        self.send_func = send_func
+        self.broadcast_func = broadcast_func
+        self.ack_mode = "off"  # on：所有小车都要求确认；off：只有 ack_cars 中的小车要求确认
+        self.ack_cars = set()
+        self.sequences = {}  # car_id -> 最近使用的序列号
+        self.pending = {}  # (car_id, sequence) -> PendingCommand
+        self.recent = deque(maxlen=COMMAND_RECENT_SIZE)
+        self._cond = threading.Condition(threading.Lock())
+        self.counters = {
+            'sent': 0,
+            'acked': 0,
+            'timeouts': 0,
+            'failed': 0,
+            'retransmits': 0,
+            'duplicate_acks': 0,
+            'unknown_acks': 0
+        }
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def ack_enabled(self, car_id):
+        return self.ack_mode == "on" or car_id in self.ack_cars
+
+    def _next_sequence(self, car_id):
+        sequence = self.sequences.get(car_id, 0) % 0xFFFF + 1
+        self.sequences[car_id] = sequence
+        return sequence
+
+    def send(self, car_id, message, max_attempts=COMMAND_MAX_ATTEMPTS):
+        """
+        向小车发送指令（只发送第一份，不阻塞），返回 PendingCommand；首次发送失败返回None
+        开启确认的小车附加序列号并在确认前重传；其它小车无法确认，
+        由调度器按 COMMAND_BLIND_DELAY 间隔共发送 max_attempts 份，最后一份发出后标记为已发送
+        """
+        ack_required = self.ack_enabled(car_id)
+        with self._cond:
+            sequence = self._next_sequence(car_id)
+            payload = tag_command(message, sequence) if ack_required else message
+            command = PendingCommand(car_id, sequence, message, payload, ack_required,
+                                     max(max_attempts, 1),
+                                     COMMAND_RETRY_DELAY if ack_required else COMMAND_BLIND_DELAY)
+            # 先登记再发送，避免确认比登记先到
+            if ack_required:
+                self.pending[(car_id, sequence)] = command
+
+        if not self.send_func(car_id, payload):
+            with self._cond:
+                self.pending.pop((car_id, sequence), None)
+                command.status = FAILED
+                self._complete(command)
+            return None
+
+        with self._cond:
+            self.counters['sent'] += 1
+            if not ack_required:
+                self._queue_blind(command)
+        return command
+
+    def broadcast(self, message, car_ids, repeats=5, delay=0.01):
+        """
+        下发全局指令：ack_mode 为 on 时逐车发送带确认的指令（只重传未确认的小车）；
+        否则沿用旧方式子网广播 repeats 次，后续几份由调度器按 delay 间隔发出
+        返回 PendingCommand 列表，全部发送失败时为空
+        """
+        if self.ack_mode == "on":
+            commands = []
+            for car_id in car_ids:
+                command = self.send(car_id, message)
+                if command is not None:
+                    commands.append(command)
+            return commands
+
+        command = self.broadcast_blind(message, repeats, delay)
+        return [command] if command is not None else []
+
+    def broadcast_blind(self, payload, repeats=5, delay=0.01):
+        """
+        子网广播 payload（文本或二进制帧）repeats 次，无需确认；
+        第一份立即发出，其余由调度器按 delay 间隔发出，首次发送失败返回None
+        """
+        if not self.broadcast_func(payload):
+            return None
+        command = PendingCommand(None, None, payload, payload, False, max(repeats, 1), delay,
+                                 broadcast=True)
+        with self._cond:
+            self.counters['sent'] += 1
+            self._queue_blind(command)
+        return command
+
+    def _queue_blind(self, command):
+        """无需确认的指令：还有剩余份数时交给 tick 继续发送，否则直接完成（调用方需持锁）"""
+        if command.attempts < command.max_attempts:
+            self.pending[(None, id(command))] = command
+        else:
+            command.status = SENT
+            self._complete(command)
+
+    def handle_ack(self, car_id, sequence):
+        """处理小车确认（接收线程调用）"""
+        now = time.monotonic()
+        with self._cond:
+            command = self.pending.pop((car_id, sequence), None)
+            if command is None:
+                # 重传与确认交错时会收到重复确认
+                if sequence <= self.sequences.get(car_id, 0):
+                    self.counters['duplicate_acks'] += 1
+                else:
+                    self.counters['unknown_acks'] += 1
+                return None
+            command.status = ACKED
+            command.completed = now
+            self.counters['acked'] += 1
+            latency = now - command.created
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            self._complete(command)
+        log.debug("✅ %s 确认指令 #%d，耗时 %.1fms", car_id, sequence, latency * 1000)
+        return command
+
+    def _complete(self, command):
+        """记录已完成的指令并唤醒等待方（调用方需持锁）"""
+        if command.completed is None:
+            command.completed = time.monotonic()
+        self.recent.append(command)
+        if command.status == FAILED:
+            self.counters['failed'] += 1
+        elif command.status == TIMEOUT:
+            self.counters['timeouts'] += 1
+        self._cond.notify_all()
+
+    def tick(self):
+        """重传到期的指令，重传用尽的标记超时（调度线程调用）"""
+        if not self.pending:
+            return
+
+        now = time.monotonic()
+        due = []
+        with self._cond:
+            for key, command in list(self.pending.items()):
+                if now < command.next_send:
+                    continue
+                if command.attempts >= command.max_attempts:
+                    del self.pending[key]
+                    command.status = TIMEOUT if command.ack_required else SENT
+                    self._complete(command)
+                    if command.ack_required:
+                        log.warning("⚠️ 小车 %s 未确认指令 #%d: %s", command.car_id, command.sequence,
+                                    command.message, extra={'rate_limit': 1.0})
+                    continue
+                command.attempts += 1
+                if command.ack_required:
+                    command.retry_delay *= COMMAND_RETRY_BACKOFF
+                    self.counters['retransmits'] += 1
+                command.next_send = now + command.retry_delay
+                due.append(command)
+
+        # 锁外发送，确认处理不被阻塞
+        for command in due:
+            if command.broadcast:
+                self.broadcast_func(command.payload)
+            else:
+                self.send_func(command.car_id, command.payload)
+
+        # 盲发（旧方式广播、旧固件单播）发完最后一份即完成
+        with self._cond:
+            for command in due:
+                if not command.ack_required and command.attempts >= command.max_attempts:
+                    if self.pending.pop((None, id(command)), None) is not None:
+                        command.status = SENT
+                        self._complete(command)
+
+    def wait(self, commands, timeout):
+        """等待指令全部完成（确认、超时或已发送），最多 timeout 秒，返回是否全部完成"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not all(command.done for command in commands):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            acked = self.counters['acked']
+            return {
+                'ack_mode': self.ack_mode,
+                'ack_cars': sorted(self.ack_cars),
+                'pending': len(self.pending),
+                **self.counters,
+                'latency_mean_ms': self.latency_sum / acked * 1000 if acked else None,
+                'latency_max_ms': self.latency_max * 1000,
+                'recent': [command.result() for command in self.recent]
+            }
@@ -0,0 +1,178 @@
+"""
+指令分发任务 - 后台线程把一批指令扇出给多辆小车
+HTTP 接口提交任务后立即返回任务ID，进度通过 /api/jobs/<id> 查询；
+同一阶段的指令在一个紧凑循环中发给所有小车，并统计首末两车之间的发送和确认时间差。
+各阶段、各任务都在同一个后台线程上依次发出（并非并发），只保证不阻塞提交任务的调用方
+"""
+
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from command_channel import ACKED
+from server_log import get_logger
+
+log = get_logger("dispatch")
+
+JOB_HISTORY_SIZE = 100  # 保留最近的任务数
+
+# 任务状态
+QUEUED = "queued"
+DISPATCHING = "dispatching"
+SENT = "sent"  # 所有指令的第一份已发出，仍有指令等待确认
+COMPLETED = "completed"  # 所有指令已确认、超时或无需确认
+
+
+def _spread_ms(times):
+    if len(times) < 2:
+        return 0.0 if times else None
+    return round((max(times) - min(times)) * 1000, 3)
+
+
+class DispatchJob:
+    """
+    一次分发任务：phases 为若干阶段，每阶段是 [(car_id, message), ...]；
+    阶段按顺序发出，某辆小车前一阶段发送失败时跳过它后续阶段的指令
+    """
+
+    def __init__(self, job_id, kind, phases):
+        self.id = job_id
+        self.kind = kind
+        self.phases = phases
+        self.created = time.time()
+        self.dispatch_started = None
+        self.dispatch_finished = None
+        self.dispatching = False
+        self.commands = [[] for _ in phases]  # 每阶段 [(car_id, PendingCommand 或 None)]
+        self.skipped = [[] for _ in phases]
+
+    @property
+    def car_ids(self):
+        seen = {}
+        for phase in self.phases:
+            for car_id, _ in phase:
+                seen.setdefault(car_id, None)
+        return list(seen)
+
+    def status(self):
+        if self.dispatch_finished is None:
+            return DISPATCHING if self.dispatching else QUEUED
+        for phase in self.commands:
+            for _, command in phase:
+                if command is not None and not command.done:
+                    return SENT
+        return COMPLETED
+
+    def phase_stats(self, index):
+        commands = self.commands[index]
+        sent = [command for _, command in commands if command is not None]
+        acked = [command for command in sent if command.status == ACKED]
+        latencies = [command.latency() for command in acked]
+        return {
+            'sent': len(sent),
+            'failed': sum(1 for _, command in commands if command is None),
+            'skipped': len(self.skipped[index]),
+            'acked': len(acked),
+            'pending': sum(1 for command in sent if not command.done),
+            # 首末两车收到（发出/确认）该阶段指令的时间差
+            'send_spread_ms': _spread_ms([command.created for command in sent]),
+            'ack_spread_ms': _spread_ms([command.completed for command in acked]),
+            'latency_max_ms': round(max(latencies) * 1000, 3) if latencies else None
+        }
+
+    def to_dict(self, details=False):
+        result = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status(),
+            'created': self.created,
+            'cars': len(self.car_ids),
+            'dispatch_ms': (round((self.dispatch_finished - self.dispatch_started) * 1000, 3)
+                            if self.dispatch_finished is not None else None),
+            'phases': [self.phase_stats(index) for index in range(len(self.phases))]
+        }
+        if details:
+            result['commands'] = [
+                [command.result() if command is not None else {'car_id': car_id, 'status': 'failed'}
+                 for car_id, command in phase]
+                for phase in self.commands
+            ]
+        return result
+
+
+class CommandDispatcher:
+    """
+    后台分发线程：submit() 只登记任务并立即返回，
+    send_command(car_id, message) 返回 PendingCommand，发送失败返回None
+    """
+
+    def __init__(self, send_command):
+        self.send_command = send_command
+        self.jobs = OrderedDict()  # job_id -> DispatchJob，只保留最近 JOB_HISTORY_SIZE 个
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="command-dispatch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self._queue.put(None)
+
+    def submit(self, kind, phases):
+        """提交分发任务，返回 DispatchJob"""
+        with self._lock:
+            job = DispatchJob(next(self._ids), kind, phases)
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_HISTORY_SIZE:
+                self.jobs.popitem(last=False)
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def recent(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _run(self):
+        while self.running:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._dispatch(job)
+            except Exception as e:
+                log.error("❌ 分发任务 %s 出错: %s", job.id, e)
+                job.dispatch_finished = time.monotonic()
+
+    def _dispatch(self, job):
+        job.dispatching = True
+        job.dispatch_started = time.monotonic()
+        failed = set()
+
+        # 每个阶段在一个紧凑循环中发给所有小车，调用线程不等待确认
+        for index, phase in enumerate(job.phases):
+            commands = job.commands[index]
+            for car_id, message in phase:
+                if car_id in failed:
+                    job.skipped[index].append(car_id)
+                    continue
+                command = self.send_command(car_id, message)
+                if command is None:
+                    failed.add(car_id)
+                commands.append((car_id, command))
+
+        job.dispatch_finished = time.monotonic()
+        job.dispatching = False
+        stats = job.phase_stats(0) if job.phases else {}
+        log.info("📨 分发任务 %s (%s): %d 辆小车, 首阶段发送时间差 %sms",
+                 job.id, job.kind, len(job.car_ids), stats.get('send_spread_ms'))
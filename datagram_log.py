@@ -0,0 +1,184 @@
+"""
+数据报记录 - 追加写入的二进制日志
+接收线程和发送路径只把 (单调时间, 方向, 地址, 数据) 追加到内存队列，
+编码和写文件在后台线程完成；读取时用 mmap 顺序解析，供回放工具使用
+
+文件格式：文件头 DATAGRAM_LOG_MAGIC，之后每条记录为
+RECORD_HEADER (monotonic 时间戳, 方向, IPv4 地址, 端口, 长度) + 数据。
+每次开始记录都先写一次 DATAGRAM_LOG_MAGIC 作为会话标记：追加到已有文件时，
+服务器重启后的单调时钟与上一段无关，读取时从标记处重新接续时间轴
+"""
+
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from server_log import get_logger
+
+log = get_logger("recorder")
+
+DATAGRAM_LOG_MAGIC = b"A7DGLOG1"
+RECORD_HEADER = struct.Struct('<dB4sHH')
+
+# 记录方向
+INBOUND = 0  # 小车 -> 服务器
+OUTBOUND_UNICAST = 1  # 服务器 -> 小车指令端口（指令、确认等）
+OUTBOUND_BROADCAST = 2  # 广播服务器发出（子网广播或拓扑定向发送）
+DIRECTION_NAMES = {INBOUND: 'in', OUTBOUND_UNICAST: 'unicast', OUTBOUND_BROADCAST: 'broadcast'}
+
+RECORDER_FLUSH_INTERVAL = 0.05  # 后台线程写盘周期（秒）
+RECORDER_MAX_PENDING = 100000  # 队列中待写条目上限，超出后丢弃并计数，不阻塞调用线程
+SESSION_GAP = 1.0  # 读取时相邻两次记录会话之间插入的时间间隔（秒）
+
+
+class DatagramRecorder:
+    """
+    record()/record_batch() 只做一次 deque.append（线程安全，无锁），
+    后台线程每 RECORDER_FLUSH_INTERVAL 秒批量编码写入文件
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = deque()
+        self._file = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.started = None
+        self.counters = {'records': 0, 'bytes': 0, 'dropped': 0}
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'ab')
+        # 新文件的文件头，或追加到已有文件时的会话标记
+        self._file.write(DATAGRAM_LOG_MAGIC)
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="datagram-recorder", daemon=True)
+        self._thread.start()
+        log.info("⏺️ 开始记录数据报: %s", self.path)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+        log.info("⏹️ 停止记录数据报: %s，共 %d 条", self.path, self.counters['records'])
+
+    def record(self, direction, address, data):
+        """记录单个数据报（发送路径调用）"""
+        if len(self._pending) >= RECORDER_MAX_PENDING:
+            self.counters['dropped'] += 1
+            return
+        self._pending.append((time.monotonic(), direction, address, data))
+
+    def record_batch(self, batch, received=None):
+        """记录接收线程收到的一批 [(data, addr)]，整批共用一个时间戳（received 为收到该批的单调时间，回放时原样送回）"""
+        if len(self._pending) >= RECORDER_MAX_PENDING:
+            self.counters['dropped'] += len(batch)
+            return
+        self._pending.append((time.monotonic() if received is None else received, INBOUND, None, batch))
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(RECORDER_FLUSH_INTERVAL):
+                self._flush()
+            self._flush()
+        finally:
+            self._file.close()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        chunks = []
+        pack = RECORD_HEADER.pack
+        pending = self._pending
+        records = 0
+        while pending:
+            timestamp, direction, address, data = pending.popleft()
+            items = data if direction == INBOUND else ((data, address),)
+            for payload, addr in items:
+                if isinstance(payload, str):
+                    payload = payload.encode('utf-8')
+                try:
+                    ip = socket.inet_aton(addr[0])
+                    port = addr[1]
+                except (OSError, TypeError, IndexError):
+                    ip, port = b"\0\0\0\0", 0
+                chunks.append(pack(timestamp, direction, ip, port, len(payload)))
+                chunks.append(payload)
+                records += 1
+        data = b"".join(chunks)
+        try:
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            log.error("❌ 写入数据报日志失败: %s", e, extra={'rate_limit': 5.0})
+            return
+        self.counters['records'] += records
+        self.counters['bytes'] += len(data)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'started': self.started,
+            'pending': len(self._pending),
+            **self.counters
+        }
+
+
+class RecordingSocket:
+    """包装发送套接字：sendto 先转发再记录，其余属性直接访问原套接字"""
+
+    def __init__(self, sock, recorder, direction):
+        self._socket = sock
+        self._recorder = recorder
+        self._direction = direction
+
+    def sendto(self, data, address):
+        result = self._socket.sendto(data, address)
+        self._recorder.record(self._direction, address, data)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+
+def read_datagram_log(path):
+    """
+    用 mmap 顺序读取数据报日志，逐条产生 (timestamp, direction, (ip, port), data)；
+    遇到会话标记时平移之后的时间戳，使其接在上一会话最后一条记录的 SESSION_GAP 秒之后，产生的时间戳不回退
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(DATAGRAM_LOG_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[:len(DATAGRAM_LOG_MAGIC)] != DATAGRAM_LOG_MAGIC:
+                raise ValueError(f"{path} 不是数据报日志")
+            marker_size = len(DATAGRAM_LOG_MAGIC)
+            offset = marker_size
+            unpack_from = RECORD_HEADER.unpack_from
+            header_size = RECORD_HEADER.size
+            shift = 0.0  # 当前会话的时间平移量
+            last = None  # 上一条记录平移后的时间戳
+            session_start = True
+            while offset + header_size <= size:
+                if mapped[offset:offset + marker_size] == DATAGRAM_LOG_MAGIC:
+                    # 会话标记的字节按时间戳解读约为 2.6e-71，不会与真实的单调时钟读数混淆
+                    offset += marker_size
+                    session_start = True
+                    continue
+                timestamp, direction, ip, port, length = unpack_from(mapped, offset)
+                offset += header_size
+                if offset + length > size:
+                    break  # 记录被截断（写入时进程退出）
+                if session_start:
+                    shift = 0.0 if last is None else last + SESSION_GAP - timestamp
+                    session_start = False
+                last = timestamp + shift
+                yield last, direction, (socket.inet_ntoa(ip), port), mapped[offset:offset + length]
+                offset += length
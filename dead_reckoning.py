@@ -0,0 +1,156 @@
+"""
+航位推算 - 广播发出时把各车最新样本外推到发出时刻
+匀速模型：位置按 (vx, vy)（米/秒）外推，航向按角速度 vz（弧度/秒）外推，外推时长不超过 max_horizon；
+遥测协议没有规定 (vx, vy) 的坐标系：世界坐标直接使用，车体坐标（x 向前、y 向左）按航向（度，逆时针为正）
+旋转到世界坐标后使用（取外推区间中点的航向）。
+接收时用同一模型检查新样本，明显异常的样本（非有限值、隐含速度超出上限的位置跳变）被丢弃，
+并以下一条真实样本统计外推误差，便于调参
+"""
+
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def wrap_heading(heading, reference):
+    """把外推后的航向（度）折回与 reference 相同的表示范围：reference 在 [-180, 180] 时为 (-180, 180]，否则为 [0, 360)"""
+    if -180.0 <= reference <= 180.0:
+        if heading > 180.0:
+            heading -= 360.0
+        elif heading <= -180.0:
+            heading += 360.0
+    else:
+        heading %= 360.0
+    return heading
+
+
+def world_velocity(vx, vy, heading):
+    """车体坐标速度按航向（度）旋转到世界坐标，参数可以是标量或 NumPy 数组"""
+    radians = np.radians(heading)
+    c, s = np.cos(radians), np.sin(radians)
+    return vx * c - vy * s, vx * s + vy * c
+
+
+def extrapolate_rows(rows, ages, max_horizon, body_frame=False):
+    """
+    rows 为 (car_id, x, y, heading, vx, vy, vz)，ages 为各行样本的年龄（秒）
+    返回 (外推到当前时刻的行, 各行外推后剩余的年龄)；年龄超过 max_horizon 的部分不再外推。
+    body_frame 时 (vx, vy) 为车体坐标，按外推区间中点的航向旋转到世界坐标；行中的速度原样保留
+    """
+    predicted = []
+    residual = []
+    degrees = math.degrees
+    radians = math.radians
+    cos, sin = math.cos, math.sin
+    for (car_id, x, y, heading, vx, vy, vz), age in zip(rows, ages):
+        dt = min(max(age, 0.0), max_horizon)
+        turn = degrees(vz) * dt
+        if body_frame:
+            angle = radians(heading + turn * 0.5)
+            c, s = cos(angle), sin(angle)
+            dx, dy = (vx * c - vy * s) * dt, (vx * s + vy * c) * dt
+        else:
+            dx, dy = vx * dt, vy * dt
+        predicted.append((car_id, x + dx, y + dy, wrap_heading(heading + turn, heading), vx, vy, vz))
+        residual.append(age - dt)
+    return predicted, residual
+
+
+def gate_samples(previous, samples, dt, max_speed, margin):
+    """
+    检查一批新样本（previous、samples 为 (x, y, vx, vy) 的 N x 4 数组，dt 为距上一条样本的秒数数组）
+    返回 (是否接受, 匀速外推误差, 保持上一条样本的误差)，误差单位为米；
+    previous 的速度须为世界坐标（车体坐标先用 world_velocity 旋转），samples 的速度只用其大小
+    """
+    previous = np.asarray(previous, dtype=np.float64).reshape(-1, 4)
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, 4)
+    dt = np.clip(np.asarray(dt, dtype=np.float64), 0.0, None)
+    finite = np.isfinite(samples).all(axis=1)
+
+    jump = np.hypot(samples[:, 0] - previous[:, 0], samples[:, 1] - previous[:, 1])
+    reported_speed = np.hypot(samples[:, 2], samples[:, 3])
+    accept = finite & (jump <= max_speed * dt + margin) & (reported_speed <= max_speed)
+
+    predicted_x = previous[:, 0] + previous[:, 2] * dt
+    predicted_y = previous[:, 1] + previous[:, 3] * dt
+    predicted_error = np.hypot(samples[:, 0] - predicted_x, samples[:, 1] - predicted_y)
+    return accept, predicted_error, jump
+
+
+class PredictionTracker:
+    """
+    record() 由接收线程调用，stats() 可在任意线程调用；
+    保留最近 window 条外推误差和保持误差（不外推、直接使用上一条样本时的误差），以及样本拒绝计数
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.predicted = deque(maxlen=window)
+        self.held = deque(maxlen=window)
+        self.horizon = deque(maxlen=window)
+        self.per_car = {}  # car_id -> deque(外推误差)
+        self.counters = {'checked': 0, 'rejected': 0, 'resynced': 0, 'resplit': 0}  # resplit 为外推后超出字节预算而拆分的文本帧
+        self._lock = threading.Lock()
+
+    def record(self, car_ids, predicted_errors, held_errors, dt):
+        with self._lock:
+            self.predicted.extend(predicted_errors)
+            self.held.extend(held_errors)
+            self.horizon.extend(dt)
+            for car_id, error in zip(car_ids, predicted_errors):
+                history = self.per_car.get(car_id)
+                if history is None:
+                    history = self.per_car[car_id] = deque(maxlen=self.window)
+                history.append(error)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def forget(self, car_id):
+        with self._lock:
+            self.per_car.pop(car_id, None)
+
+    def reset(self):
+        with self._lock:
+            self.predicted.clear()
+            self.held.clear()
+            self.horizon.clear()
+            self.per_car.clear()
+            for name in self.counters:
+                self.counters[name] = 0
+
+    @staticmethod
+    def _distribution(values):
+        """误差序列（米）的分布摘要（毫米），空序列返回None"""
+        if not values:
+            return None
+        values = np.asarray(values, dtype=np.float64) * 1000.0
+        p50, p99 = np.percentile(values, (50, 99))
+        return {'count': len(values), 'mean_mm': round(float(values.mean()), 2),
+                'p50_mm': round(float(p50), 2), 'p99_mm': round(float(p99), 2),
+                'max_mm': round(float(values.max()), 2)}
+
+    def stats(self):
+        with self._lock:
+            predicted = list(self.predicted)
+            held = list(self.held)
+            horizon = list(self.horizon)
+            per_car = {car_id: list(values) for car_id, values in self.per_car.items()}
+            counters = dict(self.counters)
+
+        predicted_stats = self._distribution(predicted)
+        held_stats = self._distribution(held)
+        return {
+            'window': self.window,
+            **counters,
+            'predicted_error': predicted_stats,
+            'hold_error': held_stats,
+            # 外推误差相对直接使用上一条样本的改善（p50），小于1表示外推更准
+            'error_ratio_p50': (round(predicted_stats['p50_mm'] / held_stats['p50_mm'], 3)
+                                if predicted_stats and held_stats and held_stats['p50_mm'] else None),
+            'sample_interval_ms': (round(float(np.median(horizon)) * 1000, 2) if horizon else None),
+            'cars': {car_id: self._distribution(values) for car_id, values in sorted(per_car.items())}
+        }
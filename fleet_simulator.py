@@ -0,0 +1,336 @@
+"""
+车队模拟器 - 本机虚拟小车压测 web_car_server.py
+N 辆虚拟小车按固定频率发送文本遥测 "CARx:x,y,yaw,voltage,vx,vy,vz"，在广播端口接收下行状态帧，
+回复带序列号指令的 ACK，并统计接收速率、广播周期耗时、下行数据滞后和指令延迟
+
+虚拟小车沿 x 轴匀速行驶，每个样本前进 POSITION_STEP 米，因此下行帧中的 x 就是样本编号，
+据此查出该样本的发送时间，得到下行滞后（车 -> 服务器 -> 广播 -> 车）
+
+用法:
+  CAR_SERVER_BROADCAST_ADDRESS=127.255.255.255 python web_car_server.py
+  python fleet_simulator.py --cars 200 --rate 20 --duration 30 [--ack]
+"""
+
+import argparse
+import json
+import random
+import resource
+import selectors
+import socket
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from telemetry_protocol import (car_id_table, is_binary_frame, parse_binary_fleet_frame, parse_text_fleet_frame,
+                                split_command_tag, COMMAND_ACK_PREFIX)
+
+POSITION_STEP = 0.01  # 每个样本前进的距离（米），与下行文本格式的两位小数一致
+POSITION_WRAP = 10000  # 样本编号循环范围（x 在 0-100 米之间循环）
+LANE_SPACING = 0.5  # 相邻小车的 y 间距（米）
+LATENCY_SAMPLES = 100000  # 每类延迟最多保留的样本数
+
+
+def percentiles(values):
+    """延迟样本（秒）的分位数，单位毫秒"""
+    if not values:
+        return None
+    data = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(data, (50, 95, 99))
+    return {'count': len(data), 'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2), 'max_ms': round(float(data.max()), 2)}
+
+
+class VirtualCar:
+    """一辆虚拟小车：独立的UDP套接字（服务器据此地址下发指令）和样本发送时间表"""
+
+    __slots__ = ('car_id', 'number', 'socket', 'sample', 'lane', 'sent_times', 'commands')
+
+    def __init__(self, car_id, lane):
+        self.car_id = car_id
+        self.number = car_id_table.number(car_id)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.setblocking(False)
+        self.sample = 0
+        self.lane = lane
+        self.sent_times = np.zeros(POSITION_WRAP)  # 样本编号 -> 发送时间（单调时钟）
+        self.commands = 0
+
+    def telemetry(self, rate, now):
+        """生成下一条遥测并记录发送时间"""
+        index = self.sample % POSITION_WRAP
+        self.sample += 1
+        self.sent_times[index] = now
+        voltage = 12.0 - self.sample * 1e-5
+        return (f"{self.car_id}:{index * POSITION_STEP:.2f},{self.lane * LANE_SPACING:.2f},0.0,"
+                f"{voltage:.2f},{POSITION_STEP * rate:.4f},0.0000,0.0000").encode('utf-8')
+
+
+class FleetSimulator:
+    def __init__(self, count, rate, server, port, broadcast_port, http):
+        self.cars = [VirtualCar(f"CAR{i + 1}", i) for i in range(count)]
+        self.by_number = {car.number: car for car in self.cars}
+        self.by_short_id = {car_id_table.short_id(car.car_id): car for car in self.cars}
+        self.by_id = {car.car_id: car for car in self.cars}
+        self.rate = rate
+        self.server = (server, port)
+        self.broadcast_port = broadcast_port
+        self.http = http.rstrip('/')
+        self.running = False
+        self.lock = threading.Lock()
+        self.counters = {'telemetry_sent': 0, 'send_errors': 0, 'frames': 0, 'frame_bytes': 0,
+                         'entries': 0, 'unknown_entries': 0, 'commands': 0, 'acks_sent': 0}
+        self.staleness = []
+        self.command_latency = []  # HTTP 请求发出到小车收到指令
+        self.command_round_trip = []  # HTTP 请求往返（确认模式下包含等待确认）
+        self.pending_commands = {}  # car_id -> HTTP 请求发出时间
+        self.seen_cars = set()
+        self.threads = []
+
+    # ---- 上行：遥测发送 ----
+    def _send_loop(self):
+        """每个周期把所有小车的发送时刻均匀错开，避免同一时刻的突发"""
+        period = 1.0 / self.rate
+        spacing = period / len(self.cars)
+        next_cycle = time.monotonic()
+        server = self.server
+        while self.running:
+            for index, car in enumerate(self.cars):
+                due = next_cycle + index * spacing
+                delay = due - time.monotonic()
+                if delay > 0.001:
+                    time.sleep(delay)
+                try:
+                    car.socket.sendto(car.telemetry(self.rate, time.monotonic()), server)
+                    self.counters['telemetry_sent'] += 1
+                except OSError:
+                    self.counters['send_errors'] += 1
+            next_cycle += period
+            if time.monotonic() - next_cycle > period:
+                next_cycle = time.monotonic()  # 落后超过一个周期时放弃追赶
+
+    # ---- 下行：广播帧 ----
+    def _downlink_loop(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        listener.bind(('', self.broadcast_port))
+        listener.settimeout(0.5)
+        while self.running:
+            try:
+                data, _ = listener.recvfrom(65536)
+            except socket.timeout:
+                continue
+            now = time.monotonic()
+            self.counters['frames'] += 1
+            self.counters['frame_bytes'] += len(data)
+            if is_binary_frame(data):
+                parsed = parse_binary_fleet_frame(data)
+                entries = [(self.by_number.get(entry[0]), entry[1]) for entry in parsed[1]] if parsed else []
+            else:
+                parsed = parse_text_fleet_frame(data.decode('utf-8', errors='ignore'))
+                entries = [(self.by_short_id.get(entry[0]), entry[1]) for entry in parsed] if parsed else []
+            self._record_entries(entries, now)
+
+    def _record_entries(self, entries, now):
+        staleness = []
+        for car, x in entries:
+            self.counters['entries'] += 1
+            if car is None:
+                self.counters['unknown_entries'] += 1
+                continue
+            sent = car.sent_times[int(round(x / POSITION_STEP)) % POSITION_WRAP]
+            if sent:
+                staleness.append(now - sent)
+            self.seen_cars.add(car.car_id)
+        if staleness:
+            with self.lock:
+                if len(self.staleness) < LATENCY_SAMPLES:
+                    self.staleness.extend(staleness)
+
+    # ---- 指令与确认 ----
+    def _command_loop(self):
+        selector = selectors.DefaultSelector()
+        for car in self.cars:
+            selector.register(car.socket, selectors.EVENT_READ, car)
+        try:
+            while self.running:
+                for key, _ in selector.select(timeout=0.5):
+                    car = key.data
+                    while True:
+                        try:
+                            data, addr = car.socket.recvfrom(2048)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        self._handle_command(car, data, addr)
+        finally:
+            selector.close()
+
+    def _handle_command(self, car, data, addr):
+        now = time.monotonic()
+        message, sequence = split_command_tag(data.decode('utf-8', errors='ignore').strip())
+        car.commands += 1
+        self.counters['commands'] += 1
+        if sequence is not None:
+            ack = COMMAND_ACK_PREFIX + f"{car.car_id},{sequence}".encode('utf-8')
+            try:
+                car.socket.sendto(ack, addr)
+                self.counters['acks_sent'] += 1
+            except OSError:
+                self.counters['send_errors'] += 1
+        if message.startswith(f"CTRL:{car.car_id},TARGET:"):
+            with self.lock:
+                started = self.pending_commands.pop(car.car_id, None)
+                if started is not None and len(self.command_latency) < LATENCY_SAMPLES:
+                    self.command_latency.append(now - started)
+
+    def _http(self, path, payload=None, timeout=5.0):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.http + path, data=data,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def _command_probe_loop(self, interval):
+        """每 interval 秒通过 HTTP 向随机一辆小车下发导航指令，测量指令延迟"""
+        while self.running:
+            time.sleep(interval)
+            car = random.choice(self.cars)
+            started = time.monotonic()
+            with self.lock:
+                self.pending_commands[car.car_id] = started
+            try:
+                self._http('/api/control_position', {'car_id': car.car_id, 'position': {'x': 1.0, 'y': 1.0},
+                                                     'heading': 0})
+                self.command_round_trip.append(time.monotonic() - started)
+            except OSError as e:
+                print(f"⚠️ 指令请求失败: {e}")
+
+    # ---- 运行与报告 ----
+    def server_stats(self):
+        """读取服务器端统计：接收数据报数、最近一次广播周期"""
+        try:
+            ingest = self._http('/api/ingest/stats')
+            broadcast = self._http('/api/broadcast/status')
+            return ingest['packets'], broadcast.get('broadcast_cycle_stats') or {}
+        except (OSError, ValueError, KeyError):
+            return None, {}
+
+    def start(self, command_interval):
+        self.running = True
+        targets = [self._send_loop, self._downlink_loop, self._command_loop]
+        if command_interval > 0:
+            targets.append(lambda: self._command_probe_loop(command_interval))
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+        for car in self.cars:
+            car.socket.close()
+
+    def report(self, elapsed, packets_delta, cycle_stats, interval):
+        with self.lock:
+            staleness = percentiles(self.staleness)
+            latency = percentiles(self.command_latency)
+            self.staleness = []
+        line = f"⏱️ {elapsed:6.1f}s | 上行 {self.counters['telemetry_sent'] / max(elapsed, 1e-9):8.0f} 条/秒"
+        if packets_delta is not None:
+            line += f" | 服务器接收 {packets_delta / interval:8.0f} 条/秒"
+        else:
+            line += " | 服务器统计不可用"
+        if cycle_stats:
+            line += f" | 广播周期 {cycle_stats.get('duration_ms', 0):.2f}ms / {cycle_stats.get('frames', 0)} 帧"
+        line += f" | 下行覆盖 {len(self.seen_cars)}/{len(self.cars)}"
+        if staleness:
+            line += f" | 滞后 p50 {staleness['p50_ms']}ms p99 {staleness['p99_ms']}ms"
+        if latency:
+            line += f" | 指令 p50 {latency['p50_ms']}ms"
+        print(line)
+
+
+def raise_file_limit(needed):
+    """每辆虚拟小车一个套接字，必要时提高文件描述符软限制"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本机虚拟车队压测")
+    parser.add_argument('--cars', type=int, default=4, help="虚拟小车数量（4-1000）")
+    parser.add_argument('--rate', type=float, default=20.0, help="每辆小车的遥测频率（Hz）")
+    parser.add_argument('--duration', type=float, default=30.0, help="运行时长（秒）")
+    parser.add_argument('--server', default='127.0.0.1', help="UDP服务器地址")
+    parser.add_argument('--port', type=int, default=8080, help="UDP服务器端口")
+    parser.add_argument('--broadcast-port', type=int, default=8081, help="下行广播端口")
+    parser.add_argument('--http', default='http://127.0.0.1:5000', help="Web接口地址")
+    parser.add_argument('--command-interval', type=float, default=1.0, help="指令延迟探测间隔（秒），0 表示不探测")
+    parser.add_argument('--report-interval', type=float, default=5.0, help="报告间隔（秒）")
+    parser.add_argument('--ack', action='store_true', help="开启服务器的指令确认模式")
+    parser.add_argument('--no-broadcast-enable', action='store_true', help="不自动开启服务器广播")
+    args = parser.parse_args()
+
+    if not 4 <= args.cars <= 1000:
+        parser.error("--cars 必须在 4-1000 之间")
+    raise_file_limit(args.cars + 64)
+
+    simulator = FleetSimulator(args.cars, args.rate, args.server, args.port, args.broadcast_port, args.http)
+    if not args.no_broadcast_enable:
+        try:
+            simulator._http('/api/broadcast', {'enable': True})
+        except OSError as e:
+            print(f"⚠️ 无法开启服务器广播: {e}")
+    if args.ack:
+        try:
+            simulator._http('/api/commands/config', {'ack_mode': 'on'})
+        except OSError as e:
+            print(f"⚠️ 无法开启确认模式: {e}")
+
+    print(f"🚗 {args.cars} 辆虚拟小车, {args.rate:g}Hz -> {args.server}:{args.port}, "
+          f"监听广播端口 {args.broadcast_port}")
+    simulator.start(args.command_interval)
+    started = time.monotonic()
+    last_packets, _ = simulator.server_stats()
+    total_staleness = []
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(min(args.report_interval, max(0.0, args.duration - (time.monotonic() - started))))
+            packets, cycle_stats = simulator.server_stats()
+            delta = packets - last_packets if packets is not None and last_packets is not None else None
+            last_packets = packets
+            with simulator.lock:
+                total_staleness.extend(simulator.staleness[:LATENCY_SAMPLES - len(total_staleness)])
+            simulator.report(time.monotonic() - started, delta, cycle_stats, args.report_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+    elapsed = time.monotonic() - started
+    counters = simulator.counters
+    summary = {
+        'cars': args.cars,
+        'rate_hz': args.rate,
+        'duration_s': round(elapsed, 2),
+        'uplink_rate': round(counters['telemetry_sent'] / elapsed, 1),
+        'downlink_frames_per_s': round(counters['frames'] / elapsed, 1),
+        'downlink_coverage': len(simulator.seen_cars) / args.cars,
+        'downlink_staleness': percentiles(total_staleness),
+        'command_latency': percentiles(simulator.command_latency),
+        'command_round_trip': percentiles(simulator.command_round_trip),
+        **counters
+    }
+    print("📊 汇总:")
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,468 @@
+"""
+车队状态存储 - 列式数组
+每个字段一列连续数组，小车通过槽位表映射到数组下标；
+Car 是只保存 (store, slot) 的轻量视图，兼容原有的属性访问方式。
+写入方在持锁状态下调用 publish() 发布不可变快照，读取方直接取 store.snapshot 无需加锁
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# 浮点列：位置、航向、电压、速度分量、合速度、时间戳
+# received 为最新样本 recvfrom 时的单调时间，用于计算广播发出时的数据年龄
+FLOAT_COLUMNS = ('x', 'y', 'heading', 'battery', 'vx', 'vy', 'vz', 'speed',
+                 'last_update', 'last_broadcast_time', 'received')
+INT_COLUMNS = ('update_count', 'connection_attempts', 'changed_version')
+SNAPSHOT_COLUMNS = ('connected',) + FLOAT_COLUMNS + INT_COLUMNS
+
+REMOVED_LOG_SIZE = 1024  # 保留的删除记录条数，超出后增量查询需要全量同步
+
+# 锚定在单调时钟上的墙钟：与 time.time() 同一量纲（可直接给仪表盘显示），但不受系统时间跳变影响；
+# last_update 由样本的接收时间换算得到，各处超时判断都用 wall_clock() 作为当前时间
+WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+
+
+def wall_clock(monotonic=None):
+    """单调时间 monotonic（默认为当前）对应的墙钟时间"""
+    return (time.monotonic() if monotonic is None else monotonic) + WALL_CLOCK_OFFSET
+
+
+class Car:
+    """小车状态视图，读写直接落到 FleetStore 的列数组上"""
+
+    __slots__ = ('car_id', '_store', '_slot')
+
+    def __init__(self, car_id, store, slot):
+        self.car_id = car_id
+        self._store = store
+        self._slot = slot
+
+    @property
+    def mac_address(self):
+        return f"CAR_{self.car_id}"
+
+    @property
+    def address(self):
+        return self._store.address[self._slot]
+
+    @address.setter
+    def address(self, value):
+        self._store.address[self._slot] = value
+
+    @property
+    def position(self):
+        store, slot = self._store, self._slot
+        return {"x": float(store.x[slot]), "y": float(store.y[slot])}
+
+    @position.setter
+    def position(self, value):
+        store, slot = self._store, self._slot
+        store.x[slot] = value["x"]
+        store.y[slot] = value["y"]
+        store.dirty.add(slot)
+
+    @property
+    def velocity(self):
+        store, slot = self._store, self._slot
+        return {"vx": float(store.vx[slot]), "vy": float(store.vy[slot]), "vz": float(store.vz[slot])}
+
+    @velocity.setter
+    def velocity(self, value):
+        store, slot = self._store, self._slot
+        store.vx[slot] = value["vx"]
+        store.vy[slot] = value["vy"]
+        store.vz[slot] = value["vz"]
+        store.speed[slot] = (value["vx"] ** 2 + value["vy"] ** 2) ** 0.5
+        store.dirty.add(slot)
+
+    @property
+    def heading(self):
+        return float(self._store.heading[self._slot])
+
+    @heading.setter
+    def heading(self, value):
+        self._store.heading[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def battery(self):
+        return float(self._store.battery[self._slot])
+
+    @battery.setter
+    def battery(self, value):
+        self._store.battery[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def speed(self):
+        return float(self._store.speed[self._slot])
+
+    @property
+    def connected(self):
+        return bool(self._store.connected[self._slot])
+
+    @connected.setter
+    def connected(self, value):
+        self._store.connected[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def last_update(self):
+        return float(self._store.last_update[self._slot])
+
+    @last_update.setter
+    def last_update(self, value):
+        self._store.last_update[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def last_broadcast_time(self):
+        return float(self._store.last_broadcast_time[self._slot])
+
+    @last_broadcast_time.setter
+    def last_broadcast_time(self, value):
+        self._store.last_broadcast_time[self._slot] = value
+
+    @property
+    def update_count(self):
+        return int(self._store.update_count[self._slot])
+
+    @update_count.setter
+    def update_count(self, value):
+        self._store.update_count[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def connection_attempts(self):
+        return int(self._store.connection_attempts[self._slot])
+
+    @connection_attempts.setter
+    def connection_attempts(self, value):
+        self._store.connection_attempts[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def status(self):
+        return self._store.status[self._slot]
+
+    @status.setter
+    def status(self, value):
+        self._store.status[self._slot] = value
+        self._store.dirty.add(self._slot)
+
+    @property
+    def sequence(self):
+        return self._store.sequence[self._slot]
+
+    @sequence.setter
+    def sequence(self, value):
+        self._store.sequence[self._slot] = value
+
+    @property
+    def sent_timestamp(self):
+        return self._store.sent_timestamp[self._slot]
+
+    @sent_timestamp.setter
+    def sent_timestamp(self, value):
+        self._store.sent_timestamp[self._slot] = value
+
+
+class FleetSnapshot:
+    """
+    某一版本车队状态的只读副本，行按小车ID排序
+    发布后不再修改，可在任意线程中无锁读取
+    """
+
+    __slots__ = ('version', 'created', 'ids', 'slots', 'index', 'address', 'status',
+                 'removed', 'removed_floor') + SNAPSHOT_COLUMNS
+
+    def __init__(self, version, ids, slots, address, status, columns, removed, removed_floor):
+        self.version = version
+        self.created = time.time()
+        self.ids = ids
+        self.slots = slots
+        self.index = {car_id: row for row, car_id in enumerate(ids)}
+        self.address = address
+        self.status = status
+        self.removed = removed  # ((版本, car_id), ...)，按版本递增
+        self.removed_floor = removed_floor  # 删除记录完整覆盖的最小版本
+        for name in SNAPSHOT_COLUMNS:
+            column = columns[name]
+            column.flags.writeable = False
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, car_id):
+        return car_id in self.index
+
+    def connected_count(self):
+        return int(np.count_nonzero(self.connected))
+
+    def live_rows(self, now, max_age):
+        """在线且最近 max_age 秒内有更新的行号（已按小车ID排序）"""
+        return np.flatnonzero(self.connected & (now - self.last_update < max_age)).tolist()
+
+    def stale_ids(self, now, timeout):
+        """在线但超过 timeout 秒未更新的小车ID"""
+        rows = np.flatnonzero(self.connected & (now - self.last_update > timeout))
+        return [self.ids[row] for row in rows.tolist()]
+
+    def expired_ids(self, now, timeout):
+        """断开超过 timeout 秒的小车ID"""
+        rows = np.flatnonzero(~self.connected & (now - self.last_update > timeout))
+        return [self.ids[row] for row in rows.tolist()]
+
+    def changed_rows(self, since):
+        """版本 since 之后有变化的行号"""
+        return np.flatnonzero(self.changed_version > since).tolist()
+
+    def removed_since(self, since):
+        """版本 since 之后被删除的小车ID；记录已被覆盖无法确定时返回None"""
+        if since < self.removed_floor:
+            return None
+        return [car_id for version, car_id in self.removed if version > since]
+
+    def rows(self, rows, columns):
+        """按行号收集若干列，返回 [(car_id, col1, col2, ...), ...]"""
+        if not rows:
+            return []
+        index = np.asarray(rows, dtype=np.intp)
+        values = [getattr(self, name)[index].tolist() for name in columns]
+        ids = [self.ids[row] for row in rows]
+        return list(zip(ids, *values))
+
+    def to_dicts(self, rows=None):
+        """导出小车的完整JSON结构（与 /api/cars 原有字段一致），rows 为None时导出全部"""
+        if rows is None:
+            rows = list(range(len(self.ids)))
+        result = []
+        for (car_id, x, y, heading, battery, vx, vy, vz, speed, connected,
+             last_update, update_count, connection_attempts) in self.rows(
+                rows,
+                ('x', 'y', 'heading', 'battery', 'vx', 'vy', 'vz', 'speed', 'connected',
+                 'last_update', 'update_count', 'connection_attempts')):
+            result.append({
+                'id': car_id,
+                'mac_address': f"CAR_{car_id}",
+                'position': {"x": x, "y": y},
+                'heading': heading,
+                'battery': battery,
+                'velocity': {"vx": vx, "vy": vy, "vz": vz},
+                'speed': speed,
+                'connected': connected,
+                'status': self.status[self.index[car_id]],
+                'last_update': last_update,
+                'update_count': update_count,
+                'connection_attempts': connection_attempts
+            })
+        return result
+
+
+class FleetStore:
+    """
+    列式车队状态存储，对外提供与 {car_id: Car} 字典相同的访问接口
+    调用方负责加锁（沿用 web_car_server.car_lock）
+    """
+
+    def __init__(self, capacity=16):
+        self.capacity = 0
+        self.slots = {}  # car_id -> 槽位
+        self.ids = []  # 槽位 -> car_id（空槽为None）
+        self.occupied = np.zeros(0, dtype=bool)
+        self.connected = np.zeros(0, dtype=bool)
+        for name in FLOAT_COLUMNS:
+            setattr(self, name, np.zeros(0, dtype=np.float64))
+        for name in INT_COLUMNS:
+            setattr(self, name, np.zeros(0, dtype=np.int64))
+        self.address = []
+        self.status = []
+        self.sequence = []
+        self.sent_timestamp = []
+        self._views = {}
+        self._free = []
+        self._grow(capacity)
+
+        self.dirty = set()  # 上次发布以来有变化的槽位
+        self.removed_log = deque(maxlen=REMOVED_LOG_SIZE)
+        self._removed = ()
+        self._removed_floor = 0
+
+        self.version = 0
+        self.snapshot = None
+        self.published = threading.Condition(threading.Lock())  # 发布新快照时通知等待者
+        self.publish()
+
+    def _grow(self, new_capacity):
+        """扩容所有列，新槽位加入空闲表"""
+        old_capacity = self.capacity
+        extra = new_capacity - old_capacity
+        self.occupied = np.concatenate([self.occupied, np.zeros(extra, dtype=bool)])
+        self.connected = np.concatenate([self.connected, np.zeros(extra, dtype=bool)])
+        for name in FLOAT_COLUMNS:
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(extra, dtype=np.float64)]))
+        for name in INT_COLUMNS:
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(extra, dtype=np.int64)]))
+        for column in (self.ids, self.address, self.status, self.sequence, self.sent_timestamp):
+            column.extend([None] * extra)
+        self._free.extend(range(new_capacity - 1, old_capacity - 1, -1))
+        self.capacity = new_capacity
+
+    # ---- 字典兼容接口 ----
+
+    def __contains__(self, car_id):
+        return car_id in self.slots
+
+    def __getitem__(self, car_id):
+        return self._views[car_id]
+
+    def __delitem__(self, car_id):
+        self.remove(car_id)
+
+    def __iter__(self):
+        return iter(list(self.slots))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, car_id, default=None):
+        return self._views.get(car_id, default)
+
+    def keys(self):
+        return list(self.slots)
+
+    def values(self):
+        return list(self._views.values())
+
+    def items(self):
+        return list(self._views.items())
+
+    # ---- 槽位管理 ----
+
+    def add(self, car_id, address):
+        """为新小车分配槽位并初始化默认状态，返回视图"""
+        if not self._free:
+            self._grow(max(16, self.capacity * 2))
+        slot = self._free.pop()
+
+        self.slots[car_id] = slot
+        self.ids[slot] = car_id
+        self.occupied[slot] = True
+        self.connected[slot] = True
+        for name in FLOAT_COLUMNS:
+            getattr(self, name)[slot] = 0.0
+        for name in INT_COLUMNS:
+            getattr(self, name)[slot] = 0
+        self.battery[slot] = 100
+        received = time.monotonic()
+        self.last_update[slot] = wall_clock(received)
+        self.received[slot] = received
+        self.address[slot] = address
+        self.status[slot] = "正常"
+        self.dirty.add(slot)
+        self.sequence[slot] = None
+        self.sent_timestamp[slot] = None
+
+        view = self._views[car_id] = Car(car_id, self, slot)
+        return view
+
+    def remove(self, car_id):
+        """释放小车槽位"""
+        slot = self.slots.pop(car_id)
+        del self._views[car_id]
+        self.ids[slot] = None
+        self.occupied[slot] = False
+        self.connected[slot] = False
+        self.address[slot] = None
+        self._free.append(slot)
+        self.dirty.discard(slot)
+
+        # 记录删除事件（归属于下一次发布的版本）
+        if len(self.removed_log) == self.removed_log.maxlen:
+            self._removed_floor = self.removed_log[0][0]
+        self.removed_log.append((self.version + 1, car_id))
+        self._removed = None
+
+    def slot_of(self, car_id):
+        return self.slots[car_id]
+
+    # ---- 批量写入 ----
+
+    def write_samples(self, slots, x, y, heading, battery, vx, vy, vz, timestamp, received=None):
+        """一次性写入一批槽位的遥测数据（各参数为等长序列），received 为接收时的单调时间"""
+        slots = np.asarray(slots, dtype=np.intp)
+        vx = np.asarray(vx, dtype=np.float64)
+        vy = np.asarray(vy, dtype=np.float64)
+        self.x[slots] = x
+        self.y[slots] = y
+        self.heading[slots] = heading
+        self.battery[slots] = battery
+        self.vx[slots] = vx
+        self.vy[slots] = vy
+        self.vz[slots] = vz
+        self.speed[slots] = np.hypot(vx, vy)
+        self.last_update[slots] = timestamp
+        self.received[slots] = time.monotonic() if received is None else received
+        self.dirty.update(slots.tolist())
+
+    def touch_broadcast(self, car_ids, slots, timestamp):
+        """
+        记录最后广播时间，槽位已被其他小车复用时跳过；
+        调用方需持锁，否则扩容替换列数组时写入会落在旧数组上而丢失
+        """
+        ids = self.ids
+        column = self.last_broadcast_time
+        for car_id, slot in zip(car_ids, slots):
+            if slot < len(ids) and ids[slot] == car_id:
+                column[slot] = timestamp
+
+    # ---- 向量化查询 ----
+
+    def mark_stale(self, now, timeout):
+        """把超过 timeout 秒未更新的在线小车标记为断开，返回这些小车的ID"""
+        mask = self.occupied & self.connected & (now - self.last_update > timeout)
+        slots = np.flatnonzero(mask)
+        if not len(slots):
+            return []
+        self.connected[slots] = False
+        self.dirty.update(slots.tolist())
+        return [self.ids[slot] for slot in slots.tolist()]
+
+    def expired_ids(self, now, timeout):
+        """断开超过 timeout 秒的小车ID"""
+        mask = self.occupied & ~self.connected & (now - self.last_update > timeout)
+        return [self.ids[slot] for slot in np.flatnonzero(mask).tolist()]
+
+    # ---- 快照发布 ----
+
+    def publish(self):
+        """生成新版本的只读快照并原子替换 self.snapshot，唤醒等待新版本的读取方（调用方需持锁）"""
+        self.version += 1
+        if self.dirty:
+            self.changed_version[list(self.dirty)] = self.version
+            self.dirty.clear()
+
+        ids = sorted(self.slots)
+        slots = np.array([self.slots[car_id] for car_id in ids], dtype=np.intp)
+        columns = {name: getattr(self, name)[slots] for name in SNAPSHOT_COLUMNS}
+        address = tuple(self.address[slot] for slot in slots.tolist())
+        status = tuple(self.status[slot] for slot in slots.tolist())
+        if self._removed is None:
+            self._removed = tuple(self.removed_log)
+
+        snapshot = FleetSnapshot(self.version, tuple(ids), slots, address, status, columns,
+                                 self._removed, self._removed_floor)
+        self.snapshot = snapshot
+        with self.published:
+            self.published.notify_all()
+        return snapshot
+
+    def wait_for_version(self, since, timeout):
+        """阻塞直到快照版本大于 since 或超时，返回当时的最新快照（不需要持 car_lock）"""
+        with self.published:
+            self.published.wait_for(lambda: self.snapshot.version > since, timeout)
+        return self.snapshot
@@ -4,8 +4,18 @@
 """
 
 import json
+import math
 import time
+
+import numpy as np
 from flask import Blueprint, request, jsonify
+from fleet_store import wall_clock
+from server_log import get_logger
+from telemetry_protocol import (car_number, car_id_table, pack_formation_bodies, encode_formation_frames,
+                                pack_target_frames, FORMATION_ACTIONS, FORMATION_TYPE_CODES)
+from topology import default_car_ids
+
+log = get_logger("formation")
 
 # 创建蓝图
 formation_bp = Blueprint('formation', __name__)
@@ -17,35 +27,241 @@ formation_type = "line"  # line, triangle, square, custom
 formation_params = {}
 cars_dict = {}  # 将在初始化时从主程序传入
 udp_server = None  # 将在初始化时传入UDP服务器实例
+notify_dashboard = None  # 仪表盘事件通知回调 notify(event, payload)，可选
+
+# 编队指令下发方式：unicast（逐车指令，兼容旧固件）或 broadcast（整个编队编码为一帧广播）
+formation_sync = "unicast"
+formation_epoch = 0  # 每次编队广播递增，小车据此丢弃重复帧
+FORMATION_FRAME_BUDGET = 1400  # 编队帧最大字节数，车辆过多时分片
+FORMATION_FRAME_REPEATS = 3  # 编队帧重复广播次数
+FORMATION_CACHE_SIZE = 64
+_formation_body_cache = {}  # (队形, 领航者, 小车ID元组) -> 预编码的编队帧分片
+
+# 编队控制方式：car（小车根据偏移量自行计算目标）或 server（服务器按固定频率计算并下发目标位姿）
+formation_control = "car"
+control_output = "ctrl"  # ctrl：逐车单播 CTRL:...,TARGET: 指令；batch：所有目标编码为一个批量帧广播
+control_rate = 10.0  # 服务器端编队控制频率（Hz）
+CONTROL_LEADER_MAX_AGE = 1.0  # 领航者位姿超过该时间（秒）未更新则暂停下发
+CONTROL_TARGET_BUDGET = 1400  # 批量目标帧最大字节数
+_control_plan = ((), np.zeros((0, 2)), np.zeros(0))  # (跟随者ID元组, 偏移量 (n,2), 航向偏移 (n,))
+control_sequence = 0
+control_stats = {'ticks': 0, 'followers': 0, 'sent': 0, 'stale_leader_ticks': 0, 'duration_ms': 0.0}
+
+# 编队生成参数
+FORMATION_TYPES = ("line", "triangle", "square")
+FORMATION_SPACING = 0.5  # 相邻小车间距（米）
+
+
+def _formation_slots(formation_type, count, spacing):
+    """按队形生成 count 个相对领航者的位置（领航者在第一个）"""
+    slots = []
+    if formation_type == "triangle":
+        # 实心三角：第 k 排有 k+1 个位置，每排从中间向两侧、先左后右填充
+        row = 0
+        while len(slots) < count:
+            positions = [(j - row / 2) * spacing * 2 for j in range(row + 1)]
+            positions.sort(key=lambda y: (abs(y), y))
+            for y in positions:
+                slots.append((-row * spacing, y))
+            row += 1
+    elif formation_type == "square":
+        # 方阵：每排 ceil(sqrt(n)) 辆，蛇形排列
+        columns = max(1, math.ceil(math.sqrt(count)))
+        for i in range(count):
+            row, column = divmod(i, columns)
+            if row % 2:
+                column = columns - 1 - column
+            slots.append((-row * spacing, -column * spacing))
+    else:
+        for i in range(count):
+            slots.append((-i * spacing, 0.0))
+    return slots[:count]
+
+
+def _car_sort_key(car_id):
+    num = car_number(car_id)
+    return (num is None, num or 0, car_id)
 
-# 编队配置（相对于领航者的偏移量）
+
+def generate_formation_config(formation_type, car_ids, leader_id=None, spacing=FORMATION_SPACING):
+    """
+    为任意数量的小车生成队形偏移量 {car_id: {"x", "y", "yaw"}}
+    领航者位于原点，其余小车按车号顺序依次占位
+    """
+    followers = sorted((car_id for car_id in car_ids if car_id != leader_id), key=_car_sort_key)
+    ordered = ([leader_id] if leader_id else []) + followers
+    offsets = {}
+    for car_id, (x, y) in zip(ordered, _formation_slots(formation_type, len(ordered), spacing)):
+        offsets[car_id] = {"x": round(x, 3) or 0, "y": round(y, 3) or 0, "yaw": 0}
+    return offsets
+
+
+# 预设编队配置（四车，相对于领航者 CAR1 的偏移量）
 FORMATION_CONFIGS = {
-    "line": {
-        "CAR1": {"x": 0, "y": 0, "yaw": 0},      # 领航者
-        "CAR2": {"x": -0.5, "y": 0, "yaw": 0},   # 后方0.5米
-        "CAR3": {"x": -1.0, "y": 0, "yaw": 0},   # 后方1.0米
-        "CAR4": {"x": -1.5, "y": 0, "yaw": 0}    # 后方1.5米
-    },
-    "triangle": {
-        "CAR1": {"x": 0, "y": 0, "yaw": 0},      # 领航者
-        "CAR2": {"x": -0.5, "y": -0.5, "yaw": 0},
-        "CAR3": {"x": -0.5, "y": 0.5, "yaw": 0},
-        "CAR4": {"x": -1.0, "y": 0, "yaw": 0}
-    },
-    "square": {
-        "CAR1": {"x": 0, "y": 0, "yaw": 0},      # 领航者
-        "CAR2": {"x": 0, "y": -0.5, "yaw": 0},
-        "CAR3": {"x": -0.5, "y": -0.5, "yaw": 0},
-        "CAR4": {"x": -0.5, "y": 0, "yaw": 0}
-    }
+    formation: generate_formation_config(formation, default_car_ids(4), "CAR1")
+    for formation in FORMATION_TYPES
 }
 
-def init_formation_controller(cars, server):
+def _formation_bodies(formation_type, leader_id, offsets):
+    """预设队形的帧分片按 (队形, 领航者, 小车集合) 缓存，自定义偏移每次重新编码"""
+    key = (formation_type, leader_id, tuple(offsets))
+    bodies = _formation_body_cache.get(key) if formation_type in FORMATION_TYPES else None
+    if bodies is None:
+        number = car_id_table.number
+        entries = [(number(car_id), offset['x'], offset['y'], offset['yaw'])
+                   for car_id, offset in offsets.items()]
+        bodies = pack_formation_bodies(entries, FORMATION_FRAME_BUDGET)
+        if formation_type in FORMATION_TYPES:
+            if len(_formation_body_cache) >= FORMATION_CACHE_SIZE:
+                _formation_body_cache.clear()
+            _formation_body_cache[key] = bodies
+    return bodies
+
+
+def broadcast_formation_frame(action, formation_type, leader_id, offsets):
+    """
+    把整个编队（动作、队形、领航者、纪元和每辆小车的偏移）编码成一帧，通过广播服务器发出；
+    小车从帧中取出自己的条目，全队在同一个数据报到达时切换
+    """
+    global formation_epoch
+
+    formation_epoch = (formation_epoch + 1) & 0xFFFF
+    frames = encode_formation_frames(formation_epoch, FORMATION_ACTIONS[action],
+                                     FORMATION_TYPE_CODES.get(formation_type, FORMATION_TYPE_CODES['custom']),
+                                     car_id_table.number(leader_id) if leader_id else 0,
+                                     _formation_bodies(formation_type, leader_id, offsets))
+
+    sent = bool(udp_server) and all(udp_server.broadcast_frame(frame, FORMATION_FRAME_REPEATS) for frame in frames)
+    log.info("📢 编队帧广播: 动作=%s, 纪元=%d, %d 辆小车, %d 帧", action, formation_epoch, len(offsets), len(frames))
+    return {
+        'epoch': formation_epoch,
+        'frames': len(frames),
+        'bytes': sum(len(frame) for frame in frames),
+        'cars': len(offsets),
+        'broadcast_success': sent
+    }
+
+
+def _use_broadcast(data):
+    """请求中的 sync 字段优先，否则使用 formation_sync"""
+    return (data.get('sync') or formation_sync) == "broadcast"
+
+
+def _set_control_plan(offsets, leader_id):
+    """把跟随者偏移量整理成服务器端控制使用的数组（领航者不在其中）"""
+    global _control_plan
+
+    followers = tuple(car_id for car_id in offsets if car_id != leader_id)
+    xy = np.array([(float(offsets[car_id]['x']), float(offsets[car_id]['y'])) for car_id in followers],
+                  dtype=np.float64).reshape(-1, 2)
+    yaw = np.array([float(offsets[car_id].get('yaw', 0)) for car_id in followers], dtype=np.float64)
+    _control_plan = (followers, xy, yaw)
+
+
+def compute_follower_targets(leader_pose, offsets, yaw_offsets):
+    """
+    由领航者位姿 (x, y, heading) 计算所有跟随者的目标位姿
+    offsets 为领航者坐标系下的 (n,2) 偏移（x 向前、y 向左），heading 单位为度、逆时针为正
+    返回 (n,3) 数组 [x, y, heading]，所有跟随者在一次数组运算中完成
+    """
+    leader_x, leader_y, leader_heading = leader_pose
+    theta = math.radians(leader_heading)
+    c, s = math.cos(theta), math.sin(theta)
+    targets = np.empty((len(offsets), 3))
+    targets[:, 0] = leader_x + c * offsets[:, 0] - s * offsets[:, 1]
+    targets[:, 1] = leader_y + s * offsets[:, 0] + c * offsets[:, 1]
+    targets[:, 2] = leader_heading + yaw_offsets
+    return targets
+
+
+def _formation_control_tick():
+    """服务器端编队控制（调度线程按 control_rate 调用）：读取快照，计算并下发跟随者目标位姿"""
+    global control_sequence
+
+    if not formation_enabled or formation_control != "server" or udp_server is None:
+        return
+
+    started = time.perf_counter()
+    snapshot = cars_dict.snapshot
+    leader_row = snapshot.index.get(formation_leader)
+    if (leader_row is None or not snapshot.connected[leader_row]
+            or wall_clock() - snapshot.last_update[leader_row] > CONTROL_LEADER_MAX_AGE):
+        # 领航者位姿过旧时不下发，避免跟随者追随过期目标
+        control_stats['stale_leader_ticks'] += 1
+        log.warning("⚠️ 领航者 %s 位姿过旧，暂停服务器端编队控制", formation_leader, extra={'rate_limit': 5.0})
+        return
+
+    followers, offsets, yaw_offsets = _control_plan
+    rows = np.array([snapshot.index.get(car_id, -1) for car_id in followers], dtype=np.intp)
+    active = rows >= 0
+    active[active] = snapshot.connected[rows[active]]
+    if not active.any():
+        return
+
+    leader_pose = (float(snapshot.x[leader_row]), float(snapshot.y[leader_row]),
+                   float(snapshot.heading[leader_row]))
+    targets = compute_follower_targets(leader_pose, offsets[active], yaw_offsets[active])
+    active_ids = [car_id for car_id, live in zip(followers, active.tolist()) if live]
+
+    if control_output == "batch":
+        number = car_id_table.number
+        entries = [(number(car_id), x, y, heading)
+                   for car_id, (x, y, heading) in zip(active_ids, targets.tolist())]
+        frames = pack_target_frames(control_sequence, entries, CONTROL_TARGET_BUDGET)
+        control_sequence = (control_sequence + len(frames)) & 0xFFFF
+        broadcast = udp_server.broadcast_server.broadcast_data
+        sent = sum(1 for frame in frames if broadcast(frame))
+    else:
+        address = snapshot.address
+        messages = [(address[snapshot.index[car_id]], f"CTRL:{car_id},TARGET:{x:.2f},{y:.2f},{heading:.1f}")
+                    for car_id, (x, y, heading) in zip(active_ids, targets.tolist())]
+        sent = udp_server.send_to_addresses(messages)
+
+    control_stats['ticks'] += 1
+    control_stats['followers'] = len(active_ids)
+    control_stats['sent'] += sent
+    control_stats['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def init_formation_controller(cars, server, notify=None):
     """初始化编队控制器"""
-    global cars_dict, udp_server
+    global cars_dict, udp_server, notify_dashboard
     cars_dict = cars
     udp_server = server
-    print("🔧 编队控制器初始化完成")
+    notify_dashboard = notify
+
+    # 预编码四车预设队形的编队帧
+    for formation, offsets in FORMATION_CONFIGS.items():
+        _formation_bodies(formation, "CAR1", offsets)
+    if server is not None:
+        server.scheduler.add_task('formation_control', _formation_control_tick, lambda: 1.0 / control_rate)
+    log.info("🔧 编队控制器初始化完成")
+
+
+def _notify_formation_changed():
+    """通知仪表盘编队状态已变化"""
+    if notify_dashboard:
+        notify_dashboard('formation', get_formation_status_data())
+
+
+def dispatch_formation_commands(kind, phases):
+    """
+    把编队指令交给后台分发线程，立即返回 DispatchJob（UDP服务器未初始化时返回None）
+    phases 为按顺序发出的阶段，每阶段 [(car_id, command), ...] 在同一个紧凑循环中发给所有小车
+    """
+    if udp_server:
+        return udp_server.dispatcher.submit(kind, phases)
+    log.error("❌ UDP服务器未初始化，无法分发编队指令")
+    return None
+
+
+def _job_fields(job, total_cars):
+    """编队接口响应中的分发任务字段"""
+    return {
+        'job_id': job.id if job else None,
+        'job': job.to_dict() if job else None,
+        'total_cars': total_cars
+    }
 
 
 def send_formation_command(car_id, command):
@@ -53,7 +269,7 @@ def send_formation_command(car_id, command):
     if udp_server:
         return udp_server.send_to_car_reliable(car_id, command, max_retries=4)
     else:
-        print(f"❌ UDP服务器未初始化，无法发送指令给 {car_id}")
+        log.error("❌ UDP服务器未初始化，无法发送指令给 %s", car_id)
         return False
 
 
@@ -73,13 +289,12 @@ def start_formation():
     if leader_id not in cars_dict or not cars_dict[leader_id].connected:
         return jsonify({'success': False, 'error': f'领航者 {leader_id} 未连接'})
 
-    print(f"🚀 启动编队控制 - 领航者: {leader_id}, 队形: {formation_type}")
+    log.info("🚀 启动编队控制 - 领航者: %s, 队形: %s", leader_id, formation_type)
 
-    # 获取编队配置
-    if formation_type in FORMATION_CONFIGS:
-        formation_offsets = FORMATION_CONFIGS[formation_type]
-    else:
-        formation_offsets = FORMATION_CONFIGS["line"]
+    # 按当前在线的小车生成编队配置（车辆数量不限）
+    connected_ids = [car_id for car_id in cars_dict if cars_dict[car_id].connected]
+    formation_offsets = generate_formation_config(
+        formation_type if formation_type in FORMATION_TYPES else "line", connected_ids, leader_id)
 
     # 🚫 重要修改：不移除停止指令，直接开始新的编队
     # 这样所有小车可以几乎同时收到开始指令，提高同步性
@@ -87,56 +302,38 @@ def start_formation():
     formation_leader = leader_id
     formation_enabled = True
 
-    print(f"🎯 直接启动编队，不发送停止指令")
+    log.debug("🎯 直接启动编队，不发送停止指令")
 
     # 向所有小车发送编队开始指令和具体的编队角色指令（全部使用单播）
-    success_count = 0
-    total_cars = 0
-
-    for car_id in cars_dict:
-        if not cars_dict[car_id].connected:
-            continue
-
-        total_cars += 1
+    # 所有小车先收到开始指令，再收到各自的角色指令，由后台线程分发
+    start_cmd = f"FORMATION:START,{leader_id},{formation_type}"
+    start_phase = []
+    role_phase = []
 
+    for car_id in connected_ids:
+        start_phase.append((car_id, start_cmd))
         if car_id == leader_id:
             # 领航者指令：开始指令 + 角色指令
-            start_cmd = f"FORMATION:START,{leader_id},{formation_type}"
-            leader_role_cmd = f"FORMATION:LEADER,{formation_type}"
-
-            # 发送开始指令
-            if send_formation_command(car_id, start_cmd):
-                print(f"🎯 向领航者 {car_id} 发送开始指令: {start_cmd}")
-                # 发送角色指令
-                if send_formation_command(car_id, leader_role_cmd):
-                    print(f"🎯 向领航者 {car_id} 发送角色指令: {leader_role_cmd}")
-                    success_count += 1
+            role_phase.append((car_id, f"FORMATION:LEADER,{formation_type}"))
         else:
-            # 跟随者指令：开始指令 + 角色指令 + 偏移量
-            start_cmd = f"FORMATION:START,{leader_id},{formation_type}"
+            # 跟随者指令：开始指令 + 角色指令 + 偏移量（原领航者也在其中，转换为跟随者）
             offset = formation_offsets.get(car_id, {"x": 0, "y": 0, "yaw": 0})
-            follower_cmd = f"FORMATION:FOLLOWER,{leader_id},{offset['x']},{offset['y']},{offset['yaw']}"
-
-            # 发送开始指令
-            if send_formation_command(car_id, start_cmd):
-                print(f"🎯 向跟随者 {car_id} 发送开始指令: {start_cmd}")
-                # 发送角色和偏移指令
-                if send_formation_command(car_id, follower_cmd):
-                    print(f"🎯 向跟随者 {car_id} 发送偏移指令: {follower_cmd}")
-                    success_count += 1
-
-    # 如果原来的领航者现在变成了跟随者，需要特别处理
-    if old_leader and old_leader != leader_id and old_leader in cars_dict:
-        if cars_dict[old_leader].connected:
-            start_cmd = f"FORMATION:START,{leader_id},{formation_type}"
-            offset = formation_offsets.get(old_leader, {"x": 0, "y": 0, "yaw": 0})
-            follower_cmd = f"FORMATION:FOLLOWER,{leader_id},{offset['x']},{offset['y']},{offset['yaw']}"
-
-            if send_formation_command(old_leader, start_cmd) and send_formation_command(old_leader, follower_cmd):
-                print(f"🔄 原领航者 {old_leader} 转换为跟随者")
-                # 注意：这里不增加success_count，因为已经在上面统计过了
-
-    unicast_success_rate = (success_count / total_cars * 100) if total_cars > 0 else 0
+            role_phase.append((car_id, f"FORMATION:FOLLOWER,{leader_id},{offset['x']},{offset['y']},{offset['yaw']}"))
+
+    if old_leader and old_leader != leader_id and old_leader in connected_ids:
+        log.info("🔄 原领航者 %s 转换为跟随者", old_leader)
+
+    _set_control_plan(formation_offsets, leader_id)
+    if formation_control == "server":
+        # 服务器端控制：跟随者直接接收目标位姿，不再下发编队角色指令
+        delivery = {'formation_control': formation_control, 'total_cars': len(connected_ids)}
+    elif _use_broadcast(data):
+        delivery = {'formation_frame': broadcast_formation_frame('start', formation_type, leader_id, formation_offsets),
+                    'total_cars': len(connected_ids)}
+    else:
+        delivery = _job_fields(dispatch_formation_commands('formation_start', [start_phase, role_phase]),
+                               len(connected_ids))
+    _notify_formation_changed()
 
     return jsonify({
         'success': True,
@@ -144,9 +341,7 @@ def start_formation():
         'formation_leader': formation_leader,
         'formation_type': formation_type,
         'formation_offsets': formation_offsets,
-        'unicast_success_count': success_count,
-        'total_cars': total_cars,
-        'success_rate': f'{unicast_success_rate:.1f}%'
+        **delivery
     })
 
 
@@ -157,38 +352,45 @@ def stop_formation():
 
     # 使用单播向所有小车发送停止编队指令
     stop_cmd = "FORMATION:STOP"
-    success_count = 0
-    total_cars = 0
-
-    for car_id in cars_dict:
-        if cars_dict[car_id].connected:
-            total_cars += 1
-            if send_formation_command(car_id, stop_cmd):
-                success_count += 1
+    connected_ids = [car_id for car_id in cars_dict if cars_dict[car_id].connected]
+    if _use_broadcast(request.get_json(silent=True) or {}):
+        delivery = {'formation_frame': broadcast_formation_frame('stop', formation_type, formation_leader, {}),
+                    'total_cars': len(connected_ids)}
+    else:
+        delivery = _job_fields(dispatch_formation_commands('formation_stop',
+                                                           [[(car_id, stop_cmd) for car_id in connected_ids]]),
+                               len(connected_ids))
 
     formation_enabled = False
+    _notify_formation_changed()
 
-    unicast_success_rate = (success_count / total_cars * 100) if total_cars > 0 else 0
-
-    print(f"🛑 编队控制已停止，单播发送停止指令: {success_count}/{total_cars} 成功")
+    log.info("🛑 编队控制已停止，向 %d 辆小车分发停止指令", len(connected_ids))
 
     return jsonify({
         'success': True,
         'message': '编队控制已停止',
-        'unicast_success_count': success_count,
-        'total_cars': total_cars,
-        'success_rate': f'{unicast_success_rate:.1f}%'
+        **delivery
     })
 
 
+def get_formation_status_data():
+    return {
+        'formation_enabled': formation_enabled,
+        'formation_leader': formation_leader,
+        'formation_type': formation_type,
+        'formation_sync': formation_sync,
+        'formation_epoch': formation_epoch,
+        'formation_control': formation_control,
+        'control_output': control_output,
+        'control_rate': control_rate,
+        'control_stats': dict(control_stats)
+    }
+
+
 @formation_bp.route('/api/formation/status')
 def get_formation_status():
     """获取编队状态"""
-    return jsonify({
-        'formation_enabled': formation_enabled,
-        'formation_leader': formation_leader,
-        'formation_type': formation_type
-    })
+    return jsonify(get_formation_status_data())
 
 
 @formation_bp.route('/api/formation/custom', methods=['POST'])
@@ -210,53 +412,106 @@ def set_custom_formation():
     formation_leader = leader_id
     formation_enabled = True
 
-    print(f"🔧 设置自定义编队 - 领航者: {leader_id}, 偏移量: {custom_offsets}")
+    log.info("🔧 设置自定义编队 - 领航者: %s, 偏移量: %s", leader_id, custom_offsets)
 
     # 向所有小车发送自定义编队开始指令和角色指令（全部使用单播）
-    success_count = 0
-    total_cars = 0
-
-    for car_id in cars_dict:
-        if not cars_dict[car_id].connected:
-            continue
-
-        total_cars += 1
+    start_cmd = f"FORMATION:CUSTOM,{leader_id}"
+    connected_ids = [car_id for car_id in cars_dict if cars_dict[car_id].connected]
+    start_phase = []
+    role_phase = []
 
+    for car_id in connected_ids:
+        start_phase.append((car_id, start_cmd))
         if car_id == leader_id:
             # 领航者指令
-            start_cmd = f"FORMATION:CUSTOM,{leader_id}"
-            leader_cmd = "FORMATION:LEADER,CUSTOM"
-
-            if send_formation_command(car_id, start_cmd) and send_formation_command(car_id, leader_cmd):
-                success_count += 1
+            role_phase.append((car_id, "FORMATION:LEADER,CUSTOM"))
         else:
             # 跟随者指令，使用自定义偏移
-            start_cmd = f"FORMATION:CUSTOM,{leader_id}"
             offset = custom_offsets.get(car_id, {"x": 0, "y": 0, "yaw": 0})
-            follower_cmd = f"FORMATION:FOLLOWER,{leader_id},{offset['x']},{offset['y']},{offset['yaw']}"
-
-            if send_formation_command(car_id, start_cmd) and send_formation_command(car_id, follower_cmd):
-                success_count += 1
-
-    unicast_success_rate = (success_count / total_cars * 100) if total_cars > 0 else 0
+            role_phase.append((car_id, f"FORMATION:FOLLOWER,{leader_id},{offset['x']},{offset['y']},{offset['yaw']}"))
+
+    _set_control_plan({car_id: custom_offsets.get(car_id, {"x": 0, "y": 0, "yaw": 0}) for car_id in connected_ids},
+                      leader_id)
+    if formation_control == "server":
+        delivery = {'formation_control': formation_control, 'total_cars': len(connected_ids)}
+    elif _use_broadcast(data):
+        frame_offsets = {car_id: ({"x": 0, "y": 0, "yaw": 0} if car_id == leader_id
+                                  else custom_offsets.get(car_id, {"x": 0, "y": 0, "yaw": 0}))
+                         for car_id in connected_ids}
+        delivery = {'formation_frame': broadcast_formation_frame('custom', 'custom', leader_id, frame_offsets),
+                    'total_cars': len(connected_ids)}
+    else:
+        delivery = _job_fields(dispatch_formation_commands('formation_custom', [start_phase, role_phase]),
+                               len(connected_ids))
+    _notify_formation_changed()
 
     return jsonify({
         'success': True,
         'message': '自定义编队已设置',
         'formation_leader': formation_leader,
         'formation_offsets': custom_offsets,
-        'unicast_success_count': success_count,
-        'total_cars': total_cars,
-        'success_rate': f'{unicast_success_rate:.1f}%'
+        **delivery
     })
 
 
+@formation_bp.route('/api/formation/sync', methods=['POST'])
+def set_formation_sync():
+    """设置编队指令下发方式：{"mode": "unicast" 或 "broadcast"}"""
+    global formation_sync
+
+    mode = request.json.get('mode', 'unicast')
+    if mode not in ("unicast", "broadcast"):
+        return jsonify({'success': False, 'error': '下发方式必须为 unicast 或 broadcast'})
+
+    formation_sync = mode
+    log.info("📢 编队指令下发方式: %s", mode)
+    _notify_formation_changed()
+
+    return jsonify({'success': True, 'formation_sync': formation_sync})
+
+
+@formation_bp.route('/api/formation/control', methods=['POST'])
+def set_formation_control():
+    """
+    设置编队控制方式：{"mode": "car" 或 "server", "output": "ctrl" 或 "batch", "rate": Hz}
+    server 模式下服务器按 rate 计算所有跟随者的目标位姿并下发
+    """
+    global formation_control, control_output, control_rate
+
+    data = request.json or {}
+    mode = data.get('mode', formation_control)
+    output = data.get('output', control_output)
+    if mode not in ("car", "server"):
+        return jsonify({'success': False, 'error': '控制方式必须为 car 或 server'})
+    if output not in ("ctrl", "batch"):
+        return jsonify({'success': False, 'error': '目标下发格式必须为 ctrl 或 batch'})
+    try:
+        rate = float(data.get('rate', control_rate))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': '控制频率必须是数字'})
+    if not 0.5 <= rate <= 100:
+        return jsonify({'success': False, 'error': '控制频率必须在 0.5-100Hz 之间'})
+
+    formation_control, control_output, control_rate = mode, output, rate
+    log.info("🎮 编队控制方式: %s, 目标格式: %s, 频率: %.1fHz", mode, output, rate)
+    _notify_formation_changed()
+
+    return jsonify({'success': True, 'formation_control': formation_control,
+                    'control_output': control_output, 'control_rate': control_rate})
+
+
 @formation_bp.route('/api/formation/configs')
 def get_formation_configs():
-    """获取所有预设编队配置"""
+    """获取预设编队配置，?cars=N 时按 CAR1..CARN 生成"""
+    count = request.args.get('cars', type=int)
+    if count and count > 0:
+        configs = {formation: generate_formation_config(formation, default_car_ids(count), "CAR1")
+                   for formation in FORMATION_TYPES}
+    else:
+        configs = FORMATION_CONFIGS
     return jsonify({
         'success': True,
-        'formation_configs': FORMATION_CONFIGS
+        'formation_configs': configs
     })
 
 
@@ -274,27 +529,33 @@ def update_formation_offsets():
     if not new_offsets:
         return jsonify({'success': False, 'error': '需要提供新的偏移量'})
 
-    print(f"🔄 更新编队偏移量: {new_offsets}")
-
-    # 向相关小车发送更新指令（单播4次）
-    success_count = 0
-    total_cars = 0
+    log.info("🔄 更新编队偏移量: %s", new_offsets)
 
+    # 向相关小车发送更新指令（单播，由后台线程分发）
+    update_phase = []
     for car_id, offset in new_offsets.items():
         if car_id in cars_dict and car_id != formation_leader and cars_dict[car_id].connected:
-            total_cars += 1
             update_cmd = f"FORMATION:UPDATE,{formation_leader},{offset['x']},{offset['y']},{offset['yaw']}"
-            if send_formation_command(car_id, update_cmd):
-                print(f"🔄 向小车 {car_id} 发送偏移更新: {update_cmd}")
-                success_count += 1
-
-    success_rate = (success_count / total_cars * 100) if total_cars > 0 else 0
+            update_phase.append((car_id, update_cmd))
+
+    followers, xy, yaw = _control_plan
+    merged = {car_id: {'x': x, 'y': y, 'yaw': yaw_offset}
+              for car_id, (x, y), yaw_offset in zip(followers, xy.tolist(), yaw.tolist())}
+    merged.update({car_id: new_offsets[car_id] for car_id in new_offsets if car_id in cars_dict})
+    _set_control_plan(merged, formation_leader)
+    if formation_control == "server":
+        delivery = {'formation_control': formation_control, 'total_cars': len(update_phase)}
+    elif _use_broadcast(data):
+        frame_offsets = {car_id: new_offsets[car_id] for car_id, _ in update_phase}
+        delivery = {'formation_frame': broadcast_formation_frame('update', 'custom', formation_leader, frame_offsets),
+                    'total_cars': len(update_phase)}
+    else:
+        delivery = _job_fields(dispatch_formation_commands('formation_update', [update_phase]), len(update_phase))
 
     return jsonify({
         'success': True,
-        'message': f'编队偏移量已更新，通知了 {success_count}/{total_cars} 辆小车',
-        'updated_cars': success_count,
-        'success_rate': f'{success_rate:.1f}%'
+        'message': f'编队偏移量更新已分发给 {len(update_phase)} 辆小车',
+        **delivery
     })
 
 
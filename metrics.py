@@ -0,0 +1,292 @@
+"""
+运行指标 - 计数器、直方图和仪表，输出 Prometheus 文本格式或 JSON
+热路径上每个线程只写自己的分片（首次使用时登记一次），不加锁；
+读取时把所有分片相加，读到的值可能比最新写入略旧，但不会干扰被测线程
+"""
+
+import bisect
+import math
+import threading
+import time
+
+# 常用直方图分桶（秒）
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class _Sharded:
+    """
+    每个线程一个分片：分片在线程首次写入时创建并登记，之后只由该线程修改；
+    已结束线程（如 HTTP 请求线程）的分片在下次登记或读取时并入 _retired，分片数量不会无限增长
+    """
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._local = threading.local()
+        self._shards = []  # [(线程, 分片)]
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_finished(self):
+        """把已结束线程的分片并入 _retired（调用方需持锁）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = alive
+
+    def _snapshot(self):
+        """合并所有分片（拷贝后合并，不影响写入线程）"""
+        with self._shards_lock:
+            self._retire_finished()
+            merged = {}
+            self._merge(merged, self._retired)
+            for _, shard in self._shards:
+                self._merge(merged, dict(shard))
+        return merged
+
+
+class Counter(_Sharded):
+    """单调递增计数器，labels 为与 label_names 对应的取值元组"""
+
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(target, shard):
+        for labels, value in shard.items():
+            target[labels] = target.get(labels, 0) + value
+
+    def values(self):
+        return self._snapshot()
+
+
+class Histogram(_Sharded):
+    """固定分桶直方图：每组标签一个 [各桶计数..., +Inf 计数, 总和] 列表"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, labels=()):
+        """上下文管理器：记录代码块耗时"""
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _merge(target, shard):
+        for labels, counts in shard.items():
+            total = target.get(labels)
+            if total is None:
+                target[labels] = list(counts)
+            else:
+                for index, value in enumerate(counts):
+                    total[index] += value
+
+    def values(self):
+        """返回 {labels: (各桶累计计数, 总数, 总和)}"""
+        result = {}
+        for labels, counts in self._snapshot().items():
+            cumulative = []
+            running = 0
+            for value in counts[:-1]:
+                running += value
+                cumulative.append(running)
+            result[labels] = (cumulative, running, counts[-1])
+        return result
+
+    def quantile(self, q, cumulative, count):
+        """按分桶上界估计分位数（落在 +Inf 桶时返回最大有限上界）"""
+        if not count:
+            return None
+        rank = q * count
+        for bound, value in zip(self.buckets, cumulative):
+            if value >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+class Gauge:
+    """
+    读取时调用 func() 取值；func 返回数值，或 {labels: 数值}
+    kind 为 counter 时表示 func 读取的是已有的累计计数（如指令通道的重传数）
+    """
+
+    def __init__(self, name, help_text, func, label_names=(), kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.label_names = tuple(label_names)
+        self.kind = kind
+
+    def values(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return value
+        return {(): value}
+
+
+class InstrumentedLock:
+    """
+    带等待/持有时间统计的互斥锁，用法与 threading.Lock 相同；
+    wait_histogram 记录获取锁的等待时间，hold_histogram 记录持有时间
+    """
+
+    def __init__(self, name, wait_histogram, hold_histogram):
+        self._lock = threading.Lock()
+        self._labels = (name,)
+        self._wait = wait_histogram
+        self._hold = hold_histogram
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = now = time.perf_counter()
+            self._wait.observe(now - started, self._labels)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold.observe(held, self._labels)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry:
+    def __init__(self, prefix="car_server"):
+        self.prefix = prefix
+        self.metrics = []
+        self.started = time.time()
+
+    def _register(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}"
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name, help_text, func, label_names=(), kind="gauge"):
+        return self._register(Gauge(name, help_text, func, label_names, kind))
+
+    def render_prometheus(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            values = metric.values()
+            if metric.kind == "histogram":
+                for labels, (cumulative, count, total) in sorted(values.items()):
+                    for bound, value in zip(metric.buckets + (math.inf,), cumulative):
+                        label_text = _format_labels(metric.label_names, labels, (('le', _format_value(float(bound))),))
+                        lines.append(f"{metric.name}_bucket{label_text} {value}")
+                    label_text = _format_labels(metric.label_names, labels)
+                    lines.append(f"{metric.name}_sum{label_text} {_format_value(float(total))}")
+                    lines.append(f"{metric.name}_count{label_text} {count}")
+            else:
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{metric.name}{_format_labels(metric.label_names, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """JSON 格式：直方图给出计数、总和、均值和按分桶估计的分位数"""
+        result = {'uptime_s': round(time.time() - self.started, 1)}
+        for metric in self.metrics:
+            values = metric.values()
+            entries = []
+            for labels, value in sorted(values.items()):
+                entry = {'labels': dict(zip(metric.label_names, labels))}
+                if metric.kind == "histogram":
+                    cumulative, count, total = value
+                    entry.update({
+                        'count': count,
+                        'sum': total,
+                        'mean': total / count if count else None,
+                        'p50': metric.quantile(0.5, cumulative, count),
+                        'p99': metric.quantile(0.99, cumulative, count),
+                        'buckets': {str(bound): cumulative_count for bound, cumulative_count
+                                    in zip(metric.buckets + ('+Inf',), cumulative)}
+                    })
+                else:
+                    entry['value'] = value
+                entries.append(entry)
+            result[metric.name] = {'type': metric.kind, 'help': metric.help, 'values': entries}
+        return result
+
+
+registry = MetricsRegistry()
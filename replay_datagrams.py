@@ -0,0 +1,134 @@
+"""
+数据报回放 - 把记录的日志重新送入服务器的接收和广播路径
+接收记录按原批次送入 UDPServer._handle_car_batch，广播路径按日志时间每 broadcast_interval 运行一次；
+日志时间整体平移到回放时的单调时钟后作为接收时间和广播时间传入，样本年龄、门限和在线判断与 --speed 无关。
+发出的数据报写入计数套接字而不上网络。--speed 0 为尽快回放，可作为真实流量的吞吐量基准
+
+用法: python replay_datagrams.py recordings/xxx.dglog [--speed 1.0] [--no-broadcast] [--loops 1]
+"""
+
+import argparse
+import time
+
+import web_car_server
+from datagram_log import read_datagram_log, INBOUND, OUTBOUND_UNICAST, OUTBOUND_BROADCAST, DIRECTION_NAMES
+from server_log import setup_logging
+
+
+class CountingSocket:
+    """回放时代替发送套接字：只统计发出的数据报和字节数"""
+
+    def __init__(self):
+        self.datagrams = 0
+        self.bytes = 0
+
+    def sendto(self, data, address):
+        self.datagrams += 1
+        self.bytes += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def load_batches(path):
+    """读取日志，返回 (接收批次 [(timestamp, [(data, addr)])], 各方向记录数)"""
+    batches = []
+    counts = {direction: 0 for direction in DIRECTION_NAMES}
+    current_time = None
+    current = None
+    for timestamp, direction, address, data in read_datagram_log(path):
+        counts[direction] = counts.get(direction, 0) + 1
+        if direction != INBOUND:
+            continue
+        # 同一接收批次的记录共用一个时间戳
+        if timestamp != current_time:
+            current = []
+            batches.append((timestamp, current))
+            current_time = timestamp
+        current.append((data, address))
+    return batches, counts
+
+
+def replay(server, batches, speed, broadcast, clock_start):
+    """
+    回放一遍，日志中的时间 t 对应回放时钟 clock_start + (t - 日志起点)；
+    返回 (接收耗时, 广播耗时, 广播周期数, 回放时钟的结束时间)
+    """
+    if not batches:
+        return 0.0, 0.0, 0, clock_start
+    log_start = batches[0][0]
+    offset = clock_start - log_start
+    wall_start = time.monotonic()
+    next_broadcast = log_start
+    handle_time = 0.0
+    broadcast_time = 0.0
+    cycles = 0
+
+    for timestamp, batch in batches:
+        if speed > 0:
+            delay = (timestamp - log_start) / speed - (time.monotonic() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        # 广播路径按日志时间驱动，回放结果与速度无关
+        while broadcast and timestamp >= next_broadcast:
+            started = time.perf_counter()
+            server._broadcast_all_cars_data(next_broadcast + offset)
+            broadcast_time += time.perf_counter() - started
+            cycles += 1
+            next_broadcast += web_car_server.broadcast_interval
+
+        started = time.perf_counter()
+        server._handle_car_batch(batch, timestamp + offset)
+        handle_time += time.perf_counter() - started
+
+    return handle_time, broadcast_time, cycles, batches[-1][0] + offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放数据报日志")
+    parser.add_argument('path', help="数据报日志文件")
+    parser.add_argument('--speed', type=float, default=0.0, help="回放速度倍数，0 表示尽快回放")
+    parser.add_argument('--no-broadcast', action='store_true', help="不运行广播路径，只回放接收")
+    parser.add_argument('--loops', type=int, default=1, help="重复回放次数（吞吐量测试）")
+    args = parser.parse_args()
+
+    setup_logging()
+    load_start = time.perf_counter()
+    batches, counts = load_batches(args.path)
+    load_time = time.perf_counter() - load_start
+    inbound = counts[INBOUND]
+    print(f"📂 {args.path}: 接收 {inbound} 条（{len(batches)} 批），"
+          f"单播 {counts[OUTBOUND_UNICAST]} 条，广播 {counts[OUTBOUND_BROADCAST]} 条，读取耗时 {load_time * 1000:.1f}ms")
+    if batches:
+        print(f"⏱️ 日志时长 {batches[-1][0] - batches[0][0]:.2f}s")
+
+    server = web_car_server.udp_server
+    unicast_sink = CountingSocket()
+    broadcast_sink = CountingSocket()
+    server.socket = unicast_sink
+    server.broadcast_server.socket = broadcast_sink
+    # 回放不启动调度器，一个周期的帧在广播时刻一次发完
+    web_car_server.broadcast_frame_gap = 0.0
+
+    clock = time.monotonic()
+    for loop in range(args.loops):
+        wall_start = time.perf_counter()
+        # 每一遍接在上一遍之后，回放时钟不回退
+        clock = max(clock + web_car_server.broadcast_interval, time.monotonic())
+        handle_time, broadcast_time, cycles, clock = replay(server, batches, args.speed,
+                                                            not args.no_broadcast, clock)
+        wall = time.perf_counter() - wall_start
+        print(f"🔁 第 {loop + 1} 遍: 总耗时 {wall * 1000:.1f}ms, "
+              f"接收 {inbound / handle_time if handle_time else 0:,.0f} 条/秒 "
+              f"（{handle_time / max(inbound, 1) * 1e6:.2f}us/条）, "
+              f"广播 {cycles} 个周期, 平均 {broadcast_time / max(cycles, 1) * 1000:.3f}ms/周期")
+
+    print(f"📤 回放产生: 单播 {unicast_sink.datagrams} 条 / {unicast_sink.bytes} 字节, "
+          f"广播 {broadcast_sink.datagrams} 条 / {broadcast_sink.bytes} 字节")
+    print(f"🚗 小车数量: {len(web_car_server.cars.snapshot)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+单调时钟调度器 - 用一个线程按截止时间运行周期任务
+基于 time.monotonic()，不受系统时间跳变影响；
+下一次截止时间 = 上一次截止时间 + 周期，避免累积漂移，并统计每个任务的抖动和超时。
+trigger() 在周期之外安排一次立即运行，窗口内的多次触发合并为一次；
+call_at() 在指定时刻运行一次任意函数（如广播的后续帧），任务之间不需要 sleep
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from server_log import get_logger
+
+log = get_logger("scheduler")
+
+# 堆条目的种类：周期运行、周期外触发、一次性调用
+_PERIODIC = "periodic"
+_TRIGGERED = "triggered"
+_CALL = "call"
+
+
+class ScheduledTask:
+    """一个周期任务及其运行统计"""
+
+    __slots__ = ('name', 'func', 'interval', 'next_deadline', 'generation',
+                 'trigger_func', 'trigger_pending', 'triggered_runs', 'coalesced_triggers',
+                 'runs', 'errors', 'overruns', 'skipped',
+                 'lateness_sum', 'lateness_sq_sum', 'lateness_max',
+                 'duration_last', 'duration_sum', 'duration_max')
+
+    def __init__(self, name, func, interval, trigger_func=None):
+        self.name = name
+        self.func = func
+        self.interval = interval  # 秒，或返回秒数的可调用对象（支持运行时修改周期）
+        self.next_deadline = 0.0
+        self.generation = 0  # 重新排期时递增，堆中旧条目作废
+        self.trigger_func = trigger_func or func  # 周期外触发时运行的函数
+        self.trigger_pending = False
+        self.triggered_runs = 0
+        self.coalesced_triggers = 0  # 被合并掉的触发次数
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0  # 运行结束时已经错过下一个截止时间的次数
+        self.skipped = 0  # 因超时被跳过的周期数
+        self.lateness_sum = 0.0
+        self.lateness_sq_sum = 0.0
+        self.lateness_max = 0.0
+        self.duration_last = 0.0
+        self.duration_sum = 0.0
+        self.duration_max = 0.0
+
+    def current_interval(self):
+        interval = self.interval() if callable(self.interval) else self.interval
+        return max(interval, 0.001)
+
+    def record(self, lateness, duration):
+        self.runs += 1
+        self.lateness_sum += lateness
+        self.lateness_sq_sum += lateness * lateness
+        if lateness > self.lateness_max:
+            self.lateness_max = lateness
+        self.duration_last = duration
+        self.duration_sum += duration
+        if duration > self.duration_max:
+            self.duration_max = duration
+
+    def stats(self):
+        runs = self.runs or 1
+        lateness_mean = self.lateness_sum / runs
+        lateness_var = max(self.lateness_sq_sum / runs - lateness_mean ** 2, 0.0)
+        return {
+            'interval_ms': self.current_interval() * 1000,
+            'runs': self.runs,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'skipped_cycles': self.skipped,
+            'triggered_runs': self.triggered_runs,
+            'coalesced_triggers': self.coalesced_triggers,
+            'jitter_mean_ms': lateness_mean * 1000,
+            'jitter_std_ms': lateness_var ** 0.5 * 1000,
+            'jitter_max_ms': self.lateness_max * 1000,
+            'duration_last_ms': self.duration_last * 1000,
+            'duration_mean_ms': self.duration_sum / runs * 1000,
+            'duration_max_ms': self.duration_max * 1000
+        }
+
+
+class MonotonicScheduler:
+    """
+    截止时间驱动的调度器：所有周期任务在同一个工作线程中按截止时间顺序运行，
+    任务不应在线程上 sleep，需要间隔执行的后续步骤用 call_at() 排到各自的截止时间
+    """
+
+    def __init__(self, name="scheduler"):
+        self.name = name
+        self.tasks = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = None
+        self.running = False
+        self.calls = 0  # 已运行的一次性调用
+        self.call_errors = 0
+
+    def add_task(self, name, func, interval, start_delay=0.0, trigger_func=None):
+        """
+        注册周期任务；interval 可以是秒数或返回秒数的函数，
+        trigger_func 为周期外触发时运行的函数（默认与 func 相同）
+        """
+        task = ScheduledTask(name, func, interval, trigger_func)
+        with self._cond:
+            self.tasks[name] = task
+            self._push(task, time.monotonic() + start_delay)
+            self._cond.notify()
+        return task
+
+    def _push(self, task, deadline):
+        """登记任务的下一次截止时间（调用方需持锁）"""
+        task.generation += 1
+        task.next_deadline = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), task, task.generation, _PERIODIC))
+
+    def trigger(self, name, delay=0.0):
+        """
+        在 delay 秒后于调度线程上额外运行一次任务（不改变周期节拍）；
+        已有待运行的触发，或周期运行本来就会在窗口内到来时，本次触发被合并
+        """
+        with self._cond:
+            task = self.tasks.get(name)
+            if task is None:
+                return False
+            now = time.monotonic()
+            deadline = now + delay
+            periodic_soon = task.trigger_func is task.func and now <= task.next_deadline <= deadline
+            if task.trigger_pending or periodic_soon:
+                task.coalesced_triggers += 1
+                return False
+            task.trigger_pending = True
+            heapq.heappush(self._heap, (deadline, next(self._counter), task, None, _TRIGGERED))
+            self._cond.notify()
+        return True
+
+    def call_at(self, deadline, func):
+        """在单调时间 deadline（已过去时尽快）于调度线程上运行一次 func()"""
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), func, None, _CALL))
+            self._cond.notify()
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+
+    def _next_due(self):
+        """
+        等待并取出下一个到期条目，返回 (task, deadline, kind)；停止时返回 (None, None, None)
+        kind 为 _CALL 时 task 是 call_at() 登记的函数
+        """
+        with self._cond:
+            while self.running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, task, generation, kind = self._heap[0]
+                if kind == _PERIODIC and generation != task.generation:
+                    heapq.heappop(self._heap)  # 已被重新排期的旧条目
+                    continue
+                wait = deadline - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                if kind == _TRIGGERED:
+                    task.trigger_pending = False
+                return task, deadline, kind
+        return None, None, None
+
+    def _run(self):
+        while self.running:
+            task, deadline, kind = self._next_due()
+            if task is None:
+                break
+
+            if kind == _CALL:
+                self.calls += 1
+                try:
+                    task()
+                except Exception as e:
+                    self.call_errors += 1
+                    log.error("❌ 调度调用 %s 出错: %s", getattr(task, '__name__', task), e,
+                              extra={'rate_limit': 1.0})
+                continue
+
+            if kind == _TRIGGERED:
+                task.triggered_runs += 1
+                try:
+                    task.trigger_func()
+                except Exception as e:
+                    task.errors += 1
+                    log.error("❌ 调度任务 %s 触发运行出错: %s", task.name, e, extra={'rate_limit': 1.0})
+                continue
+
+            started = time.monotonic()
+            try:
+                task.func()
+            except Exception as e:
+                task.errors += 1
+                log.error("❌ 调度任务 %s 出错: %s", task.name, e, extra={'rate_limit': 1.0})
+            finished = time.monotonic()
+            task.record(started - deadline, finished - started)
+
+            # 按原截止时间推进，保持固定节拍；已经错过的周期直接跳过
+            interval = task.current_interval()
+            next_deadline = deadline + interval
+            if next_deadline <= finished:
+                task.overruns += 1
+                missed = int((finished - deadline) // interval)
+                task.skipped += missed
+                next_deadline = deadline + (missed + 1) * interval
+
+            with self._cond:
+                # 运行期间被外部重新排期时保留外部设定的时间
+                if task.next_deadline == deadline:
+                    self._push(task, next_deadline)
+
+    def stats(self):
+        return {name: task.stats() for name, task in self.tasks.items()}
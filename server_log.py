@@ -0,0 +1,177 @@
+"""
+服务器日志 - 队列化后台输出
+热路径只做级别判断和入队，格式化与写 stdout 在后台线程完成；
+支持按调用位置限速/采样，以及 JSON Lines 结构化输出
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOGGER_NAME = "car_server"
+LOG_QUEUE_SIZE = 10000  # 队列满时丢弃新日志而不是阻塞调用线程
+
+# 环境变量配置：CAR_SERVER_LOG_LEVEL=DEBUG，CAR_SERVER_LOG_JSON=1
+DEFAULT_LEVEL = os.environ.get("CAR_SERVER_LOG_LEVEL", "INFO")
+DEFAULT_JSON = os.environ.get("CAR_SERVER_LOG_JSON", "0") == "1"
+
+_listener = None
+_queue_handler = None
+
+# 日志记录上的标准属性，其余属性视为 extra 字段
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+_CONTROL_ATTRS = {"rate_limit", "sample", "suppressed"}
+
+
+def get_logger(name=None):
+    """获取服务器日志器（子模块传入自己的名字）"""
+    if name:
+        return logging.getLogger(f"{LOGGER_NAME}.{name}")
+    return logging.getLogger(LOGGER_NAME)
+
+
+class SiteRateLimitFilter(logging.Filter):
+    """
+    按调用位置（文件+行号）限速或采样：
+    extra={'rate_limit': 1.0} 表示该位置每秒最多一条，
+    extra={'sample': 100} 表示该位置每100条输出一条；被丢弃的条数附在下一条输出上
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sites = {}  # (pathname, lineno) -> [下次允许时间或计数, 已抑制条数]
+
+    def filter(self, record):
+        rate_limit = getattr(record, "rate_limit", None)
+        sample = getattr(record, "sample", None)
+        if not rate_limit and not sample:
+            return True
+
+        key = (record.pathname, record.lineno)
+        state = self.sites.get(key)
+        if state is None:
+            state = self.sites[key] = [0, 0]
+
+        if rate_limit:
+            now = time.monotonic()
+            if now < state[0]:
+                state[1] += 1
+                return False
+            state[0] = now + rate_limit
+        else:
+            state[0] += 1
+            if (state[0] - 1) % sample:
+                state[1] += 1
+                return False
+
+        if state[1]:
+            record.suppressed = state[1]
+            state[1] = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，保证调用线程不被阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 在调用线程上合并消息和参数：参数可能是之后会被修改的字典或列表，
+        # 留到后台线程再格式化会输出修改后的值；其余格式化（时间、JSON）仍在后台线程完成
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PlainFormatter(logging.Formatter):
+    """与原先 print 输出接近的文本格式"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(message)s", datefmt="%H:%M:%S")
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (已抑制 {suppressed} 条)"
+        return text
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条日志一行JSON，extra 中的字段原样输出"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "site": f"{record.module}:{record.lineno}",
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key not in _CONTROL_ATTRS:
+                entry[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=DEFAULT_LEVEL, json_lines=DEFAULT_JSON, stream=None):
+    """配置日志：调用线程只入队，后台线程负责格式化和输出，可重复调用以切换配置"""
+    global _listener, _queue_handler
+
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonLinesFormatter() if json_lines else PlainFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(SiteRateLimitFilter())
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers[:] = [_queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    return logger
+
+
+def set_level(level):
+    """运行时调整日志级别"""
+    logging.getLogger(LOGGER_NAME).setLevel(level)
+
+
+def get_stats():
+    """日志子系统状态：级别、队列积压、丢弃条数"""
+    logger = logging.getLogger(LOGGER_NAME)
+    return {
+        "level": logging.getLevelName(logger.level),
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+    }
+
+
+def shutdown_logging():
+    """停止后台输出线程并刷新剩余日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
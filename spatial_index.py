@@ -0,0 +1,157 @@
+"""
+空间索引 - 小车位置的均匀网格
+每个格子保存落在其中的小车ID集合，位置更新时只有跨格的小车需要移动，
+半径查询和 k 近邻只检查查询点附近的格子，耗时与车队总规模基本无关
+"""
+
+import math
+import threading
+
+
+class SpatialGrid:
+    """
+    update()/remove() 由接收线程和清理任务调用，near()/nearest() 可在任意线程调用，
+    各操作短暂持同一把锁（不与 car_lock 嵌套）
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}  # (cx, cy) -> {car_id}
+        self.positions = {}  # car_id -> (x, y, (cx, cy))
+        self.moves = 0  # 跨格移动次数
+        self._lock = threading.Lock()
+
+    def _cell(self, x, y):
+        size = self.cell_size
+        return (math.floor(x / size), math.floor(y / size))
+
+    def update(self, car_ids, xs, ys):
+        """批量更新位置（各参数为等长序列），新车自动加入"""
+        with self._lock:
+            cells = self.cells
+            positions = self.positions
+            size = self.cell_size
+            floor = math.floor
+            isfinite = math.isfinite
+            for car_id, x, y in zip(car_ids, xs, ys):
+                if not (isfinite(x) and isfinite(y)):
+                    continue  # 无效坐标不进入索引，保留上一次位置
+                cell = (floor(x / size), floor(y / size))
+                previous = positions.get(car_id)
+                if previous is None or previous[2] != cell:
+                    if previous is not None:
+                        old = cells[previous[2]]
+                        old.discard(car_id)
+                        if not old:
+                            del cells[previous[2]]
+                        self.moves += 1
+                    members = cells.get(cell)
+                    if members is None:
+                        members = cells[cell] = set()
+                    members.add(car_id)
+                positions[car_id] = (x, y, cell)
+
+    def remove(self, car_id):
+        with self._lock:
+            previous = self.positions.pop(car_id, None)
+            if previous is not None:
+                members = self.cells[previous[2]]
+                members.discard(car_id)
+                if not members:
+                    del self.cells[previous[2]]
+
+    def position(self, car_id):
+        """小车在索引中的位置 (x, y)，不在索引中时返回None"""
+        entry = self.positions.get(car_id)
+        return entry[:2] if entry is not None else None
+
+    def near(self, x, y, radius, accept=None):
+        """半径 radius 内的小车，返回按距离升序的 [(car_id, 距离), ...]；accept(car_id) 为假的小车被跳过"""
+        min_cx, min_cy = self._cell(x - radius, y - radius)
+        max_cx, max_cy = self._cell(x + radius, y + radius)
+        limit = radius * radius
+        found = []
+        with self._lock:
+            cells = self.cells
+            positions = self.positions
+            # 半径很大时遍历已占用的格子比遍历范围内所有格子更快
+            if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+                candidates = (members for (cx, cy), members in cells.items()
+                              if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy)
+            else:
+                candidates = (cells[(cx, cy)] for cx in range(min_cx, max_cx + 1)
+                              for cy in range(min_cy, max_cy + 1) if (cx, cy) in cells)
+            for members in candidates:
+                for car_id in members:
+                    px, py, _ = positions[car_id]
+                    distance = (px - x) ** 2 + (py - y) ** 2
+                    if distance <= limit and (accept is None or accept(car_id)):
+                        found.append((distance, car_id))
+        found.sort()
+        return [(car_id, math.sqrt(distance)) for distance, car_id in found]
+
+    def nearest(self, x, y, k, exclude=None, accept=None):
+        """
+        距 (x, y) 最近的 k 辆小车（不含 exclude），返回按距离升序的 [(car_id, 距离), ...]
+        以查询点所在格子为中心逐圈向外扩展，第 ring 圈之外的小车距离至少为 ring * cell_size，
+        已找到 k 辆且第 k 近的距离不超过该下界时停止；扩展范围超过已占用格子数时改为检查全部小车
+        """
+        if k <= 0:
+            return []
+        center_x, center_y = self._cell(x, y)
+        size = self.cell_size
+        found = []
+        with self._lock:
+            cells = self.cells
+            positions = self.positions
+            remaining = len(positions)  # 尚未检查的小车数，全部检查完即可停止
+            ring = 0
+            while remaining:
+                if (2 * ring + 1) ** 2 > 4 * len(cells):
+                    # 小车分布稀疏（或查询点远离车队）时逐圈扩展代价过高，直接检查全部小车
+                    found = [((px - x) ** 2 + (py - y) ** 2, car_id)
+                             for car_id, (px, py, _) in positions.items()
+                             if car_id != exclude and (accept is None or accept(car_id))]
+                    break
+                for cell in self._ring_cells(center_x, center_y, ring):
+                    members = cells.get(cell)
+                    if not members:
+                        continue
+                    remaining -= len(members)
+                    for car_id in members:
+                        if car_id == exclude or (accept is not None and not accept(car_id)):
+                            continue
+                        px, py, _ = positions[car_id]
+                        found.append(((px - x) ** 2 + (py - y) ** 2, car_id))
+                if len(found) >= k:
+                    found.sort()
+                    bound = ring * size
+                    if found[k - 1][0] <= bound * bound:
+                        break
+                ring += 1
+        found.sort()
+        return [(car_id, math.sqrt(distance)) for distance, car_id in found[:k]]
+
+    @staticmethod
+    def _ring_cells(center_x, center_y, ring):
+        """以 (center_x, center_y) 为中心、切比雪夫距离为 ring 的一圈格子"""
+        if ring == 0:
+            yield (center_x, center_y)
+            return
+        for cx in range(center_x - ring, center_x + ring + 1):
+            yield (cx, center_y - ring)
+            yield (cx, center_y + ring)
+        for cy in range(center_y - ring + 1, center_y + ring):
+            yield (center_x - ring, cy)
+            yield (center_x + ring, cy)
+
+    def stats(self):
+        with self._lock:
+            occupied = len(self.cells)
+            return {
+                'cell_size': self.cell_size,
+                'cars': len(self.positions),
+                'occupied_cells': occupied,
+                'max_per_cell': max((len(members) for members in self.cells.values()), default=0),
+                'moves': self.moves
+            }
@@ -0,0 +1,84 @@
+"""
+数据年龄统计 - 从 recvfrom 到广播发出的端到端滞后
+接收线程为每批数据报打上单调时间戳，广播路径在每帧发出时计算帧内各车样本的年龄并记录到这里；
+每辆小车、每个帧序号（一个周期内的第几帧）各保留最近 window 个年龄，查询时给出 p50/p99/max
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def age_distribution(ages):
+    """年龄序列（秒）的分布摘要（毫秒），空序列返回None"""
+    if not ages:
+        return None
+    values = np.fromiter(ages, dtype=np.float64, count=len(ages)) * 1000.0
+    p50, p99 = np.percentile(values, (50, 99))
+    return {
+        'count': len(values),
+        'p50_ms': round(float(p50), 2),
+        'p99_ms': round(float(p99), 2),
+        'max_ms': round(float(values.max()), 2),
+        'last_ms': round(float(values[-1]), 2)
+    }
+
+
+class StalenessTracker:
+    """
+    record() 由广播线程调用，stats() 可在任意线程调用；
+    两者都只短暂持锁，统计计算在锁外对拷贝进行
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.per_car = {}  # car_id -> deque(年龄)
+        self.per_group = {}  # 帧序号 -> deque(年龄)
+        self.frames = 0
+        self._lock = threading.Lock()
+
+    def record(self, car_ids, group_index, ages):
+        """记录一帧中各辆小车样本发出时的年龄（秒）"""
+        with self._lock:
+            self.frames += 1
+            group = self.per_group.get(group_index)
+            if group is None:
+                group = self.per_group[group_index] = deque(maxlen=self.window)
+            group.extend(ages)
+            per_car = self.per_car
+            for car_id, age in zip(car_ids, ages):
+                history = per_car.get(car_id)
+                if history is None:
+                    history = per_car[car_id] = deque(maxlen=self.window)
+                history.append(age)
+
+    def forget(self, car_id):
+        """小车被删除时丢弃其记录"""
+        with self._lock:
+            self.per_car.pop(car_id, None)
+
+    def reset(self):
+        with self._lock:
+            self.per_car.clear()
+            self.per_group.clear()
+            self.frames = 0
+
+    def stats(self, car_id=None):
+        """返回整体、每个帧序号和每辆小车的年龄分布；指定 car_id 时只返回该车（没有记录时为None）"""
+        with self._lock:
+            if car_id is not None:
+                history = self.per_car.get(car_id)
+                return age_distribution(list(history)) if history else None
+            per_car = {key: list(values) for key, values in self.per_car.items()}
+            per_group = {key: list(values) for key, values in self.per_group.items()}
+            frames = self.frames
+
+        overall = [age for values in per_car.values() for age in values]
+        return {
+            'window': self.window,
+            'frames': frames,
+            'overall': age_distribution(overall),
+            'groups': {str(key): age_distribution(values) for key, values in sorted(per_group.items())},
+            'cars': {key: age_distribution(values) for key, values in sorted(per_car.items())}
+        }
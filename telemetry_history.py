@@ -0,0 +1,168 @@
+"""
+遥测历史 - 每车一个定长环形缓冲区
+所有缓冲区在创建时一次性分配为 (max_cars, depth) 的数组，内存占用与车队规模无关；
+车辆数超过 max_cars 时复用最久未更新的那一行。查询时在服务器端降采样（抽取或 LTTB）
+"""
+
+import threading
+
+import numpy as np
+
+HISTORY_FIELDS = ('x', 'y', 'heading', 'speed', 'battery')
+HISTORY_METHODS = ("lttb", "decimate")
+
+
+def decimate_indices(count, max_points):
+    """等间隔抽取 max_points 个下标（保留首尾）"""
+    if count <= max_points:
+        return np.arange(count)
+    return np.unique(np.linspace(0, count - 1, max_points).round().astype(np.intp))
+
+
+def lttb_indices(t, values, max_points):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回选中的下标（保留首尾点）
+    每个桶选出与前一个选中点、下一个桶均值构成三角形面积最大的点，保留曲线的峰谷
+    """
+    count = len(values)
+    if count <= max_points or max_points < 3:
+        return decimate_indices(count, max_points)
+
+    edges = np.linspace(1, count - 1, max_points - 1).astype(np.intp)
+    selected = np.empty(max_points, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_t = t[end:next_end].mean() if next_end > end else t[count - 1]
+        next_v = values[end:next_end].mean() if next_end > end else values[count - 1]
+
+        bucket_t = t[start:end]
+        bucket_v = values[start:end]
+        area = np.abs((t[previous] - next_t) * (bucket_v - values[previous])
+                      - (t[previous] - bucket_t) * (next_v - values[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+class TelemetryHistory:
+    """
+    环形缓冲区：第 row 行保存一辆小车最近 depth 个样本，heads[row] 为累计写入数（对 depth 取模即写入位置）
+    record() 由接收线程调用，query() 可在任意线程调用（短暂持锁拷贝所需区间）
+    """
+
+    def __init__(self, max_cars, depth):
+        self.max_cars = max_cars
+        self.depth = depth
+        self.t = np.zeros((max_cars, depth), dtype=np.float64)
+        self.columns = {name: np.zeros((max_cars, depth), dtype=np.float32) for name in HISTORY_FIELDS}
+        self.heads = np.zeros(max_cars, dtype=np.int64)  # 累计写入样本数
+        self.last_write = np.zeros(max_cars)
+        self.rows = {}  # car_id -> 行号
+        self.row_owner = [None] * max_cars
+        self.free_rows = list(range(max_cars - 1, -1, -1))
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def memory_bytes(self):
+        return self.t.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def _row(self, car_id, timestamp):
+        """取得小车的行号，行已用完时复用最久未写入的行（调用方需持锁）"""
+        row = self.rows.get(car_id)
+        if row is not None:
+            return row
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            row = int(np.argmin(self.last_write))
+            del self.rows[self.row_owner[row]]
+            self.evictions += 1
+        self.rows[car_id] = row
+        self.row_owner[row] = car_id
+        self.heads[row] = 0
+        self.last_write[row] = timestamp
+        return row
+
+    def record(self, car_ids, timestamps, x, y, heading, vx, vy, battery):
+        """
+        追加一批样本（各参数为等长序列，同一辆小车可出现多次，按顺序写入）；
+        timestamps 为各样本的接收时间，须来自单调时钟，同一辆小车的时间不减，query() 依赖这一点做二分查找
+        """
+        speed = np.hypot(np.asarray(vx, dtype=np.float64), np.asarray(vy, dtype=np.float64))
+        if not car_ids:
+            return
+        with self._lock:
+            rows = []
+            positions = []
+            for car_id, timestamp in zip(car_ids, timestamps):
+                row = self._row(car_id, timestamp)
+                head = int(self.heads[row])
+                rows.append(row)
+                positions.append(head % self.depth)
+                self.heads[row] = head + 1
+            self.last_write[rows] = timestamps
+            self.t[rows, positions] = timestamps
+            for name, values in zip(HISTORY_FIELDS, (x, y, heading, speed, battery)):
+                self.columns[name][rows, positions] = values
+
+    def forget(self, car_id):
+        """小车被删除时释放其行"""
+        with self._lock:
+            row = self.rows.pop(car_id, None)
+            if row is not None:
+                self.row_owner[row] = None
+                self.heads[row] = 0
+                self.last_write[row] = 0.0
+                self.free_rows.append(row)
+
+    def _ordered(self, row):
+        """按时间顺序拷贝一行的有效样本（调用方需持锁）"""
+        head = int(self.heads[row])
+        if head <= self.depth:
+            order = slice(0, head)
+            return self.t[row, order].copy(), {name: column[row, order].copy()
+                                                for name, column in self.columns.items()}
+        start = head % self.depth
+        return (np.roll(self.t[row], -start),
+                {name: np.roll(column[row], -start) for name, column in self.columns.items()})
+
+    def query(self, car_id, start=None, end=None, max_points=500, method="lttb", value="speed"):
+        """
+        返回 [start, end] 时间范围内降采样后的历史 {'t': [...], 'x': [...], ...}，
+        以及范围内的原始样本数；小车没有历史时返回None
+        """
+        with self._lock:
+            row = self.rows.get(car_id)
+            if row is None:
+                return None
+            t, columns = self._ordered(row)
+
+        lo = np.searchsorted(t, start, side='left') if start is not None else 0
+        hi = np.searchsorted(t, end, side='right') if end is not None else len(t)
+        t = t[lo:hi]
+        columns = {name: values[lo:hi] for name, values in columns.items()}
+
+        if method == "lttb":
+            indices = lttb_indices(t, columns[value].astype(np.float64), max_points)
+        else:
+            indices = decimate_indices(len(t), max_points)
+
+        points = {'t': t[indices].round(3).tolist()}
+        for name, values in columns.items():
+            points[name] = values[indices].astype(np.float64).round(3).tolist()
+        return points, len(t)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_cars': self.max_cars,
+                'depth': self.depth,
+                'cars': len(self.rows),
+                'memory_bytes': self.memory_bytes(),
+                'samples': int(self.heads.sum()),
+                'evictions': self.evictions
+            }
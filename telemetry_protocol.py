@@ -0,0 +1,449 @@
+"""
+遥测协议 - 文本格式与紧凑二进制格式
+文本格式保持与现有小车兼容；二进制帧以魔数字节开头，可与文本格式共存
+"""
+
+import struct
+import threading
+
+# 二进制帧公共头：魔数、版本、帧类型、标志位
+FRAME_MAGIC = 0xA7
+PROTOCOL_VERSION = 1
+
+FRAME_TELEMETRY = 0x01  # 上行：单车遥测
+FRAME_FLEET_STATE = 0x02  # 下行：多车状态广播
+FRAME_FORMATION = 0x03  # 下行：编队指令广播
+FRAME_TARGETS = 0x04  # 下行：服务器计算的目标位姿批量帧
+
+FLAG_TIMESTAMP = 0x01  # 上行帧携带发送端时间戳
+FLAG_AGE = 0x02  # 下行状态帧的每个条目附带数据年龄（毫秒）
+
+FRAME_HEADER = struct.Struct('<BBBB')
+
+# 上行遥测：车号、序列号、x、y、yaw、电压、vx、vy、vz，可选 float64 时间戳
+TELEMETRY_FRAME = struct.Struct('<BBBBHI7f')
+TELEMETRY_FRAME_TS = struct.Struct('<BBBBHI7fd')
+
+# 下行广播：帧头 + 序列号 + 车辆数，之后每车一个条目
+FLEET_HEADER = struct.Struct('<BBBBHB')
+FLEET_ENTRY = struct.Struct('<H6f')
+FLEET_ENTRY_AGE = struct.Struct('<H6fH')  # FLAG_AGE 时的条目：末尾为发出时该样本的年龄（毫秒）
+FLEET_AGE = struct.Struct('<H')
+FLEET_POSE = struct.Struct('<3f')  # 条目中紧跟车号的 x, y, yaw
+FLEET_POSE_OFFSET = struct.calcsize('<H')
+FLEET_AGE_MAX_MS = 0xFFFF
+FLEET_MAX_ENTRIES = 255
+
+# 下行编队帧：帧头 + 编队纪元 + 动作 + 队形 + 领航者车号 + 分片序号/分片数 + 条目数，
+# 之后每车一个 (车号, x, y, yaw) 偏移；同一纪元的重复帧和分片由小车按纪元去重
+FORMATION_HEADER = struct.Struct('<BBBBHBBHBBB')
+FORMATION_ENTRY = struct.Struct('<H3f')
+FORMATION_ACTIONS = {'start': 1, 'custom': 2, 'update': 3, 'stop': 4}
+FORMATION_TYPE_CODES = {'line': 0, 'triangle': 1, 'square': 2, 'custom': 3}
+
+# 下行目标位姿帧：帧头与多车状态帧相同，每车一个 (车号, x, y, heading) 条目
+TARGET_HEADER = FLEET_HEADER
+TARGET_ENTRY = struct.Struct('<H3f')
+
+# 没有数字后缀（或编号超出范围）的小车从这里开始分配车号
+DYNAMIC_CAR_NUMBER_BASE = 0x8000
+
+
+class CarIdTable:
+    """
+    小车ID与紧凑车号的对照表，车辆数量不设上限
+    CARn 直接使用 n（与现有固件一致），其它ID从 DYNAMIC_CAR_NUMBER_BASE 起依次分配；
+    短ID（文本下行中的 "C12"）与车号一一对应，不会因只取末位数字而冲突；
+    接收线程和广播/调度线程都会登记新ID，已登记的查询不加锁，登记在锁内进行
+    """
+
+    def __init__(self):
+        self.numbers = {}  # 小车ID -> 车号
+        self.ids = {}  # 车号 -> 小车ID
+        self.short_ids = {}  # 小车ID -> 短ID
+        self._next_dynamic = DYNAMIC_CAR_NUMBER_BASE
+        self._lock = threading.Lock()
+
+    def number(self, car_id):
+        """小车ID对应的车号（首次出现时登记）"""
+        num = self.numbers.get(car_id)
+        if num is not None:
+            return num
+
+        with self._lock:
+            # 等锁期间可能已被其他线程登记
+            num = self.numbers.get(car_id)
+            if num is not None:
+                return num
+            num = car_number(car_id)
+            if num is None or num >= DYNAMIC_CAR_NUMBER_BASE or num in self.ids:
+                while self._next_dynamic in self.ids:
+                    self._next_dynamic += 1
+                if self._next_dynamic > 0xFFFF:
+                    raise ValueError("车号已用尽")
+                num = self._next_dynamic
+            self.ids[num] = car_id
+            self.numbers[car_id] = num
+            return num
+
+    def car_id(self, num):
+        """车号对应的小车ID，未登记的车号按 CARn 解释"""
+        car_id = self.ids.get(num)
+        if car_id is not None:
+            return car_id
+
+        with self._lock:
+            car_id = self.ids.get(num)
+            if car_id is None:
+                car_id = f"CAR{num}"
+                self.numbers.setdefault(car_id, num)
+                self.ids[num] = car_id
+            return car_id
+
+    def short_id(self, car_id):
+        """文本下行使用的短ID：CAR12 -> C12"""
+        short_id = self.short_ids.get(car_id)
+        if short_id is None:
+            short_id = self.short_ids[car_id] = f"C{self.number(car_id)}"
+        return short_id
+
+
+car_id_table = CarIdTable()
+
+
+def is_binary_frame(data):
+    """根据首字节魔数判断是否为二进制帧"""
+    return len(data) >= FRAME_HEADER.size and data[0] == FRAME_MAGIC
+
+
+def car_number(car_id):
+    """从小车ID中提取数字编号（CAR12 -> 12），没有数字后缀时返回None"""
+    digits = len(car_id)
+    while digits > 0 and car_id[digits - 1].isdigit():
+        digits -= 1
+    if digits == len(car_id):
+        return None
+    return int(car_id[digits:])
+
+
+def parse_text_telemetry(text):
+    """
+    解析文本遥测 "CARx:x,y,yaw,voltage,vx,vy,vz"
+    返回 (car_id, x, y, yaw, voltage, vx, vy, vz, sequence, timestamp)，无效数据返回None
+    """
+    text = text.strip()
+    if not text:
+        return None
+
+    parts = text.split(':')
+    if len(parts) != 2:
+        return None
+
+    values = parts[1].split(',')
+    if len(values) < 7:
+        return None
+
+    return (parts[0],
+            float(values[0]), float(values[1]), float(values[2]), float(values[3]),
+            float(values[4]), float(values[5]), float(values[6]),
+            None, None)
+
+
+def encode_telemetry(car_num, sequence, x, y, yaw, voltage, vx, vy, vz, timestamp=None):
+    """编码上行二进制遥测帧"""
+    if timestamp is None:
+        return TELEMETRY_FRAME.pack(FRAME_MAGIC, PROTOCOL_VERSION, FRAME_TELEMETRY, 0,
+                                    car_num, sequence & 0xFFFFFFFF,
+                                    x, y, yaw, voltage, vx, vy, vz)
+    return TELEMETRY_FRAME_TS.pack(FRAME_MAGIC, PROTOCOL_VERSION, FRAME_TELEMETRY, FLAG_TIMESTAMP,
+                                   car_num, sequence & 0xFFFFFFFF,
+                                   x, y, yaw, voltage, vx, vy, vz, timestamp)
+
+
+def parse_binary_telemetry(data):
+    """
+    解析上行二进制遥测帧
+    返回格式与 parse_text_telemetry 相同，版本/类型不匹配或长度错误时返回None
+    """
+    size = len(data)
+    if size < TELEMETRY_FRAME.size:
+        return None
+
+    if data[3] & FLAG_TIMESTAMP:
+        if size < TELEMETRY_FRAME_TS.size:
+            return None
+        (_, version, frame_type, _, car_num, sequence,
+         x, y, yaw, voltage, vx, vy, vz, timestamp) = TELEMETRY_FRAME_TS.unpack_from(data)
+    else:
+        (_, version, frame_type, _, car_num, sequence,
+         x, y, yaw, voltage, vx, vy, vz) = TELEMETRY_FRAME.unpack_from(data)
+        timestamp = None
+
+    if version != PROTOCOL_VERSION or frame_type != FRAME_TELEMETRY:
+        return None
+
+    car_id = car_id_table.ids.get(car_num)
+    if car_id is None:
+        car_id = car_id_table.car_id(car_num)
+
+    return (car_id, x, y, yaw, voltage, vx, vy, vz, sequence, timestamp)
+
+
+def parse_telemetry(data):
+    """解析一个上行数据报（bytes），自动识别二进制帧和文本格式"""
+    if data and data[0] == FRAME_MAGIC:
+        return parse_binary_telemetry(data)
+    return parse_text_telemetry(data.decode('utf-8', errors='ignore'))
+
+
+# 指令确认：服务器在指令末尾附加 "|SEQ:n"，小车回复 "ACK:CAR1,n"；
+# 重传沿用同一序列号，小车据此丢弃重复指令并再次确认
+COMMAND_SEQ_TAG = "|SEQ:"
+COMMAND_ACK_PREFIX = b"ACK:"
+
+
+def tag_command(message, sequence):
+    """给指令附加序列号"""
+    return f"{message}{COMMAND_SEQ_TAG}{sequence}"
+
+
+def split_command_tag(text):
+    """拆出指令中的序列号："CTRL:...|SEQ:12" -> ("CTRL:...", 12)，没有序列号时为 (text, None)"""
+    message, tag, sequence = text.rpartition(COMMAND_SEQ_TAG)
+    if not tag:
+        return text, None
+    try:
+        return message, int(sequence)
+    except ValueError:
+        return text, None
+
+
+def parse_command_ack(data):
+    """解析小车确认 "ACK:CAR1,12"，返回 (car_id, sequence)，格式不符返回None"""
+    if not data.startswith(COMMAND_ACK_PREFIX):
+        return None
+    try:
+        car_id, sequence = data[len(COMMAND_ACK_PREFIX):].decode('utf-8', errors='ignore').strip().split(',')
+        return car_id, int(sequence)
+    except ValueError:
+        return None
+
+
+def format_text_entry(short_id, x, y, yaw, vx, vy, vz):
+    """下行文本格式中的单车条目"""
+    return f"{short_id} {x:.2f} {y:.2f} {yaw:.1f} {vx:.4f} {vy:.4f} {vz:.4f}"
+
+
+def encode_text_fleet_frame(entries):
+    """
+    编码下行文本广播 "[n C1 x y yaw vx vy vz ...]"
+    entries 为 (short_id, x, y, yaw, vx, vy, vz) 列表
+    """
+    broadcast_parts = [f"[{len(entries)}"]
+    for entry in entries:
+        broadcast_parts.append(format_text_entry(*entry))
+    return " ".join(broadcast_parts) + "]"
+
+
+def encode_binary_fleet_frame(sequence, entries, with_age=False):
+    """
+    编码下行二进制广播帧
+    entries 为 (car_num, x, y, yaw, vx, vy, vz) 列表，最多 FLEET_MAX_ENTRIES 个；
+    with_age 时设置 FLAG_AGE 并为每个条目预留年龄字段，返回 bytearray，发出前用 set_fleet_frame_ages 填写
+    """
+    count = len(entries)
+    if count > FLEET_MAX_ENTRIES:
+        raise ValueError(f"单帧最多 {FLEET_MAX_ENTRIES} 辆小车，实际 {count}")
+
+    entry_size = FLEET_ENTRY_AGE.size if with_age else FLEET_ENTRY.size
+    frame = bytearray(FLEET_HEADER.size + entry_size * count)
+    FLEET_HEADER.pack_into(frame, 0, FRAME_MAGIC, PROTOCOL_VERSION, FRAME_FLEET_STATE,
+                           FLAG_AGE if with_age else 0, sequence & 0xFFFF, count)
+    offset = FLEET_HEADER.size
+    for entry in entries:
+        FLEET_ENTRY.pack_into(frame, offset, *entry)
+        offset += entry_size
+    return frame if with_age else bytes(frame)
+
+
+def set_fleet_frame_poses(frame, poses):
+    """在二进制广播帧中就地改写各条目的 (x, y, yaw)，poses 与帧内条目一一对应"""
+    flags = frame[3]
+    entry_size = FLEET_ENTRY_AGE.size if flags & FLAG_AGE else FLEET_ENTRY.size
+    offset = FLEET_HEADER.size + FLEET_POSE_OFFSET
+    for pose in poses:
+        FLEET_POSE.pack_into(frame, offset, *pose)
+        offset += entry_size
+    return frame
+
+
+def set_fleet_frame_ages(frame, ages_ms):
+    """在带 FLAG_AGE 的帧中就地写入各条目的年龄（毫秒，超出范围时截断）"""
+    offset = FLEET_HEADER.size + FLEET_ENTRY.size
+    for age in ages_ms:
+        FLEET_AGE.pack_into(frame, offset, min(max(int(age), 0), FLEET_AGE_MAX_MS))
+        offset += FLEET_ENTRY_AGE.size
+    return frame
+
+
+def pack_text_fleet_frames(entries, budget, max_entries=0):
+    """
+    按字节预算把文本条目装成尽量少的帧，每帧不超过 budget 字节（单个条目超长时独占一帧）
+    max_entries 为每帧最多条目数（0 表示不限），返回 [(frame, 条目数), ...]
+    """
+    frames = []
+    parts = []
+    size = 0
+    for entry in entries:
+        text = format_text_entry(*entry)
+        # 帧长 = "[n" + 每个条目前的空格 + 条目 + "]"，n 按加入后的位数计算
+        grown = size + 1 + len(text)
+        count = len(parts) + 1
+        if parts and (grown + len(str(count)) + 2 > budget or (max_entries and count > max_entries)):
+            frames.append((f"[{len(parts)} " + " ".join(parts) + "]", len(parts)))
+            parts = []
+            grown = 1 + len(text)
+        parts.append(text)
+        size = grown
+    if parts:
+        frames.append((f"[{len(parts)} " + " ".join(parts) + "]", len(parts)))
+    return frames
+
+
+def parse_text_fleet_frame(text):
+    """解析下行文本广播 "[n C1 x y yaw vx vy vz ...]"，返回 [(short_id, x, y, yaw, vx, vy, vz), ...]，格式不符返回None"""
+    text = text.strip()
+    if not (text.startswith('[') and text.endswith(']')):
+        return None
+    fields = text[1:-1].split()
+    try:
+        count = int(fields[0])
+        if len(fields) != 1 + count * 7:
+            return None
+        entries = []
+        for start in range(1, len(fields), 7):
+            entries.append((fields[start],) + tuple(float(value) for value in fields[start + 1:start + 7]))
+        return entries
+    except (IndexError, ValueError):
+        return None
+
+
+def pack_binary_fleet_frames(first_sequence, entries, budget, max_entries=0, with_age=False):
+    """
+    按字节预算把二进制条目装成尽量少的帧，序列号从 first_sequence 起依次递增
+    返回 [(frame, 条目数), ...]；with_age 时每个条目带年龄字段
+    """
+    entry_size = FLEET_ENTRY_AGE.size if with_age else FLEET_ENTRY.size
+    per_frame = max(1, min(FLEET_MAX_ENTRIES, (budget - FLEET_HEADER.size) // entry_size))
+    if max_entries:
+        per_frame = min(per_frame, max_entries)
+
+    frames = []
+    sequence = first_sequence
+    for start in range(0, len(entries), per_frame):
+        chunk = entries[start:start + per_frame]
+        frames.append((encode_binary_fleet_frame(sequence, chunk, with_age), len(chunk)))
+        sequence += 1
+    return frames
+
+
+def pack_formation_bodies(entries, budget):
+    """
+    把编队条目 (car_num, x, y, yaw) 按字节预算预编码为若干分片，返回 [(条目数, bytes), ...]
+    分片内容与纪元无关，可以缓存后配合 encode_formation_frames 重复使用
+    """
+    per_frame = max(1, min(FLEET_MAX_ENTRIES, (budget - FORMATION_HEADER.size) // FORMATION_ENTRY.size))
+    bodies = []
+    for start in range(0, len(entries), per_frame):
+        chunk = entries[start:start + per_frame]
+        body = bytearray(FORMATION_ENTRY.size * len(chunk))
+        offset = 0
+        for entry in chunk:
+            FORMATION_ENTRY.pack_into(body, offset, *entry)
+            offset += FORMATION_ENTRY.size
+        bodies.append((len(chunk), bytes(body)))
+    return bodies or [(0, b"")]
+
+
+def encode_formation_frames(epoch, action, formation_code, leader_num, bodies):
+    """给预编码的分片加上帧头，返回每个分片一帧的 bytes 列表"""
+    parts = len(bodies)
+    return [FORMATION_HEADER.pack(FRAME_MAGIC, PROTOCOL_VERSION, FRAME_FORMATION, 0,
+                                  epoch & 0xFFFF, action, formation_code, leader_num,
+                                  part, parts, count) + body
+            for part, (count, body) in enumerate(bodies)]
+
+
+def parse_formation_frame(data):
+    """
+    解析下行编队帧，返回 (epoch, action, formation_code, leader_num, part, parts, [(car_num, x, y, yaw), ...])
+    """
+    if len(data) < FORMATION_HEADER.size:
+        return None
+
+    (magic, version, frame_type, _, epoch, action, formation_code, leader_num,
+     part, parts, count) = FORMATION_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != PROTOCOL_VERSION or frame_type != FRAME_FORMATION:
+        return None
+    end = FORMATION_HEADER.size + FORMATION_ENTRY.size * count
+    if len(data) < end:
+        return None
+
+    entries = list(FORMATION_ENTRY.iter_unpack(data[FORMATION_HEADER.size:end]))
+    return epoch, action, formation_code, leader_num, part, parts, entries
+
+
+def pack_target_frames(first_sequence, entries, budget):
+    """
+    把目标位姿条目 (car_num, x, y, heading) 按字节预算编码为若干帧，序列号依次递增
+    """
+    per_frame = max(1, min(FLEET_MAX_ENTRIES, (budget - TARGET_HEADER.size) // TARGET_ENTRY.size))
+    frames = []
+    sequence = first_sequence
+    for start in range(0, len(entries), per_frame):
+        chunk = entries[start:start + per_frame]
+        frame = bytearray(TARGET_HEADER.size + TARGET_ENTRY.size * len(chunk))
+        TARGET_HEADER.pack_into(frame, 0, FRAME_MAGIC, PROTOCOL_VERSION, FRAME_TARGETS, 0,
+                                sequence & 0xFFFF, len(chunk))
+        offset = TARGET_HEADER.size
+        for entry in chunk:
+            TARGET_ENTRY.pack_into(frame, offset, *entry)
+            offset += TARGET_ENTRY.size
+        frames.append(bytes(frame))
+        sequence += 1
+    return frames
+
+
+def parse_target_frame(data):
+    """解析目标位姿帧，返回 (sequence, [(car_num, x, y, heading), ...])"""
+    if len(data) < TARGET_HEADER.size:
+        return None
+
+    magic, version, frame_type, _, sequence, count = TARGET_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != PROTOCOL_VERSION or frame_type != FRAME_TARGETS:
+        return None
+    end = TARGET_HEADER.size + TARGET_ENTRY.size * count
+    if len(data) < end:
+        return None
+
+    return sequence, list(TARGET_ENTRY.iter_unpack(data[TARGET_HEADER.size:end]))
+
+
+def parse_binary_fleet_frame(data):
+    """
+    解析下行二进制广播帧，返回 (sequence, [(car_num, x, y, yaw, vx, vy, vz), ...])；
+    带 FLAG_AGE 的帧每个条目末尾多一个年龄（毫秒）
+    """
+    if len(data) < FLEET_HEADER.size:
+        return None
+
+    magic, version, frame_type, flags, sequence, count = FLEET_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC or version != PROTOCOL_VERSION or frame_type != FRAME_FLEET_STATE:
+        return None
+    entry_struct = FLEET_ENTRY_AGE if flags & FLAG_AGE else FLEET_ENTRY
+    end = FLEET_HEADER.size + entry_struct.size * count
+    if len(data) < end:
+        return None
+
+    entries = list(entry_struct.iter_unpack(data[FLEET_HEADER.size:end]))
+    return sequence, entries
@@ -0,0 +1,57 @@
+"""
+指令通道测试 - 旧固件小车（未开启确认）应收到 max_attempts 份盲发指令
+
+用法: python -m pytest tests 或 python tests/test_command_channel.py
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import command_channel
+from command_channel import SENT, CommandChannel
+
+
+class BlindUnicastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.received = []
+        self.channel = CommandChannel(lambda car_id, payload: self.received.append((car_id, payload)) or True,
+                                      lambda payload: True)
+
+    def run_ticks(self, command, limit=2.0):
+        """模拟调度线程周期调用 tick，直到指令完成"""
+        deadline = time.monotonic() + limit
+        while not command.done and time.monotonic() < deadline:
+            self.channel.tick()
+            time.sleep(0.005)
+
+    def test_non_ack_car_receives_every_copy(self):
+        command = self.channel.send("CAR1", "START", max_attempts=5)
+        self.assertEqual(len(self.received), 1)
+        self.assertFalse(command.done)
+
+        self.run_ticks(command)
+        self.assertEqual(command.status, SENT)
+        self.assertEqual(self.received, [("CAR1", "START")] * 5)
+        self.assertEqual(self.channel.stats()['pending'], 0)
+
+    def test_copies_are_spaced(self):
+        command = self.channel.send("CAR1", "STOP", max_attempts=3)
+        self.run_ticks(command)
+        elapsed = command.completed - command.created
+        self.assertGreaterEqual(elapsed, 2 * command_channel.COMMAND_BLIND_DELAY)
+
+    def test_ack_car_stops_after_ack(self):
+        self.channel.ack_cars.add("CAR2")
+        command = self.channel.send("CAR2", "START", max_attempts=5)
+        self.channel.handle_ack("CAR2", command.sequence)
+        self.run_ticks(command)
+        self.assertEqual(len(self.received), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
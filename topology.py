@@ -0,0 +1,129 @@
+"""
+通信拓扑 - 位集合表示，支持任意数量的小车
+每辆小车一个整数位掩码，第 j 位为1表示它能看到第 j 辆小车；
+单条边的增删是一次位运算，可见列表按需生成并缓存
+"""
+
+
+def default_car_ids(count):
+    """默认小车ID列表 CAR1..CARn"""
+    return [f"CAR{i + 1}" for i in range(count)]
+
+
+class Topology:
+    """有向可见关系图：visible(target) 返回 target 能看到的小车"""
+
+    def __init__(self, car_ids=()):
+        self.ids = []
+        self.index = {}
+        self.bits = []  # bits[i] 为第 i 辆小车可见集合的位掩码
+        self._visible_cache = {}
+        for car_id in car_ids:
+            self.add_car(car_id)
+
+    def add_car(self, car_id):
+        """登记小车（初始没有可见的小车），返回其位下标"""
+        position = self.index.get(car_id)
+        if position is None:
+            position = self.index[car_id] = len(self.ids)
+            self.ids.append(car_id)
+            self.bits.append(0)
+        return position
+
+    @classmethod
+    def from_matrix(cls, matrix, car_ids=None):
+        """
+        从邻接矩阵构建，沿用原有约定：matrix[other][target] == 1 表示 target 能看到 other
+        car_ids 缺省为 CAR1..CARn
+        """
+        count = len(matrix)
+        if any(len(row) != count for row in matrix):
+            raise ValueError("拓扑矩阵必须是方阵")
+        car_ids = list(car_ids) if car_ids else default_car_ids(count)
+        if len(car_ids) != count:
+            raise ValueError("car_ids 数量与矩阵大小不一致")
+
+        topology = cls(car_ids)
+        for other in range(count):
+            row = matrix[other]
+            for target in range(count):
+                if target != other and row[target]:
+                    topology.bits[target] |= 1 << other
+        return topology
+
+    @classmethod
+    def from_adjacency(cls, adjacency):
+        """从邻接表 {target: [可见的小车ID, ...]} 构建"""
+        topology = cls(sorted(adjacency))
+        for target, visible in adjacency.items():
+            for other in visible:
+                topology.set_edge(target, other, True)
+        return topology
+
+    @classmethod
+    def all_to_all(cls, car_ids):
+        """全连接：每辆小车能看到其余所有小车"""
+        topology = cls(car_ids)
+        full = (1 << len(topology.ids)) - 1
+        for position in range(len(topology.ids)):
+            topology.bits[position] = full & ~(1 << position)
+        return topology
+
+    def copy(self):
+        topology = Topology()
+        topology.ids = list(self.ids)
+        topology.index = dict(self.index)
+        topology.bits = list(self.bits)
+        return topology
+
+    def set_edge(self, target, other, visible):
+        """设置 target 是否能看到 other"""
+        if target == other:
+            return
+        target_position = self.add_car(target)
+        other_position = self.add_car(other)
+        if visible:
+            self.bits[target_position] |= 1 << other_position
+        else:
+            self.bits[target_position] &= ~(1 << other_position)
+        self._visible_cache.pop(target, None)
+
+    def can_see(self, target, other):
+        target_position = self.index.get(target)
+        other_position = self.index.get(other)
+        if target_position is None or other_position is None:
+            return False
+        return bool(self.bits[target_position] >> other_position & 1)
+
+    def visible(self, target):
+        """target 能看到的小车ID列表（按登记顺序）"""
+        cached = self._visible_cache.get(target)
+        if cached is not None:
+            return cached
+
+        position = self.index.get(target)
+        result = []
+        if position is not None:
+            mask = self.bits[position]
+            while mask:
+                low = mask & -mask
+                result.append(self.ids[low.bit_length() - 1])
+                mask ^= low
+        self._visible_cache[target] = result
+        return result
+
+    def edge_count(self):
+        return sum(bin(mask).count("1") for mask in self.bits)
+
+    def to_adjacency(self):
+        return {car_id: self.visible(car_id) for car_id in self.ids}
+
+    def to_matrix(self):
+        """转换回邻接矩阵（matrix[other][target]），行列顺序与 self.ids 相同"""
+        count = len(self.ids)
+        matrix = [[0] * count for _ in range(count)]
+        for target, mask in enumerate(self.bits):
+            for other in range(count):
+                if mask >> other & 1:
+                    matrix[other][target] = 1
+        return matrix
@@ -1,41 +1,170 @@
+import logging
+import math
 import socket
+import selectors
 import threading
+import os
 import time
 import json
+import gzip
 import random 
-from flask import Flask, request, jsonify, render_template
+from collections import deque
+from flask import Flask, Response, request, jsonify, render_template, g
 from flask_cors import CORS
+from flask_socketio import SocketIO
 from formation_controller import formation_bp, init_formation_controller  # 新增导入
+from fleet_store import FleetStore, wall_clock
+from server_log import get_logger, setup_logging, set_level, get_stats as get_log_stats
+from scheduler import MonotonicScheduler
+from command_channel import CommandChannel
+from command_dispatch import CommandDispatcher
+from telemetry_protocol import (parse_telemetry, parse_text_telemetry, car_id_table,
+                                COMMAND_ACK_PREFIX, parse_command_ack,
+                                pack_text_fleet_frames, pack_binary_fleet_frames, set_fleet_frame_ages,
+                                set_fleet_frame_poses)
+from topology import Topology, default_car_ids
+from telemetry_history import TelemetryHistory, HISTORY_METHODS, HISTORY_FIELDS
+from datagram_log import DatagramRecorder, RecordingSocket, OUTBOUND_UNICAST, OUTBOUND_BROADCAST
+from metrics import registry as metrics, InstrumentedLock, COUNT_BUCKETS
+from staleness import StalenessTracker
+from spatial_index import SpatialGrid
+from collision import CollisionMonitor, LEVELS
+from dead_reckoning import PredictionTracker, extrapolate_rows, gate_samples, world_velocity
+
+log = get_logger()
 
 app = Flask(__name__)
 CORS(app)
 app.register_blueprint(formation_bp)  # 注册编队控制器蓝图
-
-# 存储小车信息的字典，key为小车ID
-cars = {}
-car_lock = threading.Lock()
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+
+# 运行指标（/metrics 与 /api/metrics），各线程写自己的分片，不加锁
+PARSE_TIMING_SAMPLE = 8
+CAR_PACKETS_RECEIVED = metrics.counter('car_packets_received_total',
+                                       '按小车统计的解析成功数据报（含随后被航位推算门限丢弃的样本）', ('car',))
+CAR_PACKETS_REJECTED = metrics.counter('car_packets_rejected_total', '按小车统计的解析失败数据报（无法识别小车时为 unknown）',
+                                       ('car',))
+PARSE_SECONDS = metrics.histogram('parse_seconds', '单个遥测数据报的解析耗时（秒，抽样）')
+LOCK_WAIT_SECONDS = metrics.histogram('lock_wait_seconds', '获取锁的等待时间（秒）', ('lock',))
+LOCK_HOLD_SECONDS = metrics.histogram('lock_hold_seconds', '持有锁的时间（秒）', ('lock',))
+BROADCAST_CYCLE_SECONDS = metrics.histogram('broadcast_cycle_seconds', '一个广播周期的耗时（秒）')
+BROADCAST_JITTER_SECONDS = metrics.histogram('broadcast_jitter_seconds',
+                                             '相邻两次广播的间隔与 broadcast_interval 之差的绝对值（秒）')
+BROADCAST_FRAMES = metrics.histogram('broadcast_frames_per_cycle', '每个广播周期发出的帧数',
+                                     buckets=COUNT_BUCKETS)
+UNICAST_COMMANDS = metrics.counter('unicast_commands_total', '单播指令首次发送结果，result 为 sent 或 failed',
+                                   ('result',))
+HTTP_SECONDS = metrics.histogram('http_request_seconds', 'HTTP 接口处理耗时（秒）', ('endpoint', 'method', 'status'))
+COLLISION_WARNINGS = metrics.counter('collision_warnings_total', '新出现或升级的碰撞预警', ('level',))
+PREDICTION_ERROR_METERS = metrics.histogram('prediction_error_meters',
+                                            '下一条真实样本与匀速外推 (cv) / 上一条样本 (hold) 的位置误差（米）',
+                                            ('model',), buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0))
+SAMPLES_REJECTED = metrics.counter('prediction_samples_rejected_total', '航位推算门限丢弃的异常样本')
+SAMPLE_AGE_SECONDS = metrics.histogram('broadcast_sample_age_seconds', '广播发出时帧内样本距 recvfrom 的时间（秒）')
+
+# 存储小车信息的列式存储，按小车ID像字典一样访问
+cars = FleetStore()
+car_lock = InstrumentedLock('car_lock', LOCK_WAIT_SECONDS, LOCK_HOLD_SECONDS)
+
+# 遥测历史：每车一个环形缓冲区，启动时按 HISTORY_MAX_CARS x HISTORY_DEPTH 一次性分配
+# 每个样本 28 字节，默认 256 x 3000 约 21MB（100Hz 下每车保留最近30秒）
+HISTORY_MAX_CARS = 256
+HISTORY_DEPTH = 3000
+HISTORY_MAX_POINTS = 5000  # 单次查询最多返回的点数
+history = TelemetryHistory(HISTORY_MAX_CARS, HISTORY_DEPTH)
+
+# 数据年龄：每辆小车、每个帧序号保留最近 STALENESS_WINDOW 次广播时的样本年龄
+STALENESS_WINDOW = 256
+staleness = StalenessTracker(STALENESS_WINDOW)
+
+# 空间索引：小车位置的均匀网格（格子边长，米），随遥测增量更新，用于邻域查询
+SPATIAL_CELL_SIZE = 0.5
+SPATIAL_MAX_NEIGHBORS = 100  # 单次 k 近邻查询最多返回的小车数
+SPATIAL_MAX_COORDINATE = 1e6  # 查询坐标的绝对值上限（米），同时拒绝 nan/inf
+spatial_index = SpatialGrid(SPATIAL_CELL_SIZE)
+
+# 碰撞预警：每个广播周期对在线小车两两计算最近接近距离和 TTC（匀速外推）
+collision_enabled = True
+# 预警达到 COLLISION_ACTION_LEVEL 时对涉及的两辆小车的处理：
+# none 只预警；hold 下发 CTRL 目标为当前位置（原地停车）。
+# 只使用小车固件已支持的 CTRL 指令，减速类处理需固件先支持相应指令
+collision_action = "none"
+COLLISION_ACTIONS = ("none", "hold")
+COLLISION_ACTION_LEVEL = "danger"
+COLLISION_ACTION_COOLDOWN = 1.0  # 同一辆小车两次避让指令的最短间隔（秒）
+collision_monitor = CollisionMonitor()
+
+# 航位推算：prediction_mode 为 cv 时，广播每帧发出前把帧内各车位姿按速度外推到发出时刻，
+# 接收时丢弃明显异常的样本，并用下一条真实样本统计外推误差（/api/prediction，每 PREDICTION_LOG_INTERVAL 秒记日志）
+prediction_mode = "off"
+PREDICTION_MODES = ("off", "cv")
+prediction_max_horizon = 0.3  # 最长外推时间（秒），样本更旧时只外推这么久
+prediction_max_speed = 3.0  # 样本门限：速度上限（米/秒），位置跳变超过 速度上限 x 间隔 + 容差 的样本被丢弃
+# 遥测中 (vx, vy) 的坐标系，协议未规定：world 为世界坐标（碰撞预警、仪表盘同样按世界坐标使用），
+# body 为车体坐标（x 向前、y 向左），外推时按航向旋转；按小车固件的实际输出设置
+prediction_velocity_frame = os.environ.get("CAR_SERVER_VELOCITY_FRAME", "world")
+PREDICTION_VELOCITY_FRAMES = ("world", "body")
+PREDICTION_GATE_MARGIN = 0.2  # 位置跳变容差（米）
+PREDICTION_MAX_REJECTS = 3  # 同一辆小车连续丢弃超过该次数后重新接受（小车被搬动等情况）
+PREDICTION_LOG_INTERVAL = 10.0
+PREDICTION_WINDOW = 512
+prediction_stats = PredictionTracker(PREDICTION_WINDOW)
+
+# 数据报记录：CAR_SERVER_RECORD=<路径> 时启动即开始记录，也可通过 /api/recorder 开关
+RECORD_DIR = "recordings"
+RECORD_PATH = os.environ.get("CAR_SERVER_RECORD")
 
 # 服务器配置ll
 UDP_HOST = '0.0.0.0'
 UDP_PORT = 8080
 WEB_PORT = 5000
 BROADCAST_PORT = 8081  # 新增广播端口
+# 子网广播地址；本机压测（fleet_simulator.py）时设为 127.255.255.255
+BROADCAST_ADDRESS = os.environ.get("CAR_SERVER_BROADCAST_ADDRESS", "192.168.31.255")
+
+# 接收配置
+RECV_BUFFER_SIZE = 1024  # 单个数据报最大长度
+RECV_BATCH_MAX = 64  # 每次唤醒最多连续收取的数据报数量
+
+# 指令配置
+COMMAND_TICK_INTERVAL = 0.01  # 指令重传检查周期（秒）
+COMMAND_ACK_WAIT = 0.5  # 单车指令API等待确认的最长时间（秒）
 
 # 广播配置
+BROADCAST_TRIGGER_WINDOW = 0.02  # 新连接触发的周期外广播合并窗口（秒）
 broadcast_enabled = False
 broadcast_interval = 0.07  # 50ms
-broadcast_group_size = 2  # 每组最多广播的小车数量
-
-# 通信拓扑配置
+broadcast_group_size = 2  # 每帧最多广播的小车数量（默认2，与原有分组一致），设为0表示只按字节预算装帧
+broadcast_payload_budget = 1400  # 单帧最大字节数（安全的UDP载荷，或小车接收缓冲区大小）
+broadcast_frame_gap = "auto"  # 帧间隔（秒），auto 表示在广播周期内自适应
+BROADCAST_MAX_FRAME_GAP = 0.01  # 自适应帧间隔上限（秒）
+BROADCAST_PACING_SHARE = 0.5  # 自适应时一个周期的所有帧在广播间隔的这一比例内发完
+broadcast_format = "text"  # 下行广播格式：text（兼容旧小车）或 binary（紧凑二进制帧）
+broadcast_age_field = False  # 二进制帧是否为每个条目附带样本年龄（毫秒），供小车补偿延迟
+# 下行分发模式：broadcast（子网广播全部小车）或 topology（按拓扑只向每辆小车单播其可见的小车）
+dissemination_mode = "broadcast"
+
+# 通信拓扑配置（默认四车全连接，可通过API设置任意规模）
 communication_topology = [
     [0, 1, 1, 1],
     [1, 0, 1, 1],
     [1, 1, 0, 1],
     [1, 1, 1, 0]
 ]
+TOPOLOGY_COMMAND_MAX_CARS = 16  # 超过该规模不再向小车下发 TOPOLOGY 矩阵，改由服务器按拓扑分发
 
 topology_enabled = False
-topology_cache = {}
+topology_graph = Topology.from_matrix(communication_topology)
+
+# /api/cars 响应缓存：(快照版本, {格式: (etag, body, gzip_body)})，只保留当前版本
+CARS_GZIP_MIN_SIZE = 1024  # 小于该字节数的响应不压缩
+CARS_LONG_POLL_TIMEOUT = 25.0  # 增量查询默认最长等待时间（秒）
+CARS_LONG_POLL_MAX_TIMEOUT = 60.0
+cars_response_cache = (0, {})
+
+# 仪表盘推送配置：车队状态按 push_interval 推送，事件消息在下一个推送周期发出
+push_interval = 0.1  # 100ms
+dashboard_events = deque(maxlen=1000)  # 待推送事件，各线程只入队，不直接调用socketio
 
 
 def get_subnet_broadcast():
@@ -79,30 +208,12 @@ def get_subnet_broadcast():
         return "192.168.31.255"
 
 
-class Car:
-    def __init__(self, car_id, address):
-        self.car_id = car_id
-        self.mac_address = f"CAR_{car_id}"
-        self.address = address
-        self.position = {"x": 0, "y": 0}
-        self.heading = 0
-        self.battery = 100
-        self.velocity = {"vx": 0, "vy": 0, "vz": 0}
-        self.speed = 0
-        self.connected = True
-        self.last_update = time.time()
-        self.status = "正常"
-        self.update_count = 0
-        self.last_broadcast_time = 0
-        self.connection_attempts = 0
-
-
 class BroadcastServer:
     def __init__(self, port=8081):
         self.port = port
         self.socket = None
         self.running = False
-        self.broadcast_address = "192.168.31.255"  # 获取子网广播地址
+        self.broadcast_address = BROADCAST_ADDRESS  # 子网广播地址
 
     def start(self):
         """启动广播服务器"""
@@ -115,36 +226,37 @@ class BroadcastServer:
             self.socket.bind(('', self.port))
             self.running = True
 
-            print(f"📢 广播服务器启动成功，绑定端口 {self.port}")
-            print(f"🌐 使用子网广播地址: {self.broadcast_address}")
+            log.info("📢 广播服务器启动成功，绑定端口 %s", self.port)
+            log.info("🌐 使用子网广播地址: %s", self.broadcast_address)
             return True
 
         except Exception as e:
-            print(f"❌ 广播服务器启动失败: {e}")
+            log.error("❌ 广播服务器启动失败: %s", e)
             return False
 
     def broadcast_data(self, data):
-        """广播数据到所有小车 - 使用子网广播地址"""
+        """广播数据到所有小车 - 使用子网广播地址，data 可以是文本或二进制帧"""
         try:
             # 发送到子网广播地址
             target = (self.broadcast_address, self.port)
-            self.socket.sendto(data.encode('utf-8'), target)
-            print(f"📢 广播数据: {data} -> {self.broadcast_address}:{self.port}")
+            payload = data if isinstance(data, (bytes, bytearray)) else data.encode('utf-8')
+            self.socket.sendto(payload, target)
+            log.debug("📢 广播数据: %s -> %s:%s", data, self.broadcast_address, self.port)
             return True
         except Exception as e:
-            print(f"❌ 广播发送失败: {e}")
+            log.warning("❌ 广播发送失败: %s", e, extra={'rate_limit': 1.0})
             return False
 
-    def broadcast_command_reliable(self, command, retries=5, delay=0.04):
-        """可靠地广播指令，重复发送指定次数"""
-        success_count = 0
-        for i in range(retries):
-            if self.broadcast_data(command):
-                success_count += 1
-                if i < retries - 1:  # 不是最后一次发送
-                    time.sleep(delay)
-        print(f"📢 广播指令 '{command}' 发送 {success_count}/{retries} 次")
-        return success_count > 0
+    def send_data(self, data, ip):
+        """向单个小车的广播端口单播数据（拓扑分发模式），格式与广播帧相同"""
+        try:
+            payload = data if isinstance(data, (bytes, bytearray)) else data.encode('utf-8')
+            self.socket.sendto(payload, (ip, self.port))
+            log.debug("📨 定向发送: %s -> %s:%s", data, ip, self.port)
+            return True
+        except Exception as e:
+            log.warning("❌ 定向发送失败: %s", e, extra={'rate_limit': 1.0})
+            return False
 
     def stop(self):
         """停止广播服务器"""
@@ -162,9 +274,36 @@ class UDPServer:
         self.broadcast_sequence = 0
         self.last_debug_log = 0
 
+        # 批量接收统计：批次数、数据报总数、每批数量分布（按2的幂分桶）
+        self.ingest_stats = {
+            'batches': 0,
+            'packets': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'batch_size_histogram': {}
+        }
+
         # 新增广播服务器实例
         self.broadcast_server = BroadcastServer(BROADCAST_PORT)
 
+        # 广播、健康检查、清理共用一个单调时钟调度线程
+        self.scheduler = MonotonicScheduler("udp-scheduler")
+        self.broadcast_cycles = 0
+        self.last_broadcast_tick = 0.0  # 上一次周期广播开始的单调时间，用于统计抖动
+        self.collision_actions = {}  # car_id -> 上一次下发避让指令的单调时间
+        self.rejected_streak = {}  # car_id -> 连续被航位推算门限丢弃的样本数
+        self.dissemination_stats = {}  # 最近一次拓扑分发的统计
+        self.broadcast_cycle_stats = {}  # 最近一次广播周期的帧数、字节数和耗时
+        self.broadcast_in_flight = False  # 上一个周期的后续帧还在按帧间隔发送
+        self.broadcast_cycles_skipped = 0  # 因上一个周期未发完而跳过的周期数
+
+        # 指令通道：序列号、确认和重传
+        self.commands = CommandChannel(self.send_to_car, self.broadcast_server.broadcast_data)
+        self.dispatcher = CommandDispatcher(self.send_command)
+
+        # 数据报记录器（可选）：接收批次和所有发出的数据报写入二进制日志
+        self.recorder = None
+
     def start(self):
         """启动UDP服务器"""
         try:
@@ -176,298 +315,731 @@ class UDPServer:
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 128 * 1024)
 
             self.socket.bind((self.host, self.port))
+            self.socket.setblocking(False)  # 接收循环由selector驱动，批量收取
             self.running = True
 
-            print(f"🚀 UDP服务器启动在 {self.host}:{self.port}")
-            print("等待小车连接...")
+            log.info("🚀 UDP服务器启动在 %s:%s", self.host, self.port)
+            log.info("等待小车连接...")
 
             # 启动接收线程
             receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
             receive_thread.start()
 
-            # 启动广播线程
-            broadcast_thread = threading.Thread(target=self._broadcast_loop, daemon=True)
-            broadcast_thread.start()
-
-            # 启动清理线程
-            cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
-            cleanup_thread.start()
-
-            # 启动连接健康检查线程
-            health_thread = threading.Thread(target=self._health_check_loop, daemon=True)
-            health_thread.start()
+            # 启动调度器：广播按 broadcast_interval 节拍，健康检查每2秒，清理每10秒
+            self.scheduler.add_task('broadcast', self._broadcast_tick, lambda: broadcast_interval,
+                                    trigger_func=self._broadcast_all_cars_data)
+            self.scheduler.add_task('health_check', self._health_check_once, 2.0)
+            self.scheduler.add_task('cleanup', self._cleanup_once, 10.0)
+            self.scheduler.add_task('command_retransmit', self.commands.tick, COMMAND_TICK_INTERVAL)
+            self.scheduler.add_task('collision', self._collision_tick, lambda: broadcast_interval)
+            self.scheduler.add_task('prediction_log', self._prediction_log_once, PREDICTION_LOG_INTERVAL)
+            self.scheduler.start()
+            self.dispatcher.start()
 
             # 启动广播服务器
             if not self.broadcast_server.start():
-                print("❌ 广播服务器启动失败，但UDP服务器继续运行")
+                log.error("❌ 广播服务器启动失败，但UDP服务器继续运行")
 
             return True
 
         except Exception as e:
-            print(f"❌ UDP服务器启动失败: {e}")
+            log.error("❌ UDP服务器启动失败: %s", e)
             return False
 
     def _receive_loop(self):
-        """UDP数据接收循环"""
-        while self.running:
+        """UDP数据接收循环 - 每次唤醒批量收取所有就绪数据报"""
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while self.running:
+                try:
+                    if not selector.select(timeout=0.5):
+                        continue
+                    # 每个数据报带各自 recvfrom 时的单调时间，作为样本年龄和历史时间戳的起点
+                    batch, received = self._drain_socket()
+                    if batch:
+                        recorder = self.recorder
+                        if recorder is not None:
+                            recorder.record_batch(batch, received[0])
+                        self._handle_car_batch(batch, received)
+                except Exception as e:
+                    if not self.running:
+                        break
+                    log.error("❌ UDP接收错误: %s", e, extra={'rate_limit': 1.0})
+                    time.sleep(0.01)
+        finally:
+            selector.close()
+
+    def start_recording(self, path):
+        """开始记录所有收发的数据报：发送套接字换成记录包装，接收线程整批入队"""
+        if self.recorder is not None:
+            self.stop_recording()
+        recorder = DatagramRecorder(path)
+        recorder.start()
+        if self.socket is not None:
+            self.socket = RecordingSocket(self.socket, recorder, OUTBOUND_UNICAST)
+        if self.broadcast_server.socket is not None:
+            self.broadcast_server.socket = RecordingSocket(self.broadcast_server.socket, recorder,
+                                                           OUTBOUND_BROADCAST)
+        self.recorder = recorder
+        return recorder
+
+    def stop_recording(self):
+        """停止记录并还原发送套接字，返回记录器统计（未在记录时返回None）"""
+        recorder = self.recorder
+        if recorder is None:
+            return None
+        self.recorder = None
+        if isinstance(self.socket, RecordingSocket):
+            self.socket = self.socket._socket
+        if isinstance(self.broadcast_server.socket, RecordingSocket):
+            self.broadcast_server.socket = self.broadcast_server.socket._socket
+        recorder.stop()
+        return recorder.stats()
+
+    def _drain_socket(self):
+        """非阻塞地取出套接字中已到达的数据报，最多 RECV_BATCH_MAX 个，返回 (批次, 各数据报收到时的单调时间)"""
+        batch = []
+        received = []
+        recvfrom = self.socket.recvfrom
+        monotonic = time.monotonic
+        for _ in range(RECV_BATCH_MAX):
             try:
-                data, addr = self.socket.recvfrom(1024)
-                if data:
-                    self._handle_car_data(data.decode('utf-8', errors='ignore'), addr)
-            except BlockingIOError:
-                time.sleep(0.001)
-            except Exception as e:
-                print(f"❌ UDP接收错误: {e}")
-                time.sleep(0.01)
+                data, addr = recvfrom(RECV_BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            if data:
+                batch.append((data, addr))
+                received.append(monotonic())
+        return batch, received
 
     def _handle_car_data(self, data, addr):
-        """处理小车数据"""
+        """处理单个小车数据报"""
+        self._handle_car_batch([(data, addr)])
+
+    def _handle_car_batch(self, batch, received=None):
+        """
+        处理一批数据报：锁外解析，锁内一次性更新；
+        received 为各数据报收到时的单调时间，或整批共用的一个时间（默认为当前时间）
+        """
+        if received is None:
+            received = time.monotonic()
+        if not isinstance(received, list):
+            received = [received] * len(batch)
+        samples = []
+        sample_times = []
+        # 每 PARSE_TIMING_SAMPLE 批抽取第一个遥测数据报计时，计时开销不随负载增长
+        timed = self.ingest_stats['batches'] % PARSE_TIMING_SAMPLE != 0
+        for (data, addr), data_received in zip(batch, received):
+            if data[:4] == COMMAND_ACK_PREFIX:
+                ack = parse_command_ack(data)
+                if ack is not None:
+                    self.commands.handle_ack(*ack)
+                continue
+            if not timed:
+                started = time.perf_counter()
+                sample = self._parse_car_data(data, addr)
+                PARSE_SECONDS.observe(time.perf_counter() - started)
+                timed = True
+            else:
+                sample = self._parse_car_data(data, addr)
+            if sample is not None:
+                samples.append(sample)
+                sample_times.append(data_received)
+                # 在门限之前计数，被丢弃的样本也算收到
+                CAR_PACKETS_RECEIVED.inc((sample[0],))
+            else:
+                CAR_PACKETS_REJECTED.inc((self._rejected_car_label(data),))
+
+        self._record_batch(len(batch))
+
+        if samples:
+            self._apply_car_samples(samples, sample_times)
+
+    def _gate_samples(self, samples, received):
+        """
+        航位推算门限：与快照中同一辆小车的上一条样本比较，丢弃不可能的位置跳变，
+        并记录按匀速外推 / 保持上一条样本到本样本接收时刻的误差。新车和断开的小车不检查
+        （非有限值的样本在解析时已丢弃，这里的样本都是有限值，重新接受不会引入 nan/inf）；
+        received 为各样本收到时的单调时间，返回丢弃异常样本后的 (samples, received)
+        """
+        snapshot = cars.snapshot
+        index = snapshot.index
+        checked = []
+        rows = []
+        for position, sample in enumerate(samples):
+            row = index.get(sample[0])
+            if row is not None and snapshot.connected[row]:
+                checked.append(position)
+                rows.append(row)
+        if not checked:
+            return samples, received
+
+        dt = [received[position] for position in checked] - snapshot.received[rows]
+        previous_vx, previous_vy = snapshot.vx[rows], snapshot.vy[rows]
+        if prediction_velocity_frame == "body":
+            previous_vx, previous_vy = world_velocity(previous_vx, previous_vy, snapshot.heading[rows])
+        previous = list(zip(snapshot.x[rows].tolist(), snapshot.y[rows].tolist(),
+                            previous_vx.tolist(), previous_vy.tolist()))
+        # 样本格式 (car_id, addr, x, y, yaw, voltage, vx, vy, vz, sequence, timestamp)
+        current = [(samples[position][2], samples[position][3], samples[position][6], samples[position][7])
+                   for position in checked]
+        accept, predicted_error, held_error = gate_samples(previous, current, dt, prediction_max_speed,
+                                                           PREDICTION_GATE_MARGIN)
+
+        rejected = set()
+        accepted_ids = []
+        streak = self.rejected_streak
+        for position, ok in zip(checked, accept.tolist()):
+            car_id = samples[position][0]
+            if ok:
+                streak.pop(car_id, None)
+                accepted_ids.append(car_id)
+                continue
+            count = streak.get(car_id, 0) + 1
+            if count > PREDICTION_MAX_REJECTS:
+                # 连续异常说明小车确实到了新位置，重新接受
+                streak.pop(car_id, None)
+                prediction_stats.count('resynced')
+                log.info("🔁 小车 %s 连续 %d 条样本超出门限，重新接受", car_id, count - 1)
+                continue
+            streak[car_id] = count
+            rejected.add(position)
+            SAMPLES_REJECTED.inc()
+            log.debug("🚫 丢弃小车 %s 的异常样本: %s", car_id, samples[position][2:9])
+
+        ok_mask = accept.astype(bool)
+        if ok_mask.any():
+            prediction_stats.record(accepted_ids, predicted_error[ok_mask].tolist(),
+                                    held_error[ok_mask].tolist(), dt[ok_mask].tolist())
+            for error in predicted_error[ok_mask].tolist():
+                PREDICTION_ERROR_METERS.observe(error, ('cv',))
+            for error in held_error[ok_mask].tolist():
+                PREDICTION_ERROR_METERS.observe(error, ('hold',))
+        prediction_stats.count('checked', len(checked))
+        if rejected:
+            prediction_stats.count('rejected', len(rejected))
+            kept = [position for position in range(len(samples)) if position not in rejected]
+            return [samples[position] for position in kept], [received[position] for position in kept]
+        return samples, received
+
+    def _prediction_log_once(self):
+        """定期记录外推误差，便于调整 prediction_max_horizon 等参数"""
+        if prediction_mode == "off":
+            return
+        stats = prediction_stats.stats()
+        predicted, held = stats['predicted_error'], stats['hold_error']
+        if not predicted:
+            return
+        log.info("🧭 航位推算误差: 外推 p50 %.1fmm p99 %.1fmm | 不外推 p50 %.1fmm p99 %.1fmm | "
+                 "样本间隔 %sms, 丢弃 %d/%d",
+                 predicted['p50_mm'], predicted['p99_mm'], held['p50_mm'], held['p99_mm'],
+                 stats['sample_interval_ms'], stats['rejected'], stats['checked'])
+
+    @staticmethod
+    def _rejected_car_label(data):
+        """被拒绝数据报的小车标签：文本前缀是已知小车时用其ID，否则为 unknown（避免任意字符串成为标签）"""
+        if isinstance(data, str):
+            # _handle_car_data 也接受已解码的文本
+            data = data[:16].encode('utf-8', errors='ignore')
+        head = data[:16].split(b':', 1)
+        if len(head) == 2:
+            car_id = head[0].decode('utf-8', errors='ignore')
+            if car_id in cars.snapshot.index:
+                return car_id
+        return 'unknown'
+
+    def _record_batch(self, size):
+        """记录每批数据报数量统计"""
+        stats = self.ingest_stats
+        stats['batches'] += 1
+        stats['packets'] += size
+        stats['last_batch_size'] = size
+        if size > stats['max_batch_size']:
+            stats['max_batch_size'] = size
+        bucket = 1
+        while bucket < size:
+            bucket <<= 1
+        histogram = stats['batch_size_histogram']
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def _parse_car_data(self, data, addr):
+        """
+        解析小车数据（文本或二进制帧），
+        返回 (car_id, addr, x, y, yaw, voltage, vx, vy, vz, sequence, timestamp)，无效数据返回None
+        """
         try:
-            data = data.strip()
-            if not data:
-                return
+            if isinstance(data, bytes):
+                parsed = parse_telemetry(data)
+            else:
+                parsed = parse_text_telemetry(data)
+            if parsed is None:
+                return None
+            if not all(map(math.isfinite, parsed[1:8])):
+                # nan/inf 会进入快照、历史缓冲区和下行帧（/api/cars 也会输出非法 JSON），任何小车的此类样本都丢弃
+                return None
+            return (parsed[0], addr) + parsed[1:]
 
-            # 解析小车数据
-            parts = data.split(':')
-            if len(parts) != 2:
+        except Exception as e:
+            log.warning("❌ 处理小车数据失败: %s", e, extra={'rate_limit': 1.0})
+            return None
+
+    def _apply_car_samples(self, samples, received):
+        """
+        在一次加锁中把整批解析结果写入 cars；received 为各样本收到时的单调时间，
+        last_update 和历史时间戳由它换算（锚定单调时钟），回放时与原始记录一致
+        """
+        if prediction_mode != "off":
+            samples, received = self._gate_samples(samples, received)
+            if not samples:
                 return
+        reconnected = []
+
+        # 同一批中同一辆小车只保留最新一条，其余只计数
+        latest = {}
+        latest_received = {}
+        counts = {}
+        for sample, sample_received in zip(samples, received):
+            car_id = sample[0]
+            latest[car_id] = sample
+            latest_received[car_id] = sample_received
+            counts[car_id] = counts.get(car_id, 0) + 1
+
+        # 历史缓冲区记录整批所有样本（不只是最新一条），每条用自己的接收时间，有独立的锁
+        car_ids, _, x, y, yaw, voltage, vx, vy, _, _, _ = zip(*samples)
+        history.record(car_ids, [wall_clock(t) for t in received], x, y, yaw, vx, vy, voltage)
 
-            car_id = parts[0]
-            values = parts[1].split(',')
+        with car_lock:
+            slots = []
+            for car_id, sample in latest.items():
+                addr = sample[1]
+
+                # 检查小车是否已经存在
+                if car_id in cars:
+                    car = cars[car_id]
+                    old_address = car.address
+                    reconnect_event = False
+
+                    # 检查是否重连（地址变化或从断开状态恢复）
+                    if car.address != addr:
+                        log.info("🔄 小车 %s 地址变化: %s -> %s", car_id, car.address, addr)
+                        car.address = addr
+                        reconnect_event = True
 
-            if len(values) >= 7:
-                x = float(values[0])
-                y = float(values[1])
-                yaw = float(values[2])
-                voltage = float(values[3])
-                vx = float(values[4])
-                vy = float(values[5])
-                vz = float(values[6])
+                    if not car.connected:
+                        log.info("🎉 小车 %s 重新连接! 从 %s 到 %s", car_id, old_address, addr)
+                        car.connected = True
+                        reconnect_event = True
+                        car.connection_attempts = 0
 
-                current_time = time.time()
-                reconnect_event = False
+                    car.update_count += counts[car_id]
 
-                with car_lock:
-                    # 检查小车是否已经存在
-                    if car_id in cars:
-                        car = cars[car_id]
-                        old_address = car.address
-                        old_connected = car.connected
-
-                        # 检查是否重连（地址变化或从断开状态恢复）
-                        if car.address != addr:
-                            print(f"🔄 小车 {car_id} 地址变化: {car.address} -> {addr}")
-                            car.address = addr
-                            reconnect_event = True
-
-                        if not car.connected:
-                            print(f"🎉 小车 {car_id} 重新连接! 从 {old_address} 到 {addr}")
-                            car.connected = True
-                            reconnect_event = True
-                            car.connection_attempts = 0
-
-                        # 更新小车状态
-                        car.position = {"x": x, "y": y}
-                        car.heading = yaw
-                        car.battery = voltage
-                        car.velocity = {"vx": vx, "vy": vy, "vz": vz}
-                        car.speed = (vx ** 2 + vy ** 2) ** 0.5
-                        car.last_update = current_time
-                        car.update_count += 1
-
-                    else:
-                        # 新小车连接
-                        cars[car_id] = Car(car_id, addr)
-                        car = cars[car_id]
-                        car.position = {"x": x, "y": y}
-                        car.heading = yaw
-                        car.battery = voltage
-                        car.velocity = {"vx": vx, "vy": vy, "vz": vz}
-                        car.speed = (vx ** 2 + vy ** 2) ** 0.5
-                        car.last_update = current_time
-                        print(f"🚗 新小车连接: {car_id} from {addr}")
-                        reconnect_event = True
+                else:
+                    # 新小车连接
+                    car = cars.add(car_id, addr)
+                    car.update_count = counts[car_id] - 1
+                    log.info("🚗 新小车连接: %s from %s", car_id, addr)
+                    reconnect_event = True
+
+                car.sequence = sample[9]
+                car.sent_timestamp = sample[10]
+                slots.append(cars.slot_of(car_id))
 
-                # 如果是重连事件，发送确认消息
                 if reconnect_event:
-                    self._send_reconnect_ack(car_id)
+                    reconnected.append(car_id)
 
-            # 立即触发一次广播，让新连接的小车尽快收到数据
-            if reconnect_event:
-                print(f"🚀 立即为新连接的小车 {car_id} 触发广播")
-                threading.Thread(target=self._broadcast_all_cars_data, daemon=True).start()
+            # 更新小车状态（整批向量化写入）
+            _, _, x, y, yaw, voltage, vx, vy, vz, _, _ = zip(*latest.values())
+            latest_times = list(latest_received.values())
+            cars.write_samples(slots, x, y, yaw, voltage, vx, vy, vz,
+                               [wall_clock(t) for t in latest_times], latest_times)
 
-        except Exception as e:
-            print(f"❌ 处理小车数据失败: {e}")
+            # 整批写入后发布新快照，读取方无需加锁
+            cars.publish()
+
+        # 空间索引有独立的锁，在 car_lock 之外更新
+        spatial_index.update(latest.keys(), x, y)
+
+        if not reconnected:
+            return
+
+        # 如果是重连事件，发送确认消息
+        for car_id in reconnected:
+            self._send_reconnect_ack(car_id)
+            notify_dashboard('car_event', {'type': 'connected', 'car_id': car_id})
+
+        # 请求尽快广播一次，让新连接的小车尽快收到数据；
+        # 窗口内的多次请求合并为一次，在调度线程上运行，不创建新线程
+        if self.scheduler.trigger('broadcast', BROADCAST_TRIGGER_WINDOW):
+            log.info("🚀 立即为新连接的小车 %s 触发广播", reconnected)
 
     def _send_reconnect_ack(self, car_id):
         """发送重连确认消息"""
         ack_msg = f"RECONNECT_ACK:{car_id},SERVER_READY"
         try:
-            with car_lock:
-                if car_id in cars and cars[car_id].connected:
-                    self.socket.sendto(ack_msg.encode('utf-8'), cars[car_id].address)
-                    print(f"📤 向 {car_id} 发送重连确认")
+            snapshot = cars.snapshot
+            row = snapshot.index.get(car_id)
+            if row is not None and snapshot.connected[row]:
+                self.socket.sendto(ack_msg.encode('utf-8'), snapshot.address[row])
+                log.debug("📤 向 %s 发送重连确认", car_id)
         except Exception as e:
-            print(f"❌ 发送重连确认失败: {e}")
+            log.warning("❌ 发送重连确认失败: %s", e, extra={'rate_limit': 1.0})
+
+    def _broadcast_tick(self):
+        """调度器中的广播任务 - 使用子网广播"""
+        if not broadcast_enabled:
+            return
+
+        # 添加调试信息
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("📡 开始广播周期，当前连接小车数量: %d", cars.snapshot.connected_count())
+
+        started = time.monotonic()
+        if self.last_broadcast_tick:
+            BROADCAST_JITTER_SECONDS.observe(abs(started - self.last_broadcast_tick - broadcast_interval))
+        self.last_broadcast_tick = started
+
+        success = self._broadcast_all_cars_data()
+
+        self.broadcast_cycles += 1
+        if self.broadcast_cycles % 20 == 0:  # 每20次打印一次
+            log.debug("📡 广播统计: 成功=%s, 周期=%d", success, self.broadcast_cycles)
+
+    def _collision_tick(self):
+        """调度器中的碰撞预警任务：对最新快照中的在线小车做一次全量计算，预警变化时推送仪表盘"""
+        if not collision_enabled:
+            if collision_monitor.active:
+                collision_monitor.clear()
+                notify_dashboard('collision', get_collision_status())
+            return
+        snapshot = cars.snapshot
+        live_rows = snapshot.live_rows(wall_clock(), 3.0)
+        ids = [snapshot.ids[row] for row in live_rows]
+        raised, cleared = collision_monitor.evaluate(ids, snapshot.x[live_rows], snapshot.y[live_rows],
+                                                     snapshot.vx[live_rows], snapshot.vy[live_rows])
+        if not raised and not cleared:
+            return
+
+        for warning in raised:
+            COLLISION_WARNINGS.inc((warning['level'],))
+            if warning['level'] != "warning":
+                log.warning("⚠️ 碰撞预警 %s <-> %s: %s, TTC %.2fs, 最近距离 %.2fm",
+                            *warning['cars'], warning['level'], warning['ttc'], warning['min_distance'],
+                            extra={'rate_limit': 0.5})
+        notify_dashboard('collision', get_collision_status())
+
+        if collision_action != "none":
+            self._collision_avoidance(snapshot, raised)
+
+    def _collision_avoidance(self, snapshot, raised):
+        """对达到 COLLISION_ACTION_LEVEL 的预警涉及的小车下发避让指令（每车有冷却时间）"""
+        threshold = LEVELS.index(COLLISION_ACTION_LEVEL)
+        now = time.monotonic()
+        targets = []
+        for warning in raised:
+            if LEVELS.index(warning['level']) < threshold:
+                continue
+            for car_id in warning['cars']:
+                if now - self.collision_actions.get(car_id, 0.0) >= COLLISION_ACTION_COOLDOWN:
+                    self.collision_actions[car_id] = now
+                    targets.append(car_id)
+
+        for car_id in targets:
+            # hold：目标设为当前位姿，小车原地停车
+            row = snapshot.index[car_id]
+            message = (f"CTRL:{car_id},TARGET:{snapshot.x[row]:.2f},{snapshot.y[row]:.2f},"
+                       f"{snapshot.heading[row]:.1f}")
+            self.send_command(car_id, message, max_retries=2)
+        if targets:
+            log.warning("🛑 碰撞避让(%s): %s", collision_action, targets)
+
+    def _encode_frames(self, car_rows):
+        """
+        按字节预算把小车数据行装成尽量少的帧，返回 [(frame, 该帧包含的行), ...]
+        行格式为 (car_id, x, y, heading, vx, vy, vz)（已按ID排序），帧格式由 broadcast_format 决定；
+        二进制帧带年龄字段时返回可写的帧，由 _stamp_frame 在发出前填写
+        """
+        if broadcast_format == "binary":
+            number = car_id_table.number
+            entries = [(number(car_id), x, y, heading, vx, vy, vz)
+                       for car_id, x, y, heading, vx, vy, vz in car_rows]
+            packed = pack_binary_fleet_frames(self.broadcast_sequence + 1, entries,
+                                              broadcast_payload_budget, broadcast_group_size,
+                                              broadcast_age_field)
+            self.broadcast_sequence = (self.broadcast_sequence + len(packed)) & 0xFFFF
+        else:
+            # 使用小车期望的格式
+            # 使用极简ID：C1 C2 ... C12（完整车号，避免 CAR1 与 CAR11 冲突）
+            short_id = car_id_table.short_id
+            entries = [(short_id(car_id), x, y, heading, vx, vy, vz)
+                       for car_id, x, y, heading, vx, vy, vz in car_rows]
+            packed = pack_text_fleet_frames(entries, broadcast_payload_budget, broadcast_group_size)
+
+        frames = []
+        start = 0
+        for frame, count in packed:
+            frames.append((frame, car_rows[start:start + count]))
+            start += count
+        return frames
+
+    @staticmethod
+    def _stamp_frame(frame, group_rows, group_index, received_of, now=None):
+        """
+        帧发出前计算帧内各车样本的年龄（距 recvfrom 的秒数）并记录；
+        开启航位推算时把帧内位姿外推到此刻（二进制帧就地改写，文本帧重新编码），
+        帧带年龄字段时就地写入外推后剩余的年龄（毫秒）。返回要发送的帧列表：
+        文本帧外推后数字可能变长，按字节预算重新装帧，超出预算时拆成多帧；
+        now 为发出时的单调时间（默认为当前，回放时由日志时间给出）
+        """
+        if now is None:
+            now = time.monotonic()
+        group_ids = [row[0] for row in group_rows]
+        ages = [now - received_of[car_id] for car_id in group_ids]
+        staleness.record(group_ids, group_index, ages)
+        observe = SAMPLE_AGE_SECONDS.observe
+        for age in ages:
+            observe(age)
+
+        if prediction_mode != "off":
+            predicted, ages = extrapolate_rows(group_rows, ages, prediction_max_horizon,
+                                               prediction_velocity_frame == "body")
+            if isinstance(frame, str):
+                short_id = car_id_table.short_id
+                packed = pack_text_fleet_frames([(short_id(row[0]),) + row[1:] for row in predicted],
+                                                broadcast_payload_budget, broadcast_group_size)
+                if len(packed) > 1:
+                    prediction_stats.count('resplit')
+                return [text for text, _ in packed]
+            frame = set_fleet_frame_poses(bytearray(frame) if isinstance(frame, bytes) else frame,
+                                          [row[1:4] for row in predicted])
+        if broadcast_age_field and not isinstance(frame, str):
+            set_fleet_frame_ages(frame, [age * 1000.0 for age in ages])
+        return [frame]
+
+    def _frame_gap(self, frame_count):
+        """
+        帧间隔：broadcast_frame_gap 为固定秒数时直接使用；
+        auto 时把一个周期的帧均匀分布在广播间隔的 BROADCAST_PACING_SHARE 内，且不超过 BROADCAST_MAX_FRAME_GAP
+        """
+        if broadcast_frame_gap != "auto":
+            return broadcast_frame_gap
+        if frame_count <= 1:
+            return 0.0
+        return min(BROADCAST_MAX_FRAME_GAP, broadcast_interval * BROADCAST_PACING_SHARE / (frame_count - 1))
+
+    def _pace_frames(self, frame_count, frame_gap, send_frame, finish):
+        """
+        依次调用 send_frame(0..frame_count-1)，全部发出后调用 finish()；
+        第 0 帧立即发送，其余帧按 frame_gap 排到调度器各自的截止时间上，
+        不在调度线程上 sleep，帧间隔期间指令重传、碰撞预警等任务照常运行
+        """
+        self.broadcast_in_flight = True
+        started = time.monotonic()
+
+        def send_from(index):
+            while True:
+                try:
+                    send_frame(index)
+                except Exception as e:
+                    log.error("❌ 发送第 %d 帧失败: %s", index + 1, e, extra={'rate_limit': 1.0})
+                index += 1
+                if index >= frame_count:
+                    self.broadcast_in_flight = False
+                    finish()
+                    return
+                if frame_gap:
+                    self.scheduler.call_at(started + index * frame_gap, lambda: send_from(index))
+                    return
+
+        send_from(0)
+
+    def _broadcast_all_cars_data(self, now=None):
+        """使用子网广播发送所有小车数据 - 分组发送；now 为本周期的单调时间（默认为当前，回放时由日志时间给出）"""
+        if self.broadcast_in_flight:
+            # 帧间隔较大时上一个周期可能还没发完，跳过本周期（与原先 sleep 导致的周期超时一致）
+            self.broadcast_cycles_skipped += 1
+            return False
 
-    def _broadcast_loop(self):
-        """UDP广播循环 - 使用子网广播"""
-        last_broadcast = 0
-        debug_counter = 0
+        current_time = wall_clock(now)
 
-        while self.running:
-            try:
-                current_time = time.time()
-                if broadcast_enabled and (current_time - last_broadcast >= broadcast_interval):
-                    # 添加调试信息
-                    with car_lock:
-                        connected_count = sum(1 for car in cars.values() if car.connected)
-                    print(f"📡 开始广播周期，当前连接小车数量: {connected_count}")
-
-                    success = self._broadcast_all_cars_data()
-                    last_broadcast = current_time
-
-                    debug_counter += 1
-                    if debug_counter >= 20:  # 每20次打印一次
-                        print(f"📡 广播统计: 成功={success}, 周期={debug_counter}")
-                        debug_counter = 0
-
-                sleep_time = max(0.001, broadcast_interval - (time.time() - last_broadcast))
-                time.sleep(sleep_time)
-
-            except Exception as e:
-                print(f"❌ 广播循环错误: {e}")
-                time.sleep(0.01)
-
-    def _split_cars_into_groups(self, car_list):
-        """将小车列表分成多个组，每组最多 broadcast_group_size 辆小车"""
-        groups = []
-        car_ids = sorted(car_list.keys())  # 按ID排序确保分组稳定
-
-        for i in range(0, len(car_ids), broadcast_group_size):
-            group_car_ids = car_ids[i:i + broadcast_group_size]
-            group_cars = {car_id: car_list[car_id] for car_id in group_car_ids}
-            groups.append(group_cars)
-
-        return groups
-
-    def _broadcast_all_cars_data(self):
-        """使用子网广播发送所有小车数据 - 分组发送"""
-        current_time = time.time()
-        connected_cars = {}
-
-        # 收集连接的小车
-        with car_lock:
-            for car_id, car in cars.items():
-                if car.connected and current_time - car.last_update < 3.0:
-                    connected_cars[car_id] = car
+        # 从最新快照收集连接的小车（无锁，向量化筛选 + 按列取数）
+        snapshot = cars.snapshot
+        live_rows = snapshot.live_rows(current_time, 3.0)
+        car_rows = snapshot.rows(live_rows, ('x', 'y', 'heading', 'vx', 'vy', 'vz'))
+        slot_of = dict(zip(snapshot.ids, snapshot.slots.tolist()))
+        # 快照中各车样本的接收时间，发出每帧时据此计算年龄
+        received_of = dict(zip([row[0] for row in car_rows], snapshot.received[live_rows].tolist()))
+
+        # 拓扑未启用时所有小车互相可见，等同于广播
+        if dissemination_mode == "topology" and topology_enabled and car_rows:
+            addresses = {snapshot.ids[row]: snapshot.address[row] for row in live_rows}
+            return self._disseminate_by_topology(car_rows, addresses, slot_of, received_of, current_time, now)
 
-        print(f"📡 准备广播，连接的小车: {list(connected_cars.keys())}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("📡 准备广播，连接的小车: %s", [row[0] for row in car_rows])
 
-        if not connected_cars:
-            print("📡 没有连接的小车，跳过广播")
+        if not car_rows:
+            log.debug("📡 没有连接的小车，跳过广播", extra={'rate_limit': 5.0})
             return False
 
         try:
-            # 将小车分成多个组
-            car_groups = self._split_cars_into_groups(connected_cars)
-            total_groups = len(car_groups)
-
-            print(f"📡 将 {len(connected_cars)} 辆小车分成 {total_groups} 组进行广播")
+            started = time.monotonic()
 
-            all_success = True
+            # 按字节预算装帧
+            car_groups = self._encode_frames(car_rows)
+            total_groups = len(car_groups)
+            frame_gap = self._frame_gap(total_groups)
 
-            # 依次广播每个组
-            for group_index, group_cars in enumerate(car_groups):
-                # 构建包含组内小车数据的广播消息
-                broadcast_parts = [f"[{len(group_cars)}"]
-                for car_id, car in group_cars.items():
-                    # 使用小车期望的格式
-                    # 使用极简ID：C1 C2 C3
-                    short_id = f"C{car_id[-1]}"
-                    car_data = (f"{short_id} {car.position['x']:.2f} {car.position['y']:.2f} "
-                                f"{car.heading:.1f} {car.velocity['vx']:.4f} "
-                                f"{car.velocity['vy']:.4f} {car.velocity['vz']:.4f}")
-                    broadcast_parts.append(car_data)
+            log.debug("📡 将 %d 辆小车装成 %d 帧进行广播", len(car_rows), total_groups)
 
-                broadcast_msg = " ".join(broadcast_parts) + "]"
-                print(f"📡 广播第 {group_index + 1}/{total_groups} 组小车数据: {broadcast_msg}")
+            cycle = {'success': True, 'bytes': 0}
 
+            def send_frame(group_index):
+                broadcast_msg, group_rows = car_groups[group_index]
+                log.debug("📡 广播第 %d/%d 帧小车数据: %s", group_index + 1, total_groups, broadcast_msg)
+                cycle['bytes'] += len(broadcast_msg)
                 # 发送广播消息 - 使用子网广播地址
-                success = self.broadcast_server.broadcast_data(broadcast_msg)
-                if not success:
-                    all_success = False
+                for frame in self._stamp_frame(broadcast_msg, group_rows, group_index, received_of, now):
+                    if not self.broadcast_server.broadcast_data(frame):
+                        cycle['success'] = False
 
                 # 更新组内小车的最后广播时间
-                for car in group_cars.values():
-                    car.last_broadcast_time = current_time
+                group_ids = [row[0] for row in group_rows]
+                with car_lock:
+                    cars.touch_broadcast(group_ids, [slot_of[car_id] for car_id in group_ids], current_time)
+
+            def finish():
+                duration = time.monotonic() - started
+                BROADCAST_CYCLE_SECONDS.observe(duration)
+                BROADCAST_FRAMES.observe(total_groups)
+                self.broadcast_cycle_stats = {
+                    'cars': len(car_rows),
+                    'frames': total_groups,
+                    'bytes': cycle['bytes'],
+                    'frame_gap_ms': frame_gap * 1000,
+                    'duration_ms': duration * 1000
+                }
+                log.debug("📡 分组广播完成: %s", '全部成功' if cycle['success'] else '部分失败')
+
+            # 第一帧立即发出，后续帧按帧间隔排到调度器上
+            self._pace_frames(total_groups, frame_gap, send_frame, finish)
+            return cycle['success']
 
-                # 如果不是最后一组，稍微延迟一下再发送下一组
-                if group_index < total_groups - 1:
-                    time.sleep(0.01)  # 10ms延迟
+        except Exception as e:
+            log.error("❌ 广播所有小车数据失败: %s", e, extra={'rate_limit': 1.0})
+            return False
+
+    def _disseminate_by_topology(self, car_rows, addresses, slot_of, received_of, current_time, now=None):
+        """
+        拓扑分发：每辆小车只收到拓扑中它可见的小车状态；
+        可见集合相同的小车共用同一组编码好的帧，帧单播到各自的广播端口
+        """
+        try:
+            rows_by_id = {row[0]: row for row in car_rows}
+
+            # 按可见集合对接收方分组
+            audiences = {}
+            for receiver in rows_by_id:
+                visible = frozenset(car_id for car_id in self._get_visible_cars_for_car(receiver)
+                                    if car_id in rows_by_id)
+                if visible:
+                    audiences.setdefault(visible, []).append(receiver)
+
+            if not audiences:
+                log.debug("📡 拓扑中没有可见的小车，跳过分发", extra={'rate_limit': 5.0})
+                return False
+
+            # 每个可见集合只编码一次
+            plans = []
+            sent_ids = set()
+            for visible, receivers in audiences.items():
+                visible_rows = [rows_by_id[car_id] for car_id in sorted(visible)]
+                frames = self._encode_frames(visible_rows)
+                targets = [addresses[receiver][0] for receiver in receivers if addresses[receiver]]
+                plans.append((frames, targets))
+                sent_ids.update(visible)
+
+            started = time.monotonic()
+            cycle = {'success': True, 'frames_sent': 0}
+            max_frames = max(len(frames) for frames, _ in plans)
+            frame_gap = self._frame_gap(max_frames)
+
+            # 第 i 帧先发给所有接收方，再间隔发送下一帧，保证单个接收方的帧间隔不变
+            def send_frame(frame_index):
+                for frames, targets in plans:
+                    if frame_index >= len(frames):
+                        continue
+                    frame, frame_rows = frames[frame_index]
+                    for stamped in self._stamp_frame(frame, frame_rows, frame_index, received_of, now):
+                        for ip in targets:
+                            if not self.broadcast_server.send_data(stamped, ip):
+                                cycle['success'] = False
+                            cycle['frames_sent'] += 1
+
+            def finish():
+                BROADCAST_CYCLE_SECONDS.observe(time.monotonic() - started)
+                ids = sorted(sent_ids)
+                with car_lock:
+                    cars.touch_broadcast(ids, [slot_of[car_id] for car_id in ids], current_time)
+                self.dissemination_stats = {
+                    'audiences': len(plans),
+                    'receivers': sum(len(targets) for _, targets in plans),
+                    'frames_sent': cycle['frames_sent']
+                }
+                log.debug("📡 拓扑分发完成: %d 个可见集合, %d 帧", len(plans), cycle['frames_sent'])
 
-            print(f"📡 分组广播完成: {'全部成功' if all_success else '部分失败'}")
-            return all_success
+            self._pace_frames(max_frames, frame_gap, send_frame, finish)
+            return cycle['success']
 
         except Exception as e:
-            print(f"❌ 广播所有小车数据失败: {e}")
+            log.error("❌ 拓扑分发失败: %s", e, extra={'rate_limit': 1.0})
             return False
 
     def _get_visible_cars_for_car(self, target_car_id):
         """获取目标小车可以看到的其他小车列表"""
         if not topology_enabled:
-            return ["CAR1", "CAR2", "CAR3", "CAR4"]
-        return topology_cache.get(target_car_id, [])
-
-    def _health_check_loop(self):
-        """连接健康检查循环"""
-        while self.running:
-            try:
-                current_time = time.time()
-                disconnected_cars = []
+            return [car_id for car_id in cars.snapshot.ids if car_id != target_car_id]
+        return topology_graph.visible(target_car_id)
 
-                with car_lock:
-                    for car_id, car in cars.items():
-                        # 如果小车超过3秒没有更新，标记为断开
-                        if current_time - car.last_update > 5.0:
-                            if car.connected:
-                                disconnected_cars.append(car_id)
-                                car.connected = False
+    def _health_check_once(self):
+        """连接健康检查"""
+        current_time = wall_clock()
 
-                for car_id in disconnected_cars:
-                    print(f"⚠️ 小车 {car_id} 超时未更新，标记为断开")
-
-                time.sleep(2.0)
+        # 如果小车超过5秒没有更新，标记为断开（先查快照，确有超时才加锁）
+        disconnected_cars = []
+        if cars.snapshot.stale_ids(current_time, 5.0):
+            with car_lock:
+                disconnected_cars = cars.mark_stale(current_time, 5.0)
+                if disconnected_cars:
+                    cars.publish()
 
-            except Exception as e:
-                print(f"❌ 健康检查错误: {e}")
-                time.sleep(1.0)
+        for car_id in disconnected_cars:
+            log.warning("⚠️ 小车 %s 超时未更新，标记为断开", car_id)
+            notify_dashboard('car_event', {'type': 'disconnected', 'car_id': car_id})
 
-    def _cleanup_loop(self):
+    def _cleanup_once(self):
         """清理离线小车"""
-        while self.running:
-            try:
-                current_time = time.time()
-                cleanup_cars = []
+        current_time = wall_clock()
 
-                with car_lock:
-                    for car_id, car in list(cars.items()):
-                        # 如果小车断开超过60秒，清理资源
-                        if not car.connected and current_time - car.last_update > 60.0:
-                            cleanup_cars.append(car_id)
+        # 如果小车断开超过60秒，清理资源（先查快照，确有过期才加锁）
+        if not cars.snapshot.expired_ids(current_time, 60.0):
+            return
 
-                for car_id in cleanup_cars:
-                    with car_lock:
-                        if car_id in cars:
-                            del cars[car_id]
-                            print(f"🗑️ 清理长时间离线小车: {car_id}")
-
-                time.sleep(10.0)
-
-            except Exception as e:
-                print(f"❌ 清理循环错误: {e}")
-                time.sleep(1.0)
+        with car_lock:
+            cleanup_cars = cars.expired_ids(current_time, 60.0)
+            for car_id in cleanup_cars:
+                del cars[car_id]
+            if cleanup_cars:
+                cars.publish()
+
+        for car_id in cleanup_cars:
+            history.forget(car_id)
+            staleness.forget(car_id)
+            spatial_index.remove(car_id)
+            prediction_stats.forget(car_id)
+            self.rejected_streak.pop(car_id, None)
+            log.info("🗑️ 清理长时间离线小车: %s", car_id)
+            notify_dashboard('car_event', {'type': 'removed', 'car_id': car_id})
 
     def send_to_car(self, car_id, message):
         """向指定小车发送消息"""
@@ -479,33 +1051,65 @@ class UDPServer:
                         if not message.endswith('\n'):
                             message += '\n'
                         self.socket.sendto(message.encode('utf-8'), car.address)
-                        print(f"📤 向 {car_id} 发送: {message.strip()}")
+                        log.debug("📤 向 %s 发送: %s", car_id, message.strip())
                         return True
                     except Exception as e:
-                        print(f"❌ 向 {car_id} 发送失败: {e}")
+                        log.warning("❌ 向 %s 发送失败: %s", car_id, e)
                         car.connected = False
+                        cars.publish()
                         return False
                 else:
-                    print(f"⚠️ 小车 {car_id} 已断开连接")
+                    log.warning("⚠️ 小车 %s 已断开连接", car_id, extra={'rate_limit': 1.0})
             else:
-                print(f"⚠️ 小车 {car_id} 不存在")
+                log.warning("⚠️ 小车 %s 不存在", car_id, extra={'rate_limit': 1.0})
         return False
 
+    def send_to_addresses(self, messages):
+        """
+        批量单播 [(address, message)]，地址取自快照，不加锁；
+        用于高频、可丢失的数据流（如服务器端编队控制的目标位姿），返回成功条数
+        """
+        sent = 0
+        sendto = self.socket.sendto
+        for address, message in messages:
+            try:
+                sendto(message if isinstance(message, bytes) else f"{message}\n".encode('utf-8'), address)
+                sent += 1
+            except OSError as e:
+                log.warning("❌ 向 %s 发送失败: %s", address, e, extra={'rate_limit': 1.0})
+        return sent
+
+    def send_command(self, car_id, message, max_retries=4):
+        """
+        通过指令通道发送，返回 PendingCommand（首次发送失败返回None）；
+        开启确认的小车在确认前最多重传 max_retries 次，旧固件小车盲发 max_retries 次，均由调度线程完成
+        """
+        command = self.commands.send(car_id, message, max_attempts=max_retries + 1)
+        UNICAST_COMMANDS.inc(('sent',) if command is not None else ('failed',))
+        return command
+
     def send_to_car_reliable(self, car_id, message, max_retries=4):
-        """可靠地向指定小车发送消息 - 重复4次"""
-        for attempt in range(max_retries):
-            if self.send_to_car(car_id, message):
-                return True
-            time.sleep(0.05)
-        return False
+        """可靠地向指定小车发送消息，不阻塞调用线程，返回首次发送是否成功"""
+        return self.send_command(car_id, message, max_retries) is not None
+
+    def broadcast_frame(self, payload, repeats=3, delay=0.01):
+        """广播一个二进制帧 repeats 次（后续几份由调度线程发出），返回首次发送是否成功"""
+        return self.commands.broadcast_blind(payload, repeats, delay) is not None
 
     def broadcast_global_command(self, command):
-        """广播全局指令（重复5次）"""
-        return self.broadcast_server.broadcast_command_reliable(command, retries=5, delay=0.01)
+        """
+        下发全局指令：确认模式下逐车发送并只重传未确认的小车，
+        否则广播5次（后4次由调度线程间隔10ms发出）
+        """
+        snapshot = cars.snapshot
+        connected_ids = [car_id for car_id, connected in zip(snapshot.ids, snapshot.connected) if connected]
+        return bool(self.commands.broadcast(command, connected_ids, repeats=5, delay=0.01))
 
     def stop(self):
         """停止服务器"""
         self.running = False
+        self.scheduler.stop()
+        self.dispatcher.stop()
         if self.socket:
             self.socket.close()
         self.broadcast_server.stop()
@@ -515,33 +1119,19 @@ class UDPServer:
 udp_server = UDPServer(UDP_HOST, UDP_PORT)
 
 
-# 拓扑缓存更新函数
-def update_topology_cache():
-    global topology_cache
+# 拓扑更新函数
+def update_topology_cache(graph=None):
+    """替换当前拓扑图（整体替换，读取方无需加锁）"""
+    global topology_graph, communication_topology
 
-    if not topology_enabled:
-        topology_cache = {
-            "CAR1": ["CAR2", "CAR3", "CAR4"],
-            "CAR2": ["CAR1", "CAR3", "CAR4"],
-            "CAR3": ["CAR1", "CAR2", "CAR4"],
-            "CAR4": ["CAR1", "CAR2", "CAR3"]
-        }
-    else:
-        topology_cache = {}
-        car_ids = ["CAR1", "CAR2", "CAR3", "CAR4"]
-        car_mapping = {"CAR1": 0, "CAR2": 1, "CAR3": 2, "CAR4": 3}
+    if graph is not None:
+        topology_graph = graph
+        communication_topology = (graph.to_matrix() if len(graph.ids) <= TOPOLOGY_COMMAND_MAX_CARS
+                                  else None)
 
-        for target_car in car_ids:
-            visible_cars = []
-            target_index = car_mapping[target_car]
-            for other_car in car_ids:
-                if other_car != target_car:
-                    other_index = car_mapping[other_car]
-                    if communication_topology[other_index][target_index] == 1:
-                        visible_cars.append(other_car)
-            topology_cache[target_car] = visible_cars
-
-    print(f"🔧 拓扑缓存已更新: {topology_cache}")
+    log.info("🔧 拓扑已更新: %d 辆小车, %d 条可见关系, %s",
+             len(topology_graph.ids), topology_graph.edge_count(),
+             "已启用" if topology_enabled else "未启用（全部可见）")
 
 
 # 编队控制变量
@@ -549,27 +1139,83 @@ formation_enabled = False
 formation_leader = None
 formation_type = "line"
 
-# 编队配置
-FORMATION_CONFIGS = {
-    "line": {
-        "CAR1": {"x": 0, "y": 0, "yaw": 0},
-        "CAR2": {"x": -0.5, "y": 0, "yaw": 0},
-        "CAR3": {"x": -1.0, "y": 0, "yaw": 0},
-        "CAR4": {"x": -1.5, "y": 0, "yaw": 0}
-    },
-    "triangle": {
-        "CAR1": {"x": 0, "y": 0, "yaw": 0},
-        "CAR2": {"x": -0.5, "y": -0.5, "yaw": 0},
-        "CAR3": {"x": -0.5, "y": 0.5, "yaw": 0},
-        "CAR4": {"x": -1.0, "y": 0, "yaw": 0}
-    },
-    "square": {
-        "CAR1": {"x": 0, "y": 0, "yaw": 0},
-        "CAR2": {"x": 0, "y": -0.5, "yaw": 0},
-        "CAR3": {"x": -0.5, "y": -0.5, "yaw": 0},
-        "CAR4": {"x": -0.5, "y": 0, "yaw": 0}
+
+def notify_dashboard(event, payload):
+    """登记一条待推送给仪表盘的事件（任意线程可调用，只做入队）"""
+    dashboard_events.append((event, payload))
+
+
+def get_broadcast_status():
+    return {
+        'broadcast_enabled': broadcast_enabled,
+        'broadcast_interval': broadcast_interval,
+        'broadcast_group_size': broadcast_group_size,
+        'broadcast_payload_budget': broadcast_payload_budget,
+        'broadcast_frame_gap': broadcast_frame_gap,
+        'broadcast_format': broadcast_format,
+        'broadcast_age_field': broadcast_age_field,
+        'prediction_mode': prediction_mode,
+        'broadcast_cycle_stats': udp_server.broadcast_cycle_stats,
+        'broadcast_cycles_skipped': udp_server.broadcast_cycles_skipped,
+        'dissemination_mode': dissemination_mode,
+        'dissemination_stats': udp_server.dissemination_stats
+    }
+
+
+def get_collision_status():
+    return {
+        'collision_enabled': collision_enabled,
+        'collision_action': collision_action,
+        'config': collision_monitor.config(),
+        'warnings': collision_monitor.warnings,
+        'stats': collision_monitor.stats
+    }
+
+
+def get_topology_status_data():
+    graph = topology_graph
+    status = {
+        'topology': communication_topology,
+        'topology_enabled': topology_enabled,
+        'car_ids': graph.ids,
+        'edge_count': graph.edge_count()
     }
-}
+    if communication_topology is None:
+        # 大规模拓扑只返回邻接表
+        status['adjacency'] = graph.to_adjacency()
+    return status
+
+
+def fleet_push_payload(snapshot):
+    return {'version': snapshot.version, 'cars': compact_car_dicts(snapshot)}
+
+
+def dashboard_push_loop():
+    """仪表盘推送循环：发出积压的事件，车队状态有新版本时推送一次"""
+    last_version = 0
+    while True:
+        cycle_start = time.monotonic()
+        try:
+            while dashboard_events:
+                event, payload = dashboard_events.popleft()
+                socketio.emit(event, payload)
+
+            snapshot = cars.snapshot
+            if snapshot.version != last_version:
+                socketio.emit('fleet', fleet_push_payload(snapshot))
+                last_version = snapshot.version
+        except Exception as e:
+            log.error("❌ 仪表盘推送失败: %s", e, extra={'rate_limit': 1.0})
+
+        socketio.sleep(max(0.005, push_interval - (time.monotonic() - cycle_start)))
+
+
+@socketio.on('connect')
+def handle_dashboard_connect():
+    """新仪表盘连接时发送一次完整状态"""
+    socketio.emit('broadcast', get_broadcast_status(), to=request.sid)
+    socketio.emit('topology', get_topology_status_data(), to=request.sid)
+    socketio.emit('fleet', fleet_push_payload(cars.snapshot), to=request.sid)
 
 
 # Flask路由
@@ -578,27 +1224,332 @@ def index():
     return render_template('index.html')
 
 
+def compact_car_dicts(snapshot, rows=None):
+    """精简格式，字段与前端 parseCompactCarData 对应，rows 为None时导出全部"""
+    if rows is None:
+        rows = list(range(len(snapshot)))
+    result = []
+    for (car_id, x, y, heading, battery, vx, vy, vz, speed, connected,
+         last_update, update_count) in snapshot.rows(
+            rows,
+            ('x', 'y', 'heading', 'battery', 'vx', 'vy', 'vz', 'speed', 'connected',
+             'last_update', 'update_count')):
+        result.append({
+            'i': car_id,
+            'p': [round(x, 3), round(y, 3)],
+            'v': [round(vx, 4), round(vy, 4), round(vz, 4)],
+            'h': round(heading, 1),
+            'b': round(battery, 2),
+            's': round(speed, 4),
+            'c': connected,
+            'lu': round(last_update, 3),
+            'uc': update_count
+        })
+    return result
+
+
+def get_cars_response_body(snapshot, fmt):
+    """返回 (etag, body, gzip_body) ，同一快照版本和格式只序列化一次"""
+    global cars_response_cache
+    version, entries = cars_response_cache
+    if snapshot.version > version:
+        # 版本变化时整体替换缓存（单次引用赋值，无需加锁）
+        entries = {}
+        cars_response_cache = (snapshot.version, entries)
+    elif snapshot.version < version:
+        entries = {}  # 过期快照的结果不写入缓存
+
+    cached = entries.get(fmt)
+    if cached is not None:
+        return cached
+
+    if fmt == 'compact':
+        car_list = compact_car_dicts(snapshot)
+    else:
+        car_list = snapshot.to_dicts()
+    body = json.dumps(car_list, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    gzip_body = gzip.compress(body, compresslevel=1) if len(body) >= CARS_GZIP_MIN_SIZE else None
+    cached = entries[fmt] = (f"{snapshot.version}-{fmt}", body, gzip_body)
+    return cached
+
+
+def get_cars_delta(fmt):
+    """
+    增量查询：返回版本 since 之后变化的小车、被清理的ID和被标记断开的ID；
+    没有变化时阻塞等待新版本，最长 timeout 秒
+    """
+    try:
+        since = int(request.args['since'])
+        timeout = min(float(request.args.get('timeout', CARS_LONG_POLL_TIMEOUT)), CARS_LONG_POLL_MAX_TIMEOUT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since/timeout 参数无效'}), 400
+
+    snapshot = cars.snapshot
+    if since == snapshot.version and timeout > 0:
+        snapshot = cars.wait_for_version(since, timeout)
+
+    # 客户端版本比服务器还新（例如服务器重启）时，按全量同步处理
+    removed = snapshot.removed_since(since) if since <= snapshot.version else None
+    full = since <= 0 or removed is None
+    rows = None if full else snapshot.changed_rows(since)
+
+    if fmt == 'compact':
+        car_list = compact_car_dicts(snapshot, rows)
+    else:
+        car_list = snapshot.to_dicts(rows)
+
+    if rows is None:
+        rows = list(range(len(snapshot)))
+    disconnected = [snapshot.ids[row] for row in rows if not snapshot.connected[row]]
+
+    return jsonify({
+        'version': snapshot.version,
+        'since': since,
+        'full': full,
+        'cars': car_list,
+        'removed': removed or [],
+        'disconnected': disconnected
+    })
+
+
+@app.route('/api/cars/<car_id>/history')
+def get_car_history(car_id):
+    """
+    小车遥测历史，服务器端降采样：?from=&to=（Unix时间戳，秒）&max_points=&method=lttb|decimate
+    &value=（LTTB 依据的字段，默认 speed）
+    """
+    start = request.args.get('from', type=float)
+    end = request.args.get('to', type=float)
+    max_points = request.args.get('max_points', 500, type=int)
+    method = request.args.get('method', 'lttb')
+    value = request.args.get('value', 'speed')
+    if method not in HISTORY_METHODS:
+        return jsonify({'success': False, 'error': f'method 必须为 {" 或 ".join(HISTORY_METHODS)}'}), 400
+    if value not in HISTORY_FIELDS:
+        return jsonify({'success': False, 'error': f'value 必须为 {", ".join(HISTORY_FIELDS)} 之一'}), 400
+    if not 2 <= max_points <= HISTORY_MAX_POINTS:
+        return jsonify({'success': False, 'error': f'max_points 必须在 2-{HISTORY_MAX_POINTS} 之间'}), 400
+
+    result = history.query(car_id, start, end, max_points, method, value)
+    if result is None:
+        return jsonify({'success': False, 'error': f'小车 {car_id} 没有历史数据'}), 404
+
+    points, total = result
+    return jsonify({
+        'success': True,
+        'car_id': car_id,
+        'method': method,
+        'total': total,
+        'count': len(points['t']),
+        'points': points
+    })
+
+
+@app.route('/api/history')
+def get_history_stats():
+    """历史缓冲区容量与内存占用"""
+    return jsonify(history.stats())
+
+
+def _connected_filter(snapshot):
+    """空间查询的过滤条件：只返回快照中在线的小车"""
+    index = snapshot.index
+    connected = snapshot.connected
+
+    def accept(car_id):
+        row = index.get(car_id)
+        return row is not None and bool(connected[row])
+    return accept
+
+
+def _neighbor_entries(found):
+    return [{'id': car_id, 'distance': round(distance, 4),
+             'position': dict(zip(('x', 'y'), spatial_index.position(car_id) or (None, None)))}
+            for car_id, distance in found]
+
+
+@app.route('/api/cars/near')
+def get_cars_near():
+    """半径查询：?x=&y=&r=（米），返回半径内在线小车，按距离升序；limit 限制返回数量"""
+    x = request.args.get('x', type=float)
+    y = request.args.get('y', type=float)
+    radius = request.args.get('r', type=float)
+    limit = request.args.get('limit', 0, type=int)
+    if x is None or y is None or radius is None:
+        return jsonify({'success': False, 'error': '需要参数 x, y, r'}), 400
+    # type=float 接受 nan/inf，网格计算格子时会抛异常；比较对 nan 恒为假，因此一并拒绝
+    if not (abs(x) <= SPATIAL_MAX_COORDINATE and abs(y) <= SPATIAL_MAX_COORDINATE):
+        return jsonify({'success': False, 'error': f'x, y 必须为绝对值不超过 {SPATIAL_MAX_COORDINATE:g} 的有限数'}), 400
+    if not 0 <= radius <= 1000:
+        return jsonify({'success': False, 'error': 'r 必须在 0-1000 之间'}), 400
+
+    snapshot = cars.snapshot
+    started = time.perf_counter()
+    found = spatial_index.near(x, y, radius, _connected_filter(snapshot))
+    elapsed = time.perf_counter() - started
+    if limit > 0:
+        found = found[:limit]
+    return jsonify({
+        'success': True,
+        'center': {'x': x, 'y': y},
+        'radius': radius,
+        'count': len(found),
+        'cars': _neighbor_entries(found),
+        'query_us': round(elapsed * 1e6, 1)
+    })
+
+
+@app.route('/api/cars/<car_id>/neighbors')
+def get_car_neighbors(car_id):
+    """k 近邻：?k=（默认 3），返回距该车最近的 k 辆在线小车（不含自身）"""
+    k = request.args.get('k', 3, type=int)
+    if not 1 <= k <= SPATIAL_MAX_NEIGHBORS:
+        return jsonify({'success': False, 'error': f'k 必须在 1-{SPATIAL_MAX_NEIGHBORS} 之间'}), 400
+    position = spatial_index.position(car_id)
+    if position is None:
+        return jsonify({'success': False, 'error': f'小车 {car_id} 没有位置数据'}), 404
+
+    snapshot = cars.snapshot
+    started = time.perf_counter()
+    found = spatial_index.nearest(position[0], position[1], k, car_id, _connected_filter(snapshot))
+    elapsed = time.perf_counter() - started
+    return jsonify({
+        'success': True,
+        'car_id': car_id,
+        'position': {'x': position[0], 'y': position[1]},
+        'k': k,
+        'neighbors': _neighbor_entries(found),
+        'query_us': round(elapsed * 1e6, 1)
+    })
+
+
+@app.route('/api/collisions')
+def get_collisions():
+    """当前碰撞预警（按 TTC 升序）、预警参数和最近一次计算的耗时"""
+    return jsonify(get_collision_status())
+
+
+@app.route('/api/collisions/config', methods=['POST'])
+def set_collision_config():
+    """
+    设置碰撞预警：enable、radius（安全半径，米）、ttc_warning / ttc_danger（秒）、horizon（外推时长，秒）、
+    action（none / hold）
+    """
+    global collision_enabled, collision_action
+    data = request.json or {}
+    action = data.get('action', collision_action)
+    if action not in COLLISION_ACTIONS:
+        return jsonify({'success': False, 'error': f'action 必须为 {" / ".join(COLLISION_ACTIONS)} 之一'})
+    try:
+        values = {name: float(data[name]) for name in ('radius', 'ttc_warning', 'ttc_danger', 'horizon')
+                  if name in data}
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': '参数必须为数字'})
+    if not all(value > 0 for value in values.values()):
+        return jsonify({'success': False, 'error': '参数必须大于0'})
+
+    collision_monitor.configure(**values)
+    if 'enable' in data:
+        collision_enabled = bool(data['enable'])
+    collision_action = action
+    log.info("⚠️ 碰撞预警配置: 启用=%s, 处理=%s, %s", collision_enabled, collision_action, collision_monitor.config())
+    notify_dashboard('collision', get_collision_status())
+    return jsonify({'success': True, **get_collision_status()})
+
+
+@app.route('/api/spatial/stats')
+def get_spatial_stats():
+    """空间索引规模：格子边长、已占用格子数、单格最多小车数和跨格移动次数"""
+    return jsonify(spatial_index.stats())
+
+
 @app.route('/api/cars')
 def get_cars():
-    """获取所有小车状态"""
-    with car_lock:
-        car_list = []
-        for car_id, car in cars.items():
-            car_list.append({
-                'id': car_id,
-                'mac_address': car.mac_address,
-                'position': car.position,
-                'heading': car.heading,
-                'battery': car.battery,
-                'velocity': car.velocity,
-                'speed': car.speed,
-                'connected': car.connected,
-                'status': car.status,
-                'last_update': car.last_update,
-                'update_count': car.update_count,
-                'connection_attempts': car.connection_attempts
-            })
-        return jsonify(car_list)
+    """
+    获取所有小车状态，支持 ?format=compact、If-None-Match/304 和 gzip；
+    带 ?since=<版本> 时为增量长轮询查询
+    """
+    fmt = request.args.get('format', 'full')
+    if fmt not in ('full', 'compact'):
+        return jsonify({'success': False, 'error': 'format 必须为 full 或 compact'}), 400
+
+    if 'since' in request.args:
+        return get_cars_delta(fmt)
+
+    etag, body, gzip_body = get_cars_response_body(cars.snapshot, fmt)
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif gzip_body is not None and request.accept_encodings['gzip']:
+        response = Response(gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.observe(time.perf_counter() - started, (endpoint, request.method, str(response.status_code)))
+    return response
+
+
+metrics.gauge('packets_received_total', '收到的数据报总数（含确认）', lambda: udp_server.ingest_stats['packets'],
+              kind="counter")
+metrics.gauge('cars_connected', '在线小车数', lambda: cars.snapshot.connected_count())
+# 被接受的样本数取自 update_count 列（不含门限丢弃的样本；update_count 不计首条样本，这里加回）
+metrics.gauge('car_packets_accepted_total', '按小车统计的被接受样本（写入车队状态）',
+              lambda: {(car_id,): count + 1 for car_id, count
+                       in zip(cars.snapshot.ids, cars.snapshot.update_count.tolist())},
+              ('car',), kind="counter")
+metrics.gauge('command_channel_total', '指令通道累计计数（发送、确认、重传、超时等）',
+              lambda: {(name,): value for name, value in udp_server.commands.counters.items()},
+              ('counter',), kind="counter")
+
+
+@app.route('/metrics')
+def get_metrics_prometheus():
+    """Prometheus 文本格式指标"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/metrics')
+def get_metrics_json():
+    """与 /metrics 相同的指标（JSON），直方图附带均值和按分桶估计的分位数"""
+    return jsonify(metrics.to_dict())
+
+
+@app.route('/api/ingest/stats')
+def get_ingest_stats():
+    """获取批量接收统计"""
+    stats = udp_server.ingest_stats
+    batches = stats['batches']
+    return jsonify({
+        'batches': batches,
+        'packets': stats['packets'],
+        'avg_batch_size': stats['packets'] / batches if batches else 0,
+        'last_batch_size': stats['last_batch_size'],
+        'max_batch_size': stats['max_batch_size'],
+        'batch_size_histogram': {str(k): v for k, v in sorted(stats['batch_size_histogram'].items())}
+    })
+
+
+@app.route('/api/scheduler/stats')
+def get_scheduler_stats():
+    """获取调度任务统计：运行次数、抖动、耗时、超时和跳过的周期"""
+    return jsonify(udp_server.scheduler.stats())
 
 
 @app.route('/api/broadcast', methods=['POST'])
@@ -610,7 +1561,8 @@ def toggle_broadcast():
     broadcast_enabled = enable
     status = "开启" if enable else "关闭"
 
-    print(f"📢 广播功能 {status}")
+    log.info("📢 广播功能 %s", status)
+    notify_dashboard('broadcast', get_broadcast_status())
 
     # 移除初始化广播测试
     # if enable:
@@ -624,6 +1576,29 @@ def toggle_broadcast():
     })
 
 
+@app.route('/api/broadcast/status')
+def broadcast_status():
+    return jsonify(get_broadcast_status())
+
+
+@app.route('/api/push/interval', methods=['POST'])
+def set_push_interval():
+    global push_interval
+    data = request.json
+    interval = data.get('interval', 0.1)
+
+    if interval <= 0:
+        return jsonify({'success': False, 'error': '间隔必须大于0'})
+
+    push_interval = interval
+
+    return jsonify({
+        'success': True,
+        'message': f'推送间隔已更新为{interval}秒',
+        'push_interval': interval
+    })
+
+
 @app.route('/api/broadcast/interval', methods=['POST'])
 def set_broadcast_interval():
     global broadcast_interval
@@ -648,18 +1623,175 @@ def set_broadcast_group_size():
     data = request.json
     group_size = data.get('group_size', 2)
 
-    if group_size <= 0:
-        return jsonify({'success': False, 'error': '分组大小必须大于0'})
+    if not isinstance(group_size, int) or group_size < 0:
+        return jsonify({'success': False, 'error': '分组大小必须为非负整数（0 表示只按字节预算装帧）'})
 
     broadcast_group_size = group_size
 
     return jsonify({
         'success': True,
-        'message': f'广播分组大小已更新为{group_size}辆小车',
+        'message': f'广播分组大小已更新为{group_size}辆小车' if group_size else '广播分组已改为只按字节预算装帧',
         'broadcast_group_size': group_size
     })
 
 
+@app.route('/api/broadcast/packing', methods=['POST'])
+def set_broadcast_packing():
+    """设置装帧字节预算和帧间隔：{"payload_budget": 1400, "frame_gap": "auto" 或秒数}"""
+    global broadcast_payload_budget, broadcast_frame_gap
+    data = request.json
+
+    budget = data.get('payload_budget', broadcast_payload_budget)
+    frame_gap = data.get('frame_gap', broadcast_frame_gap)
+
+    if not isinstance(budget, int) or not 64 <= budget <= 65507:
+        return jsonify({'success': False, 'error': '字节预算必须是 64~65507 之间的整数'})
+    if frame_gap != "auto" and (not isinstance(frame_gap, (int, float)) or not 0 <= frame_gap <= 0.1):
+        return jsonify({'success': False, 'error': '帧间隔必须为 auto 或 0~0.1 秒'})
+
+    broadcast_payload_budget = budget
+    broadcast_frame_gap = frame_gap
+
+    return jsonify({
+        'success': True,
+        'message': f'装帧预算已更新为{budget}字节，帧间隔: {frame_gap}',
+        'broadcast_payload_budget': budget,
+        'broadcast_frame_gap': frame_gap
+    })
+
+
+@app.route('/api/broadcast/format', methods=['POST'])
+def set_broadcast_format():
+    """设置下行帧格式；age_field 只对 binary 生效（文本帧字段数固定，旧小车无法解析多出的字段）"""
+    global broadcast_format, broadcast_age_field
+    data = request.json
+    fmt = data.get('format', 'text')
+
+    if fmt not in ("text", "binary"):
+        return jsonify({'success': False, 'error': '广播格式必须为 text 或 binary'})
+
+    broadcast_format = fmt
+    if 'age_field' in data:
+        broadcast_age_field = bool(data['age_field'])
+
+    return jsonify({
+        'success': True,
+        'message': f'广播格式已更新为{fmt}',
+        'broadcast_format': fmt,
+        'broadcast_age_field': broadcast_age_field
+    })
+
+
+@app.route('/api/staleness')
+def get_staleness():
+    """样本年龄分布：从 recvfrom 到广播发出，整体、按帧序号和按小车的 p50/p99/max；?car=<ID> 只查一辆"""
+    car_id = request.args.get('car')
+    if car_id:
+        stats = staleness.stats(car_id)
+        if stats is None:
+            return jsonify({'success': False, 'error': f'小车 {car_id} 没有年龄记录'}), 404
+        return jsonify({'car_id': car_id, **stats})
+    return jsonify(staleness.stats())
+
+
+@app.route('/api/broadcast/prediction', methods=['POST'])
+def set_broadcast_prediction():
+    """
+    设置航位推算：mode（off / cv）、max_horizon（最长外推秒数）、max_speed（样本门限速度上限，米/秒）、
+    velocity_frame（遥测速度的坐标系 world / body）
+    """
+    global prediction_mode, prediction_max_horizon, prediction_max_speed, prediction_velocity_frame
+    data = request.json or {}
+    mode = data.get('mode', prediction_mode)
+    if mode not in PREDICTION_MODES:
+        return jsonify({'success': False, 'error': f'mode 必须为 {" 或 ".join(PREDICTION_MODES)}'})
+    velocity_frame = data.get('velocity_frame', prediction_velocity_frame)
+    if velocity_frame not in PREDICTION_VELOCITY_FRAMES:
+        return jsonify({'success': False,
+                        'error': f'velocity_frame 必须为 {" 或 ".join(PREDICTION_VELOCITY_FRAMES)}'})
+    try:
+        max_horizon = float(data.get('max_horizon', prediction_max_horizon))
+        max_speed = float(data.get('max_speed', prediction_max_speed))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': '参数必须为数字'})
+    if not 0 < max_horizon <= 2.0:
+        return jsonify({'success': False, 'error': 'max_horizon 必须在 0-2 秒之间'})
+    if not max_speed > 0:
+        return jsonify({'success': False, 'error': 'max_speed 必须大于0'})
+
+    prediction_mode = mode
+    prediction_max_horizon = max_horizon
+    prediction_max_speed = max_speed
+    prediction_velocity_frame = velocity_frame
+    if mode == "off":
+        udp_server.rejected_streak.clear()
+    log.info("🧭 航位推算: %s, 最长外推 %.3fs, 速度上限 %.1fm/s, 速度坐标系 %s",
+             mode, max_horizon, max_speed, velocity_frame)
+    notify_dashboard('broadcast', get_broadcast_status())
+    return jsonify({
+        'success': True,
+        'prediction_mode': prediction_mode,
+        'max_horizon': prediction_max_horizon,
+        'max_speed': prediction_max_speed,
+        'velocity_frame': prediction_velocity_frame
+    })
+
+
+@app.route('/api/prediction')
+def get_prediction_stats():
+    """航位推算误差：下一条真实样本与外推位置 / 上一条样本的距离分布（毫米），以及样本丢弃计数"""
+    return jsonify({
+        'prediction_mode': prediction_mode,
+        'max_horizon': prediction_max_horizon,
+        'max_speed': prediction_max_speed,
+        'velocity_frame': prediction_velocity_frame,
+        **prediction_stats.stats()
+    })
+
+
+@app.route('/api/prediction/reset', methods=['POST'])
+def reset_prediction_stats():
+    prediction_stats.reset()
+    return jsonify({'success': True})
+
+
+@app.route('/api/staleness/reset', methods=['POST'])
+def reset_staleness():
+    staleness.reset()
+    return jsonify({'success': True})
+
+
+@app.route('/api/log', methods=['GET', 'POST'])
+def log_config():
+    """查询日志状态；POST {"level": "DEBUG"} 运行时调整级别"""
+    if request.method == 'POST':
+        level = str(request.json.get('level', 'INFO')).upper()
+        if level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR'):
+            return jsonify({'success': False, 'error': '日志级别无效'})
+        set_level(level)
+    return jsonify({'success': True, **get_log_stats()})
+
+
+@app.route('/api/broadcast/mode', methods=['POST'])
+def set_dissemination_mode():
+    global dissemination_mode
+    data = request.json
+    mode = data.get('mode', 'broadcast')
+
+    if mode not in ("broadcast", "topology"):
+        return jsonify({'success': False, 'error': '分发模式必须为 broadcast 或 topology'})
+
+    dissemination_mode = mode
+    log.info("📡 下行分发模式: %s", mode)
+    notify_dashboard('broadcast', get_broadcast_status())
+
+    return jsonify({
+        'success': True,
+        'message': f'分发模式已更新为{mode}',
+        'dissemination_mode': mode
+    })
+
+
 @app.route('/api/control_position', methods=['POST'])
 def control_car_position():
     data = request.json
@@ -671,62 +1803,184 @@ def control_car_position():
         return jsonify({'success': False, 'error': '缺少参数'})
 
     cmd_str = f"CTRL:{car_id},TARGET:{position.get('x', 0):.2f},{position.get('y', 0):.2f},{heading:.1f}"
-    success = udp_server.send_to_car_reliable(car_id, cmd_str, max_retries=4)
+    command = udp_server.send_command(car_id, cmd_str, max_retries=4)
 
-    if success:
-        return jsonify({'success': True, 'message': f'导航指令已发送到小车 {car_id}'})
-    else:
+    if command is None:
         return jsonify({'success': False, 'error': f'小车 {car_id} 未连接'})
 
+    # 开启确认的小车等待确认，返回投递延迟
+    if command.ack_required:
+        udp_server.commands.wait([command], COMMAND_ACK_WAIT)
+    return jsonify({'success': True, 'message': f'导航指令已发送到小车 {car_id}',
+                    'command': command.result()})
+
+
+@app.route('/api/commands')
+def get_command_stats():
+    """指令通道统计：确认数、重传数、超时数、确认延迟和最近的指令结果"""
+    return jsonify(udp_server.commands.stats())
+
+
+@app.route('/api/recorder', methods=['GET', 'POST'])
+def datagram_recorder():
+    """
+    数据报记录：GET 查看状态；POST {"enabled": true, "path": "recordings/xxx.dglog"} 开始，
+    {"enabled": false} 停止。日志可用 replay_datagrams.py 回放
+    """
+    if request.method == 'GET':
+        recorder = udp_server.recorder
+        return jsonify({'recording': recorder is not None, **(recorder.stats() if recorder else {})})
+
+    data = request.json or {}
+    if not data.get('enabled', True):
+        stats = udp_server.stop_recording()
+        return jsonify({'success': True, 'recording': False, **(stats or {})})
+
+    path = data.get('path') or os.path.join(RECORD_DIR, time.strftime("%Y%m%d-%H%M%S") + ".dglog")
+    try:
+        recorder = udp_server.start_recording(path)
+    except OSError as e:
+        return jsonify({'success': False, 'error': f'无法创建日志文件: {e}'}), 400
+    return jsonify({'success': True, 'recording': True, **recorder.stats()})
+
+
+@app.route('/api/jobs')
+def list_jobs():
+    """最近的指令分发任务"""
+    return jsonify({'jobs': [job.to_dict() for job in udp_server.dispatcher.recent()]})
+
+
+@app.route('/api/jobs/<int:job_id>')
+def get_job(job_id):
+    """分发任务状态：各阶段发送/确认数量、首末车时间差，以及每条指令的结果"""
+    job = udp_server.dispatcher.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'任务 {job_id} 不存在'}), 404
+    return jsonify({'success': True, **job.to_dict(details=True)})
+
+
+@app.route('/api/commands/config', methods=['POST'])
+def set_command_config():
+    """
+    配置指令确认：{"ack_mode": "on" 或 "off", "ack_cars": ["CAR1", ...]}
+    off 时只有 ack_cars 中的小车（已支持确认的固件）附加序列号
+    """
+    data = request.json
+    ack_mode = data.get('ack_mode', udp_server.commands.ack_mode)
+    ack_cars = data.get('ack_cars')
+
+    if ack_mode not in ("on", "off"):
+        return jsonify({'success': False, 'error': '确认模式必须为 on 或 off'})
+    if ack_cars is not None and not isinstance(ack_cars, list):
+        return jsonify({'success': False, 'error': 'ack_cars 必须是小车ID列表'})
+
+    udp_server.commands.ack_mode = ack_mode
+    if ack_cars is not None:
+        udp_server.commands.ack_cars = set(ack_cars)
+    log.info("📨 指令确认模式: %s, 确认小车: %s", ack_mode, sorted(udp_server.commands.ack_cars))
+
+    return jsonify({
+        'success': True,
+        'ack_mode': ack_mode,
+        'ack_cars': sorted(udp_server.commands.ack_cars)
+    })
+
 
 # 拓扑相关API - 使用广播发送
 @app.route('/api/topology', methods=['POST'])
 def set_topology():
-    global communication_topology, topology_enabled
+    """
+    设置通信拓扑，支持两种格式：
+    {"topology": NxN矩阵, "car_ids": [...可选，默认 CAR1..CARN]} 或 {"adjacency": {"CAR1": ["CAR2", ...]}}
+    """
+    global topology_enabled
 
     data = request.json
     topology_matrix = data.get('topology')
+    adjacency = data.get('adjacency')
     enable = data.get('enable', False)
 
-    if topology_matrix:
-        if (isinstance(topology_matrix, list) and len(topology_matrix) == 4 and
-                all(isinstance(row, list) and len(row) == 4 for row in topology_matrix)):
-            communication_topology = topology_matrix
-            topology_enabled = enable
-            update_topology_cache()
-
-            # 将拓扑矩阵转换为紧凑的字符串格式：1,1,1,1;1,0,1,0;1,1,0,1;1,0,1,0
-            topology_str = ';'.join(','.join(str(cell) for cell in row) for row in communication_topology)
-
-            # 使用广播发送拓扑指令（重复5次）
-            topology_cmd = f"TOPOLOGY:{topology_str}"
-            success = udp_server.broadcast_global_command(topology_cmd)
-
-            print(f"✅ 通信拓扑已更新: {communication_topology}")
-            print(f"📤 发送拓扑指令: {topology_cmd}")
-
-            return jsonify({
-                'success': True,
-                'message': f'通信拓扑已{"启用" if enable else "禁用"}',
-                'topology': communication_topology,
-                'topology_enabled': topology_enabled,
-                'broadcast_success': success,
-                'topology_string': topology_str
-            })
+    if not topology_matrix and not adjacency:
+        return jsonify({'success': False, 'error': '缺少拓扑矩阵或邻接表'})
+
+    try:
+        if topology_matrix:
+            if not (isinstance(topology_matrix, list) and
+                    all(isinstance(row, list) for row in topology_matrix)):
+                raise ValueError("拓扑矩阵必须是二维列表")
+            graph = Topology.from_matrix(topology_matrix, data.get('car_ids'))
         else:
-            return jsonify({'success': False, 'error': '无效的拓扑矩阵格式'})
+            if not isinstance(adjacency, dict):
+                raise ValueError("邻接表必须是 {小车ID: [可见小车ID]} 格式")
+            graph = Topology.from_adjacency(adjacency)
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': f'无效的拓扑格式: {e}'})
+
+    topology_enabled = enable
+    update_topology_cache(graph)
+
+    topology_str = None
+    success = False
+    if communication_topology is not None and graph.ids == default_car_ids(len(graph.ids)):
+        # 将拓扑矩阵转换为紧凑的字符串格式：1,1,1,1;1,0,1,0;1,1,0,1;1,0,1,0
+        topology_str = ';'.join(','.join(str(cell) for cell in row) for row in communication_topology)
+
+        # 使用广播发送拓扑指令（重复5次）
+        topology_cmd = f"TOPOLOGY:{topology_str}"
+        success = udp_server.broadcast_global_command(topology_cmd)
+        log.info("📤 发送拓扑指令: %s", topology_cmd)
     else:
-        return jsonify({'success': False, 'error': '缺少拓扑矩阵'})
+        # 小车固件只认识 CAR1..CARN 的矩阵，其它情况由服务器按拓扑分发
+        log.info("📤 拓扑规模为 %d 辆小车，不下发 TOPOLOGY 指令，由服务器按拓扑分发", len(graph.ids))
 
+    notify_dashboard('topology', get_topology_status_data())
 
-@app.route('/api/topology/status')
-def get_topology_status():
     return jsonify({
+        'success': True,
+        'message': f'通信拓扑已{"启用" if enable else "禁用"}',
         'topology': communication_topology,
-        'topology_enabled': topology_enabled
+        'car_ids': graph.ids,
+        'edge_count': graph.edge_count(),
+        'topology_enabled': topology_enabled,
+        'broadcast_success': success,
+        'topology_string': topology_str
+    })
+
+
+@app.route('/api/topology/edges', methods=['POST'])
+def update_topology_edges():
+    """
+    增量修改可见关系：{"edges": [[target, other, 1或0], ...]}
+    在当前拓扑的副本上修改后整体替换，不影响正在进行的分发
+    """
+    data = request.json
+    edges = data.get('edges')
+    if not isinstance(edges, list) or not edges:
+        return jsonify({'success': False, 'error': '缺少 edges 列表'})
+
+    graph = topology_graph.copy()
+    try:
+        for target, other, visible in edges:
+            graph.set_edge(str(target), str(other), bool(visible))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'edges 中每项必须为 [target, other, 1或0]'})
+
+    update_topology_cache(graph)
+    notify_dashboard('topology', get_topology_status_data())
+
+    return jsonify({
+        'success': True,
+        'updated_edges': len(edges),
+        'car_ids': graph.ids,
+        'edge_count': graph.edge_count()
     })
 
 
+@app.route('/api/topology/status')
+def get_topology_status():
+    return jsonify(get_topology_status_data())
+
+
 @app.route('/api/topology/toggle', methods=['POST'])
 def toggle_topology():
     global topology_enabled
@@ -742,7 +1996,8 @@ def toggle_topology():
     toggle_cmd = f"TOPOLOGY_TOGGLE:{enable}"
     broadcast_success = udp_server.broadcast_global_command(toggle_cmd)
 
-    print(f"🔗 拓扑通信 {status}")
+    log.info("🔗 拓扑通信 %s", status)
+    notify_dashboard('topology', get_topology_status_data())
 
     return jsonify({
         'success': True,
@@ -789,6 +2044,9 @@ def get_network_info():
 
 
 if __name__ == '__main__':
+    # 日志在后台线程输出，热路径只入队
+    setup_logging()
+
     # 显示网络信息
     get_network_info()
 
@@ -798,10 +2056,18 @@ if __name__ == '__main__':
         print("✅ UDP服务器启动成功")
 
         # 初始化编队控制器
-        init_formation_controller(cars, udp_server)
+        init_formation_controller(cars, udp_server, notify_dashboard)
+
+        if RECORD_PATH:
+            udp_server.start_recording(RECORD_PATH)
+            print(f"⏺️ 记录数据报到 {RECORD_PATH}")
+
+        # 启动仪表盘推送
+        socketio.start_background_task(dashboard_push_loop)
 
         print(f"📡 广播频率: {1 / broadcast_interval:.0f}Hz ({broadcast_interval * 1000:.0f}ms间隔)")
-        print(f"📡 广播分组大小: 每组最多 {broadcast_group_size} 辆小车")
+        print(f"📡 广播装帧: 每帧最多 {broadcast_payload_budget} 字节"
+              + (f"，最多 {broadcast_group_size} 辆小车" if broadcast_group_size else ""))
         print(f"📢 使用子网广播地址，端口: {BROADCAST_PORT}")
         print("💡 全局指令使用广播重复5次，特定指令使用单播重复4次")
 
@@ -809,7 +2075,9 @@ if __name__ == '__main__':
         print(f"🌐 服务器本地IP地址: {local_ip}")
         print(f"💡 请确保小车配置中的SERVER_IP设置为: {local_ip}")
         print(f"💡 访问 http://{local_ip}:{WEB_PORT} 打开控制界面")
+        print(f"📡 仪表盘推送间隔: {push_interval * 1000:.0f}ms")
 
-        app.run(host='0.0.0.0', port=WEB_PORT, debug=False, use_reloader=False, threaded=True)
+        socketio.run(app, host='0.0.0.0', port=WEB_PORT, debug=False, use_reloader=False,
+                     allow_unsafe_werkzeug=True)
     else:
         print("❌ UDP服务器启动失败")
\ No newline at end of file